@@ -0,0 +1,243 @@
+import logging
+import uuid
+from typing import Optional
+
+from celery import chain, chord
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT_KEY = "ultralytics_in_flight"
+
+
+def get_queue_worker_n(queue_name: str, refresh: bool = False) -> int:
+    """
+    Get the number of workers consuming a queue. Asking the workers is a broadcast that waits for them to
+    reply, so the answer is cached for ULTRALYTICS_QUEUE_CACHE_SECONDS.
+
+    Args:
+        queue_name (str): name of the queue
+        refresh (bool, optional): ask the workers, even if the answer is cached. Defaults to False.
+
+    Returns:
+        int: number of workers consuming the queue
+    """
+    from .tasks import ai_app
+
+    cache_key = f"queue_worker_n_{queue_name}"
+    worker_n = None if refresh else cache.get(cache_key)
+    if worker_n is None:
+        active_queues = ai_app.control.inspect().active_queues() or {}
+        worker_n = len([worker for worker, queues in active_queues.items()
+                        if queue_name in [x['name'] for x in queues]])
+        cache.set(cache_key, worker_n,
+                  settings.ULTRALYTICS_QUEUE_CACHE_SECONDS)
+    return worker_n
+
+
+def change_in_flight(key: str, delta: int) -> int:
+    """
+    Change a count of inference chunks in flight. The count expires if no chunks are admitted for
+    ULTRALYTICS_CHUNK_TIMEOUT, so chunks whose results never arrive are not counted forever.
+
+    Args:
+        key (str): cache key of the count
+        delta (int): change in the count
+
+    Returns:
+        int: the new count
+    """
+    cache.add(key, 0, settings.ULTRALYTICS_CHUNK_TIMEOUT)
+    try:
+        in_flight = cache.incr(key, delta)
+    except ValueError:
+        # Expired since it was added
+        in_flight = max(delta, 0)
+        cache.set(key, in_flight, settings.ULTRALYTICS_CHUNK_TIMEOUT)
+    if in_flight < 0:
+        in_flight = 0
+        cache.set(key, in_flight, settings.ULTRALYTICS_CHUNK_TIMEOUT)
+    cache.touch(key, settings.ULTRALYTICS_CHUNK_TIMEOUT)
+    return in_flight
+
+
+def start_ultra_dispatch(datafile_pks: list[int], model_name: str, target_labels: Optional[list[str]],
+                         chunksize: int, chunksize2: int, parallel: bool,
+                         preprocess_size: Optional[int] = None) -> str:
+    """
+    Record the files to be analysed, so that they can be dispatched to the workers as they have capacity.
+    The pks are stored once under their own key, and only a cursor into them is updated as chunks are dispatched.
+
+    Args:
+        datafile_pks (list[int]): pks of the files to analyse
+        model_name (str): name of the model to run
+        target_labels (Optional[list[str]]): labels to keep
+        chunksize (int): number of files in each chunk
+        chunksize2 (int): number of files in each job of a chunk
+        parallel (bool): if False, only one chunk of these files is in flight at a time
+        preprocess_size (Optional[int], optional): if set, images are letterboxed to this size before being
+        sent to the worker. Defaults to None.
+
+    Returns:
+        str: id of the dispatch
+    """
+    dispatch_id = uuid.uuid4().hex
+    state_key = f"ultralytics_dispatch_{dispatch_id}"
+    cache.set(f"{state_key}_pks", sorted(datafile_pks),
+              settings.ULTRALYTICS_DISPATCH_TIMEOUT)
+    cache.set(state_key,
+              {"file_n": len(datafile_pks),
+               "cursor": 0,
+               "model_name": model_name,
+               "target_labels": target_labels,
+               "chunksize": chunksize,
+               "chunksize2": chunksize2,
+               "parallel": parallel,
+               "preprocess_size": preprocess_size},
+              settings.ULTRALYTICS_DISPATCH_TIMEOUT)
+    logger.info(
+        f"Inference dispatch {dispatch_id}: {len(datafile_pks)} files with {model_name}")
+    return dispatch_id
+
+
+def dispatch_ultra_chunks(dispatch_id: str) -> Optional[int]:
+    """
+    Submit chunks of files to the ultralytics workers, while they have capacity.
+
+    Args:
+        dispatch_id (str): id of the dispatch
+
+    Returns:
+        Optional[int]: seconds after which to try again if the workers are at capacity, otherwise None
+    """
+    from data_models.models import DataFile
+
+    state_key = f"ultralytics_dispatch_{dispatch_id}"
+    pks_key = f"{state_key}_pks"
+    dispatch_in_flight_key = f"{IN_FLIGHT_KEY}_{dispatch_id}"
+    lock_key = f"{state_key}_lock"
+
+    # Only one dispatcher should move the cursor at a time
+    if not cache.add(lock_key, 1, 60):
+        return settings.ULTRALYTICS_DISPATCH_RETRY_SECONDS
+    try:
+        state = cache.get(state_key)
+        if state is None:
+            logger.info(f"Inference dispatch {dispatch_id}: not found")
+            return None
+
+        capacity = get_queue_worker_n(settings.ULTRALYTICS_QUEUE) * settings.ULTRALYTICS_CHUNKS_PER_WORKER - \
+            (cache.get(IN_FLIGHT_KEY) or 0)
+        if not state["parallel"]:
+            capacity = min(capacity, 1 - (cache.get(dispatch_in_flight_key) or 0))
+
+        # The pks are only read if there is capacity to dispatch them
+        datafile_pks = cache.get(pks_key) if capacity > 0 else None
+        if capacity > 0 and datafile_pks is None:
+            logger.info(f"Inference dispatch {dispatch_id}: files not found")
+            cache.delete(state_key)
+            return None
+
+        while capacity > 0 and state["cursor"] < state["file_n"]:
+            chunk_pks = datafile_pks[state["cursor"]:state["cursor"] + state["chunksize"]]
+            file_values = DataFile.objects.filter(pk__in=chunk_pks).full_paths().order_by(
+                "pk").values_list("pk", "full_path", "recording_dt")
+            chunk_files = [[file_pk, full_path, recording_dt.isoformat() if recording_dt is not None else None]
+                           for file_pk, full_path, recording_dt in file_values]
+
+            # Only the small state is rewritten, not the pks
+            state["cursor"] += len(chunk_pks)
+            cache.set(state_key, state, settings.ULTRALYTICS_DISPATCH_TIMEOUT)
+            if len(chunk_files) == 0:
+                continue
+
+            change_in_flight(IN_FLIGHT_KEY, 1)
+            change_in_flight(dispatch_in_flight_key, 1)
+            submit_ultra_chunk(dispatch_id, chunk_files, state["model_name"],
+                               state["target_labels"], state["chunksize2"], state.get("preprocess_size"))
+            capacity -= 1
+
+        remaining_n = state["file_n"] - state["cursor"]
+        if remaining_n == 0:
+            if (cache.get(dispatch_in_flight_key) or 0) == 0:
+                logger.info(f"Inference dispatch {dispatch_id}: complete")
+                cache.delete_many([state_key, pks_key, dispatch_in_flight_key])
+            # Chunks still in flight dispatch again when they finish
+            return None
+
+        logger.info(
+            f"Inference dispatch {dispatch_id}: {remaining_n} files waiting for capacity")
+        return settings.ULTRALYTICS_DISPATCH_RETRY_SECONDS
+    finally:
+        cache.delete(lock_key)
+
+
+def submit_ultra_chunk(dispatch_id: str, chunk_files: list, model_name: str,
+                       target_labels: Optional[list[str]], chunksize2: int, preprocess_size: Optional[int] = None):
+    """
+    Submit a chunk of files to the ultralytics worker, in jobs of chunksize2 files, with a callback to save
+    the results.
+    By default, the worker receives the path of each file, and returns results keyed by file name.
+    If ULTRALYTICS_FILE_IDENTITIES is set, the worker instead receives a list of the pk, path and recording
+    datetime of each file, and returns results keyed by pk. The worker must be updated to accept these lists
+    before the setting is turned on.
+    If the images are also preprocessed, each file's list ends with the path of its letterboxed array. The
+    worker should load it with `np.load(mmap_mode="r")`, and read the image itself if the array does not exist.
+
+    Args:
+        dispatch_id (str): id of the dispatch
+        chunk_files (list): pk, full path and recording datetime of each file in the chunk
+        model_name (str): name of the model to run
+        target_labels (Optional[list[str]]): labels to keep
+        chunksize2 (int): number of files in each job
+        preprocess_size (Optional[int], optional): if set, images are letterboxed to this size before being
+        sent to the worker. Defaults to None.
+    """
+    from .preprocess_functions import get_preprocessed_path
+    from .tasks import (ai_app, finish_ultra_chunk_task, handle_ultra_results,
+                        preprocess_images_task)
+
+    if not settings.ULTRALYTICS_FILE_IDENTITIES:
+        # Workers that only take paths cannot use preprocessed arrays
+        worker_files = [x[1] for x in chunk_files]
+        preprocess_size = None
+    elif preprocess_size is not None:
+        worker_files = [x + [get_preprocessed_path(x[1], preprocess_size)]
+                        for x in chunk_files]
+    else:
+        worker_files = chunk_files
+
+    all_tasks = []
+    for i in range(0, len(worker_files), chunksize2):
+        all_tasks.append(ai_app.signature('AnalysisTask', [
+            worker_files[i:i + chunksize2], model_name, target_labels],
+            queue=settings.ULTRALYTICS_QUEUE, immutable=True))
+
+    # Free the chunk's capacity, even if the worker fails
+    error_callback = finish_ultra_chunk_task.si(
+        dispatch_id).set(queue="main_worker")
+    callback = handle_ultra_results.s(
+        target_labels, chunk_files, dispatch_id).set(queue="main_worker").on_error(error_callback)
+    task_chord = chord(all_tasks, callback)
+
+    if preprocess_size is not None:
+        preprocess_task = preprocess_images_task.si(
+            [x[0] for x in chunk_files], preprocess_size).set(queue="main_worker").on_error(error_callback)
+        chain(preprocess_task, task_chord).apply_async()
+    else:
+        task_chord.apply_async()
+
+
+def finish_ultra_chunk(dispatch_id: str):
+    """
+    Stop counting a chunk as in flight, and dispatch more chunks into its capacity.
+
+    Args:
+        dispatch_id (str): id of the dispatch
+    """
+    from .tasks import dispatch_ultra_inference_task
+
+    change_in_flight(IN_FLIGHT_KEY, -1)
+    change_in_flight(f"{IN_FLIGHT_KEY}_{dispatch_id}", -1)
+    dispatch_ultra_inference_task.apply_async([dispatch_id])
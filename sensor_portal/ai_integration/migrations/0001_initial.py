@@ -0,0 +1,26 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('data_models', '0037_datatype_archive_compressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreprocessedImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('image_size', models.IntegerField()),
+                ('size', models.BigIntegerField(default=0)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('data_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preprocessed_image', to='data_models.datafile')),
+            ],
+        ),
+    ]
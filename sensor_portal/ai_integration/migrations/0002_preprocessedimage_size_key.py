@@ -0,0 +1,37 @@
+import os
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def remove_unsized_preprocessed_images(apps, schema_editor):
+    """
+    Arrays made before the size was part of their name are not found by the model runners, so remove them.
+    They are made again at the next preprocessing.
+    """
+    PreprocessedImage = apps.get_model("ai_integration", "PreprocessedImage")
+    for preprocessed_path in PreprocessedImage.objects.values_list("path", flat=True).iterator():
+        if preprocessed_path.endswith("_LETTERBOX.npy") and os.path.exists(preprocessed_path):
+            os.remove(preprocessed_path)
+    PreprocessedImage.objects.filter(path__endswith="_LETTERBOX.npy").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_integration', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_unsized_preprocessed_images,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='preprocessedimage',
+            name='data_file',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preprocessed_images', to='data_models.datafile'),
+        ),
+        migrations.AddConstraint(
+            model_name='preprocessedimage',
+            constraint=models.UniqueConstraint(fields=('data_file', 'image_size'), name='unique_preprocessed_image_size'),
+        ),
+    ]
@@ -0,0 +1,343 @@
+import ast
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import QuerySet
+from PIL import Image
+
+from .preprocess_functions import get_preprocessed_path, letterbox_image
+from .result_functions import save_ultra_results
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRunner():
+    """
+    Base class for running a detection model in this process.
+    Subclasses implement `predict`, which runs the model over a batch of letterboxed images.
+    """
+
+    name = "default"
+    # Width and height in pixels of the letterboxed images the model takes
+    image_size = 640
+    # Largest number of images the model can take at once
+    max_batch_size = None
+
+    def predict(self, images: np.ndarray, orig_shapes: list[tuple[int, int]]) -> list[list[dict]]:
+        """
+        Run the model over a batch of images.
+
+        Args:
+            images (np.ndarray): uint8 RGB images of shape (n, image_size, image_size, 3), letterboxed with
+            `preprocess_functions.letterbox_image`
+            orig_shapes (list[tuple[int, int]]): height and width of each image before letterboxing
+
+        Returns:
+            list[list[dict]]: detections of each image, with "prediction", "confidence", "bbox" (x1, y1, x2, y2
+            in pixels of the original image) and "orig_shape", as returned by the ultralytics worker
+        """
+        raise NotImplementedError()
+
+
+class StubModelRunner(ModelRunner):
+    """
+    Model that does not need any model weights, for tests and for benchmarking everything but the model.
+    Detects a single object covering the central quarter of any image that is not blank.
+    """
+
+    name = "stub"
+    image_size = 64
+
+    def predict(self, images: np.ndarray, orig_shapes: list[tuple[int, int]]) -> list[list[dict]]:
+        all_results = []
+        for image, (height, width) in zip(images, orig_shapes):
+            if image.std() == 0:
+                all_results.append([])
+                continue
+            all_results.append([{"prediction": "stub",
+                                 "confidence": 1.0,
+                                 "bbox": [width / 4, height / 4, width * 3 / 4, height * 3 / 4],
+                                 "orig_shape": [height, width]}])
+        return all_results
+
+
+class OnnxModelRunner(ModelRunner):
+    """
+    Ultralytics YOLO detection model exported to ONNX, run on the CPU with ONNX Runtime.
+    The model is read from AI_LOCAL_MODEL_ROOT/<model_name>.onnx.
+    ONNX Runtime is an optional dependency, and must be installed to use this runner.
+    """
+
+    confidence_threshold = 0.25
+    iou_threshold = 0.7
+    # Boxes of different classes are offset by this much, so they are suppressed separately
+    class_offset = 7680
+
+    def __init__(self, model_name: str):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                "onnxruntime must be installed to run ONNX models locally") from e
+
+        self.name = model_name
+        model_path = os.path.join(
+            settings.AI_LOCAL_MODEL_ROOT, f"{model_name}.onnx")
+        session_options = onnxruntime.SessionOptions()
+        # Images are run in parallel threads, so each run uses one core
+        session_options.intra_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.image_size = model_input.shape[2]
+        if isinstance(model_input.shape[0], int):
+            # Exported without a dynamic batch size
+            self.max_batch_size = model_input.shape[0]
+
+        # Ultralytics stores the class names in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.class_names = ast.literal_eval(metadata.get("names", "{}"))
+
+    def predict(self, images: np.ndarray, orig_shapes: list[tuple[int, int]]) -> list[list[dict]]:
+        # NHWC uint8 to NCHW float
+        model_input = np.ascontiguousarray(
+            images.transpose(0, 3, 1, 2), dtype=np.float32) / 255
+        if self.max_batch_size is not None and len(model_input) < self.max_batch_size:
+            # A model with a fixed batch size needs a full batch, the padding results are then dropped
+            model_input = np.concatenate([model_input, np.zeros(
+                (self.max_batch_size - len(model_input),) + model_input.shape[1:], dtype=np.float32)])
+        outputs = self.session.run(None, {self.input_name: model_input})[0]
+
+        return [self.postprocess(output, orig_shape) for output, orig_shape in zip(outputs, orig_shapes)]
+
+    def postprocess(self, output: np.ndarray, orig_shape: tuple[int, int]) -> list[dict]:
+        """
+        Convert the raw output of a YOLO model for one image to detections.
+
+        Args:
+            output (np.ndarray): output of shape (4 + number of classes, number of candidate boxes)
+            orig_shape (tuple[int, int]): height and width of the image before letterboxing
+
+        Returns:
+            list[dict]: detections
+        """
+        output = output.T
+        class_scores = output[:, 4:]
+        class_idxs = class_scores.argmax(axis=1)
+        confidences = class_scores[np.arange(len(class_idxs)), class_idxs]
+        keep = confidences > self.confidence_threshold
+        if not keep.any():
+            return []
+
+        # Centre x, centre y, width, height to corners
+        xywh = output[keep, :4]
+        boxes = np.concatenate(
+            [xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        class_idxs = class_idxs[keep]
+        confidences = confidences[keep]
+
+        keep = non_max_suppression(
+            boxes + (class_idxs * self.class_offset)[:, None], confidences, self.iou_threshold)
+        boxes = unletterbox_boxes(boxes[keep], orig_shape, self.image_size)
+
+        return [{"prediction": self.class_names.get(int(class_idx), str(class_idx)),
+                 "confidence": float(confidence),
+                 "bbox": box.tolist(),
+                 "orig_shape": list(orig_shape)}
+                for box, class_idx, confidence in zip(boxes, class_idxs[keep], confidences[keep])]
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Select the highest scoring boxes, removing boxes that overlap them.
+
+    Args:
+        boxes (np.ndarray): boxes of shape (n, 4) as x1, y1, x2, y2
+        scores (np.ndarray): score of each box
+        iou_threshold (float): boxes that overlap a selected box by more than this are removed
+
+    Returns:
+        np.ndarray: indices of the selected boxes, in order of score
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while len(order) > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        overlap_width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) -
+                                np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        overlap_height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) -
+                                 np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        intersection = overlap_width * overlap_height
+        iou = intersection / (areas[best] + areas[rest] - intersection)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
+def unletterbox_boxes(boxes: np.ndarray, orig_shape: tuple[int, int], image_size: int) -> np.ndarray:
+    """
+    Convert boxes in a letterboxed image to pixels of the original image.
+
+    Args:
+        boxes (np.ndarray): boxes of shape (n, 4) as x1, y1, x2, y2
+        orig_shape (tuple[int, int]): height and width of the original image
+        image_size (int): width and height of the letterboxed image
+
+    Returns:
+        np.ndarray: boxes in the original image
+    """
+    height, width = orig_shape
+    scale = min(image_size / width, image_size / height)
+    pad_x = (image_size - round(width * scale)) // 2
+    pad_y = (image_size - round(height * scale)) // 2
+    boxes = (boxes - np.array([pad_x, pad_y, pad_x, pad_y])) / scale
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes
+
+
+# Runners that do not need a model file
+MODEL_RUNNERS = {StubModelRunner.name: StubModelRunner}
+
+
+def get_model_runner(model_name: str) -> ModelRunner:
+    """
+    Get a runner for a model, which is an ONNX model unless it is a named runner.
+
+    Args:
+        model_name (str): name of the model
+
+    Returns:
+        ModelRunner: runner of the model
+    """
+    if model_name in MODEL_RUNNERS:
+        return MODEL_RUNNERS[model_name]()
+    return OnnxModelRunner(model_name)
+
+
+def load_model_input(full_path: str, image_size: int) -> tuple[np.ndarray, tuple[int, int]]:
+    """
+    Get the letterboxed image to run a model over, from its preprocessed array if there is one.
+
+    Args:
+        full_path (str): path of the image
+        image_size (int): width and height of the letterboxed image in pixels
+
+    Returns:
+        tuple[np.ndarray, tuple[int, int]]: letterboxed image, and height and width of the original image
+    """
+    with Image.open(full_path) as image:
+        # Only reads the header
+        width, height = image.size
+        # Rotated by 90 degrees when letterboxed
+        if image.getexif().get(0x0112) in [5, 6, 7, 8]:
+            width, height = height, width
+
+    preprocessed_path = get_preprocessed_path(full_path, image_size)
+    if os.path.exists(preprocessed_path):
+        letterboxed = np.load(preprocessed_path, mmap_mode="r")
+        if letterboxed.shape[0] == image_size:
+            return letterboxed, (height, width)
+    return letterbox_image(full_path, image_size), (height, width)
+
+
+def predict_batch(runner: ModelRunner, batch_files: list) -> dict[str, list[dict]]:
+    """
+    Run a model over a batch of images.
+
+    Args:
+        runner (ModelRunner): runner of the model
+        batch_files (list): pk and full path of each image
+
+    Returns:
+        dict[str, list[dict]]: detections of each image, keyed by pk. Images that could not be read are left out.
+    """
+    file_keys = []
+    images = []
+    orig_shapes = []
+    for file_pk, full_path in batch_files:
+        try:
+            image, orig_shape = load_model_input(full_path, runner.image_size)
+        except Exception as e:
+            logger.info(f"{full_path}: Error reading image: {repr(e)}")
+            continue
+        file_keys.append(str(file_pk))
+        images.append(image)
+        orig_shapes.append(orig_shape)
+
+    if len(images) == 0:
+        return {}
+    all_results = runner.predict(np.stack(images), orig_shapes)
+    return dict(zip(file_keys, all_results))
+
+
+def run_local_inference(file_objs: QuerySet, model_name: str, target_labels: Optional[list[str]] = None,
+                        chunksize: int = 500) -> int:
+    """
+    Run a model over images in this process, rather than on the ultralytics worker.
+    Batches of images are run in parallel threads, and the results of each chunk of images are saved as they
+    finish, in the same way as the results of the worker.
+
+    Args:
+        file_objs (QuerySet): DataFile objects of images in local storage
+        model_name (str): name of the model to run, see `get_model_runner`
+        target_labels (Optional[list[str]], optional): labels to keep. Defaults to None, which keeps all.
+        chunksize (int, optional): number of images to save the results of at once. Defaults to 500.
+
+    Returns:
+        int: number of observations created
+    """
+    runner = get_model_runner(model_name)
+    batch_size = runner.max_batch_size or settings.AI_LOCAL_INFERENCE_BATCH_SIZE
+    file_values = file_objs.filter(local_storage=True).full_paths().order_by(
+        "pk").values_list("pk", "full_path", "recording_dt")
+
+    n_observations = 0
+    # ONNX Runtime and numpy release the GIL while running, so threads use multiple cores
+    with ThreadPoolExecutor(max_workers=settings.AI_LOCAL_INFERENCE_THREADS) as executor:
+        chunk_files = []
+        for file_pk, full_path, recording_dt in file_values.iterator(chunk_size=chunksize):
+            chunk_files.append([file_pk, full_path,
+                                recording_dt.isoformat() if recording_dt is not None else None])
+            if len(chunk_files) == chunksize:
+                n_observations += run_local_chunk(
+                    executor, runner, chunk_files, batch_size, target_labels)
+                chunk_files = []
+        if len(chunk_files) > 0:
+            n_observations += run_local_chunk(
+                executor, runner, chunk_files, batch_size, target_labels)
+
+    return n_observations
+
+
+def run_local_chunk(executor: ThreadPoolExecutor, runner: ModelRunner, chunk_files: list, batch_size: int,
+                    target_labels: Optional[list[str]]) -> int:
+    """
+    Run a model over a chunk of images in batches, and save the results.
+
+    Args:
+        executor (ThreadPoolExecutor): pool to run the batches in
+        runner (ModelRunner): runner of the model
+        chunk_files (list): pk, full path and recording datetime of each image
+        batch_size (int): number of images in each batch
+        target_labels (Optional[list[str]]): labels to keep
+
+    Returns:
+        int: number of observations created
+    """
+    batches = [[x[:2] for x in chunk_files[i:i + batch_size]]
+               for i in range(0, len(chunk_files), batch_size)]
+    file_results = {}
+    for batch_results in executor.map(predict_batch, [runner] * len(batches), batches):
+        file_results.update(batch_results)
+    logger.info(f"{runner.name}: ran over {len(file_results)} images")
+
+    return save_ultra_results([{"source": runner.name, "files": file_results}], target_labels, chunk_files)
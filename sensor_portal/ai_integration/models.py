@@ -0,0 +1,35 @@
+from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone as djtimezone
+from utils.general import try_remove_file_clean_dirs
+
+
+class PreprocessedImage(models.Model):
+    """
+    Resized and letterboxed copy of an image, stored as a .npy array next to the image, so that it does not
+    need to be decoded again each time a model is run over it.
+    """
+    data_file = models.ForeignKey(
+        "data_models.DataFile", related_name="preprocessed_images", on_delete=models.CASCADE)
+    path = models.CharField(max_length=500)
+    # Width and height in pixels of the letterboxed image
+    image_size = models.IntegerField()
+    # Size in bytes of the array file
+    size = models.BigIntegerField(default=0)
+    last_used = models.DateTimeField(default=djtimezone.now, db_index=True)
+
+    class Meta:
+        # One array per image per size, so that models with different input sizes do not replace each other's arrays
+        constraints = [
+            models.UniqueConstraint(
+                fields=["data_file", "image_size"], name="unique_preprocessed_image_size"),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+@receiver(post_delete, sender=PreprocessedImage)
+def post_remove_preprocessed_image(sender, instance: PreprocessedImage, **kwargs):
+    try_remove_file_clean_dirs(instance.path)
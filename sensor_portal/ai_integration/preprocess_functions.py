@@ -0,0 +1,178 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import QuerySet, Sum
+from django.utils import timezone as djtimezone
+from PIL import Image, ImageOps
+
+from .models import PreprocessedImage
+
+logger = logging.getLogger(__name__)
+
+# Value of the padding added when letterboxing, as used by ultralytics
+LETTERBOX_PAD_VALUE = 114
+
+
+def get_preprocessed_path(full_path: str, image_size: int) -> str:
+    """
+    Path of the preprocessed array of an image at a size, next to its thumbnail.
+    The size is part of the name, so that arrays for models with different input sizes are kept side by side.
+
+    Args:
+        full_path (str): path of the image
+        image_size (int): width and height of the letterboxed image in pixels
+
+    Returns:
+        str: path of the .npy array
+    """
+    file_dir, file_name = os.path.split(full_path)
+    return os.path.join(file_dir, os.path.splitext(file_name)[0]+f"_LETTERBOX_{image_size}.npy")
+
+
+def letterbox_image(image_path: str, image_size: int) -> np.ndarray:
+    """
+    Resize an image to fit in a square, keeping its aspect ratio, and pad the rest of the square.
+    The image is scaled by min(image_size / width, image_size / height) and centred.
+
+    Args:
+        image_path (str): path of the image
+        image_size (int): width and height of the square in pixels
+
+    Returns:
+        np.ndarray: RGB image of shape (image_size, image_size, 3)
+    """
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        scale = min(image_size / image.width, image_size / image.height)
+        new_width = round(image.width * scale)
+        new_height = round(image.height * scale)
+        resized_image = image.resize(
+            (new_width, new_height), Image.Resampling.BILINEAR)
+
+    letterboxed = np.full((image_size, image_size, 3),
+                          LETTERBOX_PAD_VALUE, dtype=np.uint8)
+    top = (image_size - new_height) // 2
+    left = (image_size - new_width) // 2
+    letterboxed[top:top + new_height,
+                left:left + new_width] = np.asarray(resized_image)
+    return letterboxed
+
+
+def make_preprocessed_image(full_path: str, preprocessed_path: str, image_size: int) -> Optional[int]:
+    """
+    Letterbox an image and save it as an array, which can be memory-mapped with `np.load(mmap_mode="r")`.
+
+    Args:
+        full_path (str): path of the image
+        preprocessed_path (str): path to save the array to
+        image_size (int): width and height of the letterboxed image in pixels
+
+    Returns:
+        Optional[int]: size of the array file in bytes, or None if the image could not be preprocessed
+    """
+    try:
+        letterboxed = letterbox_image(full_path, image_size)
+        # Write to a partial file, so a reader never sees a truncated array
+        partial_path = preprocessed_path+".part"
+        with open(partial_path, "wb") as f:
+            np.save(f, letterboxed)
+        os.replace(partial_path, preprocessed_path)
+        return os.path.getsize(preprocessed_path)
+    except Exception as e:
+        logger.info(f"{full_path}: Error preprocessing image: {repr(e)}")
+        return None
+
+
+def preprocess_images(file_objs: QuerySet, image_size: int = settings.AI_PREPROCESS_IMAGE_SIZE) -> int:
+    """
+    Make preprocessed arrays of images that do not have one of this size, in parallel, and mark those that
+    do as used.
+
+    Args:
+        file_objs (QuerySet): DataFile objects of images in local storage
+        image_size (int, optional): width and height of the letterboxed images in pixels.
+        Defaults to settings.AI_PREPROCESS_IMAGE_SIZE.
+
+    Returns:
+        int: number of images preprocessed
+    """
+    file_objs = file_objs.filter(local_storage=True)
+    now = djtimezone.now()
+
+    existing_image_objs = PreprocessedImage.objects.filter(
+        data_file__in=file_objs, image_size=image_size)
+    existing_file_pks = set()
+    for data_file_pk, preprocessed_path in existing_image_objs.values_list("data_file", "path"):
+        if os.path.exists(preprocessed_path):
+            existing_file_pks.add(data_file_pk)
+    existing_image_objs.filter(
+        data_file__in=existing_file_pks).update(last_used=now)
+
+    to_preprocess = [(file_pk, full_path, get_preprocessed_path(full_path, image_size))
+                     for file_pk, full_path in file_objs.full_paths().values_list("pk", "full_path")
+                     if file_pk not in existing_file_pks]
+    if len(to_preprocess) == 0:
+        return 0
+
+    # PIL and numpy release the GIL while decoding and resizing, so threads use multiple cores
+    with ThreadPoolExecutor(max_workers=settings.AI_PREPROCESS_THREADS) as executor:
+        sizes = executor.map(make_preprocessed_image,
+                             [x[1] for x in to_preprocess],
+                             [x[2] for x in to_preprocess],
+                             [image_size] * len(to_preprocess))
+        new_image_objs = [PreprocessedImage(data_file_id=file_pk,
+                                            path=preprocessed_path,
+                                            image_size=image_size,
+                                            size=size,
+                                            last_used=now)
+                          for (file_pk, full_path, preprocessed_path), size in zip(to_preprocess, sizes)
+                          if size is not None]
+
+    PreprocessedImage.objects.bulk_create(new_image_objs, batch_size=2000,
+                                          update_conflicts=True,
+                                          unique_fields=[
+                                              "data_file", "image_size"],
+                                          update_fields=["path", "size", "last_used"])
+    logger.info(f"Preprocessed {len(new_image_objs)} images")
+    return len(new_image_objs)
+
+
+def evict_preprocessed_images(max_size_gb: float = settings.AI_PREPROCESS_CACHE_MAX_GB) -> int:
+    """
+    Remove the least recently used preprocessed images, until their total size is within the limit.
+    Preprocessed images of files that are no longer in local storage are always removed.
+
+    Args:
+        max_size_gb (float, optional): maximum total size in GB.
+        Defaults to settings.AI_PREPROCESS_CACHE_MAX_GB.
+
+    Returns:
+        int: number of preprocessed images removed
+    """
+    # Deleting sends post_delete, which removes the array files
+    n_removed, _ = PreprocessedImage.objects.filter(
+        data_file__local_storage=False).delete()
+
+    max_size = int(max_size_gb * 1024 * 1024 * 1024)
+    total_size = PreprocessedImage.objects.aggregate(
+        total_size=Sum("size"))["total_size"] or 0
+
+    to_remove_pks = []
+    if total_size > max_size:
+        for image_pk, size in PreprocessedImage.objects.order_by("last_used").values_list("pk", "size").iterator(
+                chunk_size=2000):
+            to_remove_pks.append(image_pk)
+            total_size -= size
+            if total_size <= max_size:
+                break
+
+    for i in range(0, len(to_remove_pks), 2000):
+        n_removed += PreprocessedImage.objects.filter(
+            pk__in=to_remove_pks[i:i + 2000]).delete()[0]
+
+    logger.info(f"Removed {n_removed} preprocessed images")
+    return n_removed
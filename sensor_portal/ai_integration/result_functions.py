@@ -0,0 +1,154 @@
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from data_models.models import DataFile
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from observation_editor.models import Observation, Taxon
+
+logger = logging.getLogger(__name__)
+
+
+def get_taxon_map(species_names: set[str]) -> dict[str, tuple[int, str]]:
+    """
+    Get taxa by species name, creating any that do not exist yet.
+
+    Args:
+        species_names (set[str]): species names to look up
+
+    Returns:
+        dict[str, tuple[int, str]]: pk and taxon code of the taxon of each species name
+    """
+    taxon_map = {}
+    for species_name, taxon_pk, taxon_code in Taxon.objects.filter(
+            species_name__in=species_names).order_by("pk").values_list("species_name", "pk", "taxon_code"):
+        # Keep the first taxon, if there are several with this name
+        taxon_map.setdefault(species_name, (taxon_pk, taxon_code))
+
+    for species_name in species_names - taxon_map.keys():
+        # New taxa are saved one by one, so that their taxon codes are looked up
+        taxon_obj = Taxon.objects.get_or_create(species_name=species_name)[0]
+        taxon_map[species_name] = (taxon_obj.pk, taxon_obj.taxon_code)
+
+    return taxon_map
+
+
+def save_ultra_results(all_results: list[dict], target_labels: Optional[list[str]] = None,
+                       chunk_files: Optional[list] = None) -> int:
+    """
+    Save the results of running a model over files as observations.
+
+    Args:
+        all_results (list[dict]): results of each job, with the model name as "source" and the detections of
+        each file in "files", keyed by pk or file name
+        target_labels (Optional[list[str]], optional): labels to keep. Defaults to None, which keeps all.
+        chunk_files (Optional[list], optional): pk, full path and recording datetime of each file.
+        Defaults to None.
+
+    Returns:
+        int: number of observations created
+    """
+    through_class = Observation.data_files.through
+    if target_labels is not None and type(target_labels) is not list:
+        target_labels = [target_labels]
+
+    # Results are keyed by the pk of each file that was submitted, or by its name if the worker only took paths
+    file_map = {}
+    for file_pk, full_path, recording_dt in chunk_files or []:
+        file_name = os.path.splitext(os.path.basename(full_path))[0]
+        if recording_dt is not None:
+            recording_dt = datetime.fromisoformat(recording_dt)
+        file_map[str(file_pk)] = file_map[file_name] = (
+            file_pk, file_name, recording_dt)
+
+    all_file_keys = set()
+    all_predictions = {"No detection"}
+    for results in all_results:
+        for file_key, file_results in results.get('files').items():
+            all_file_keys.add(file_key)
+            all_predictions.update([result.get('prediction')
+                                   for result in file_results])
+
+    # Results of files that were not submitted in this chunk need the files looking up
+    unknown_file_keys = all_file_keys - file_map.keys()
+    if len(unknown_file_keys) > 0:
+        for file_name, file_pk, recording_dt in DataFile.objects.filter(
+                file_name__in=unknown_file_keys).values_list("file_name", "pk", "recording_dt"):
+            file_map[file_name] = (file_pk, file_name, recording_dt)
+
+    if target_labels is not None:
+        all_predictions = {
+            x for x in all_predictions if x in target_labels or x == "No detection"}
+    taxon_map = get_taxon_map(all_predictions)
+
+    objs_to_create = []
+    file_objs_pks = []
+    file_objs_human_pks = set()
+
+    for results in all_results:
+        source = results.get('source')
+        for file_key, file_results in results.get('files').items():
+            if file_key not in file_map:
+                logger.info(f"{file_key}: file not found")
+                continue
+            file_pk, file_name, recording_dt = file_map[file_key]
+            num_results = 0
+            for result in file_results:
+                prediction = result.get('prediction')
+                if target_labels is None or prediction in target_labels:
+                    num_results += 1
+                    bounding_box = result.get("bbox")
+                    extra_data = {}
+
+                    if bounding_box is not None:
+                        bbox_keys = ["x1", "y1", "x2", "y2"]
+                        bounding_box = {k: v for k, v in zip(
+                            bbox_keys, bounding_box)}
+                    confidence = result.get('confidence')
+                    if result.get('orig_shape') is not None:
+                        extra_data["orig_shape"] = result.get('orig_shape')
+
+                    taxon_pk, taxon_code = taxon_map[prediction]
+
+                    new_observation_object = Observation(
+                        label=f"{prediction}_{file_name}",
+                        taxon_id=taxon_pk,
+                        obs_dt=recording_dt,
+                        bounding_box=bounding_box,
+                        confidence=confidence,
+                        extra_data=extra_data,
+                        source=source
+                    )
+
+                    objs_to_create.append(new_observation_object)
+                    file_objs_pks.append(file_pk)
+                    if taxon_code == settings.HUMAN_TAXON_CODE:
+                        file_objs_human_pks.add(file_pk)
+
+            if num_results == 0:
+                new_observation_object = Observation(
+                    label=f"No_dectection_{file_name}",
+                    taxon_id=taxon_map["No detection"][0],
+                    obs_dt=recording_dt,
+                    extra_data={},
+                    source=source
+                )
+                objs_to_create.append(new_observation_object)
+                file_objs_pks.append(file_pk)
+
+    with transaction.atomic():
+        new_observations = Observation.objects.bulk_create(
+            objs_to_create, batch_size=500)
+        through_class.objects.bulk_create(
+            [through_class(observation_id=obs.pk, datafile_id=file_pk)
+             for obs, file_pk in zip(new_observations, file_objs_pks)],
+            batch_size=500, ignore_conflicts=True)
+    logger.info(f"Created {len(new_observations)} observations")
+    # Update datafiles if human is present
+    DataFile.objects.filter(pk__in=file_objs_human_pks).update(
+        has_human=True, modified_on=timezone.now())
+
+    return len(new_observations)
@@ -1,17 +1,21 @@
 import logging
 
-from celery import chain, chord, group, shared_task, signature
+from celery import group, shared_task, signature
 from celery.app import Celery
 from data_models.job_handling_functions import register_job
 from data_models.models import DataFile
 from django.conf import settings
 from django.db.models import CharField
 from django.db.models.functions import Lower
-from django.utils import timezone
-from observation_editor.models import Observation, Taxon
 
 from sensor_portal.celery import app
 
+from .dispatch_functions import (dispatch_ultra_chunks, finish_ultra_chunk,
+                                 get_queue_worker_n, start_ultra_dispatch)
+from .model_runners import run_local_inference
+from .preprocess_functions import evict_preprocessed_images, preprocess_images
+from .result_functions import save_ultra_results
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,16 +32,18 @@ CharField.register_lookup(Lower)
 @register_job("Do Ultralytic AI model inference", "do_ultra_inference", "datafile", True,
               default_args={"model_name": "yolov8s"})
 def do_ultra_inference(datafile_pks, model_name, target_labels=None, chunksize=500, chunksize2=100,
-                       exclude_done=False, parallel=False, **kwargs):
+                       exclude_done=False, parallel=False, preprocess=False, local=False, **kwargs):
 
     valid_formats = [".jpg", ".jpeg", ".png"]  # should be setting from env
     target_queue_name = settings.ULTRALYTICS_QUEUE  # should be setting from env
-    queue_names = [x[0]['name']
-                   for x in ai_app.control.inspect().active_queues().values()]
 
-    if target_queue_name not in queue_names:
-        logger.info(f"No {target_queue_name} queue available")
-        return
+    if not local and get_queue_worker_n(target_queue_name) == 0:
+        if not settings.AI_LOCAL_INFERENCE_FALLBACK:
+            logger.info(f"No {target_queue_name} queue available")
+            return
+        logger.info(
+            f"No {target_queue_name} queue available, running {model_name} locally")
+        local = True
 
     if type(datafile_pks) is not list:
         datafile_pks = [datafile_pks]
@@ -49,121 +55,83 @@ def do_ultra_inference(datafile_pks, model_name, target_labels=None, chunksize=5
 
     if exclude_done or not parallel:
         file_objs = file_objs.exclude(observations__source=model_name)
-        datafile_pks = list(file_objs.values_list('pk', flat=True))
+    # Files are only selected once, the dispatch then moves a cursor through them
+    datafile_pks = list(file_objs.values_list('pk', flat=True))
 
     if len(datafile_pks) == 0:
         logger.info("No files to analyse")
         return
 
-    file_pks_chunks = [datafile_pks[i:i + chunksize]
-                       for i in range(0, len(datafile_pks), chunksize)]
+    if local:
+        run_local_inference(DataFile.objects.filter(
+            pk__in=datafile_pks), model_name, target_labels, chunksize)
+        return
 
-    for i, file_pks_chunk in enumerate(file_pks_chunks):
-        file_objs_chunk = file_objs.filter(pk__in=file_pks_chunk).full_paths()
-        file_pks_job_chunks = [file_pks_chunk[i:i + chunksize2]
-                               for i in range(0, len(file_pks_chunk), chunksize2)]
+    # Preprocessed images let the worker skip decoding and resizing each image
+    preprocess_size = settings.AI_PREPROCESS_IMAGE_SIZE if preprocess else None
+    if preprocess_size is not None and not settings.ULTRALYTICS_FILE_IDENTITIES:
+        logger.info(
+            "Preprocessing needs ULTRALYTICS_FILE_IDENTITIES, images will not be preprocessed")
+        preprocess_size = None
+    dispatch_id = start_ultra_dispatch(
+        datafile_pks, model_name, target_labels, chunksize, chunksize2, parallel, preprocess_size)
+    dispatch_ultra_inference_task.apply_async([dispatch_id])
 
-        all_tasks = []
 
-        for file_pk_job_chunk in file_pks_job_chunks:
+@app.task()
+def dispatch_ultra_inference_task(dispatch_id):
+    """
+    Submit chunks of a dispatch to the ultralytics workers while they have capacity, trying again later
+    if they are full.
 
-            job_qs = file_objs_chunk.filter(pk__in=file_pk_job_chunk)
-            file_paths = list(
-                job_qs.values_list("full_path", flat=True))
+    Args:
+        dispatch_id (str): id of the dispatch
+    """
+    retry_seconds = dispatch_ultra_chunks(dispatch_id)
+    if retry_seconds is not None:
+        dispatch_ultra_inference_task.apply_async(
+            [dispatch_id], countdown=retry_seconds)
 
-            all_tasks.append(ai_app.signature('AnalysisTask', [
-                file_paths, model_name, target_labels], queue="ultralytics", immutable=True))
 
-        task_chord = chord(all_tasks, handle_ultra_results.s(
-            target_labels).set(queue="main_worker"))
+@app.task()
+def finish_ultra_chunk_task(dispatch_id):
+    """
+    Free the capacity of an inference chunk whose results could not be saved.
+
+    Args:
+        dispatch_id (str): id of the dispatch
+    """
+    logger.info(f"Inference dispatch {dispatch_id}: chunk failed")
+    finish_ultra_chunk(dispatch_id)
+
+
+@app.task(name="preprocess_images")
+@register_job("Preprocess images for AI model inference", "preprocess_images", "datafile", True)
+def preprocess_images_task(datafile_pks, image_size=None, **kwargs):
+    """
+    Make letterboxed arrays of images, so that they do not need decoding again for each model run over them.
+
+    Args:
+        datafile_pks (list[int]): pks of the images to preprocess
+        image_size (int, optional): width and height of the letterboxed images in pixels.
+        Defaults to settings.AI_PREPROCESS_IMAGE_SIZE.
+    """
+    if type(datafile_pks) is not list:
+        datafile_pks = [datafile_pks]
+    file_objs = DataFile.objects.filter(pk__in=datafile_pks)
+    preprocess_images(file_objs, image_size or settings.AI_PREPROCESS_IMAGE_SIZE)
 
-        if not parallel:
-            task_chain = chain(task_chord,
-                               do_ultra_inference.si(datafile_pks,
-                                                     model_name,
-                                                     target_labels,
-                                                     chunksize,
-                                                     chunksize2, True, False).set(queue="main_worker"))
-            logger.info(task_chain)
-            task_chain.apply_async()
-            return
 
-        else:
-            task_chord.apply_async()
+@app.task()
+def evict_preprocessed_images_task():
+    """
+    Remove the least recently used preprocessed images, if they are over their size limit.
+    """
+    evict_preprocessed_images()
 
 
 @app.task()
-def handle_ultra_results(all_results, target_labels=None):
-    through_class = Observation.data_files.through
-    if target_labels is not None and type(target_labels) is not list:
-        target_labels = [target_labels]
-
-    objs_to_create = []
-    file_objs_pks = []
-    file_objs_human_pks = []
-
-    for results in all_results:
-        source = results.get('source')
-        for file_name, file_results in results.get('files').items():
-            file_obj = DataFile.objects.get(file_name=file_name)
-            num_results = 0
-            if len(file_results) > 0:
-                for result in file_results:
-                    prediction = result.get('prediction')
-                    if target_labels is None or prediction in target_labels:
-                        num_results += 1
-                        bounding_box = result.get("bbox")
-                        extra_data = {}
-
-                        if bounding_box is not None:
-                            bbox_keys = ["x1", "y1", "x2", "y2"]
-                            bounding_box = {k: v for k, v in zip(
-                                bbox_keys, bounding_box)}
-                        confidence = result.get('confidence')
-                        if result.get('orig_shape') is not None:
-                            extra_data["orig_shape"] = result.get('orig_shape')
-
-                        taxon_obj = Taxon.objects.get_or_create(
-                            species_name=prediction)[0]
-
-                        new_observation_object = Observation(
-                            label=f"{prediction}_{file_obj.file_name}",
-                            taxon=taxon_obj,
-                            obs_dt=file_obj.recording_dt,
-                            bounding_box=bounding_box,
-                            confidence=confidence,
-                            extra_data=extra_data,
-                            source=source
-                        )
-
-                        objs_to_create.append(new_observation_object)
-                        file_objs_pks.append(file_obj.pk)
-                        if taxon_obj.taxon_code == settings.HUMAN_TAXON_CODE:
-                            file_objs_human_pks.append(file_obj.pk)
-
-            if len(file_results) == 0 or num_results == 0:
-                taxon_obj = Taxon.objects.get_or_create(
-                    species_name="No detection")[0]
-                new_observation_object = Observation(
-                    label=f"No_dectection_{file_obj.file_name}",
-                    taxon=taxon_obj,
-                    obs_dt=file_obj.recording_dt,
-                    extra_data={},
-                    source=source
-                )
-                objs_to_create.append(new_observation_object)
-                file_objs_pks.append(file_obj.pk)
-    new_observations = Observation.objects.bulk_create(
-        objs_to_create, batch_size=500)
-    new_obervation_pks = [x.pk for x in new_observations]
-    all_through_objs = []
-    for obs_pk, file_pk in zip(new_obervation_pks, file_objs_pks):
-        new_through_obj = through_class.objects.create(
-            observation_id=obs_pk, datafile_id=file_pk)
-        all_through_objs.append(new_through_obj)
-    through_class.objects.bulk_create(
-        all_through_objs, batch_size=500, ignore_conflicts=True)
-    logger.info(f"Created {len(new_observations)} observations")
-    # Update datafiles if human is present
-    DataFile.objects.filter(pk__in=file_objs_human_pks).update(
-        has_human=True, modified_on=timezone.now())
+def handle_ultra_results(all_results, target_labels=None, chunk_files=None, dispatch_id=None):
+    save_ultra_results(all_results, target_labels, chunk_files)
+    if dispatch_id is not None:
+        finish_ultra_chunk(dispatch_id)
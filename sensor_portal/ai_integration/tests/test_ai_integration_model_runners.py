@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from ai_integration.model_runners import (OnnxModelRunner, non_max_suppression,
+                                          run_local_inference,
+                                          unletterbox_boxes)
+from data_models.factories import DataFileFactory, DeploymentFactory
+from data_models.models import DataFile
+from PIL import Image
+
+
+@pytest.mark.django_db
+def test_run_local_inference_stub():
+    """
+    Test: Are the detections of a locally run model saved as observations of the right files?
+    """
+    new_deployment = DeploymentFactory()
+    detected_file = DataFileFactory(
+        file_name="detected_file", deployment=new_deployment)
+    blank_file = DataFileFactory(
+        file_name="blank_file", deployment=new_deployment)
+    # The stub model detects nothing in an image of a single colour
+    Image.new("RGB", (500, 500), (255, 0, 0)).save(
+        blank_file.full_path(), format="JPEG")
+    new_files = [detected_file, blank_file]
+
+    # One file per chunk, so that results are saved as each chunk finishes
+    n_observations = run_local_inference(DataFile.objects.filter(pk__in=[x.pk for x in new_files]),
+                                         "stub", chunksize=1)
+
+    assert n_observations == 2
+
+    detected_observation = detected_file.observations.get()
+    assert detected_observation.taxon.species_name == "stub"
+    assert detected_observation.source == "stub"
+    assert detected_observation.bounding_box == {
+        "x1": 125, "y1": 125, "x2": 375, "y2": 375}
+    assert list(detected_observation.data_files.all()) == [detected_file]
+
+    blank_observation = blank_file.observations.get()
+    assert blank_observation.taxon.species_name == "No detection"
+    assert list(blank_observation.data_files.all()) == [blank_file]
+
+    for new_file in new_files:
+        new_file.delete()
+
+
+def test_non_max_suppression():
+    """
+    Test: Are boxes that overlap a higher scoring box removed?
+    """
+    boxes = np.array([[0, 0, 10, 10],
+                      [1, 1, 11, 11],
+                      [20, 20, 30, 30],
+                      [0, 0, 10, 9]], dtype=float)
+    scores = np.array([0.8, 0.9, 0.7, 0.6])
+
+    keep = non_max_suppression(boxes, scores, 0.5)
+
+    assert keep.tolist() == [1, 2]
+
+
+def test_postprocess_class_aware():
+    """
+    Test: Are overlapping boxes of the same class suppressed, and those of other classes kept?
+    """
+    # Only the attributes used in postprocessing, so that no model file is needed
+    runner = OnnxModelRunner.__new__(OnnxModelRunner)
+    runner.image_size = 64
+    runner.class_names = {0: "person", 1: "vehicle"}
+
+    # Centre x, centre y, width, height, then the score of each class, for each candidate box
+    output = np.array([[32, 32, 20, 20, 0.9, 0.1],
+                       [33, 33, 20, 20, 0.8, 0.1],
+                       [32, 32, 20, 20, 0.1, 0.7],
+                       [10, 10, 4, 4, 0.1, 0.2]], dtype=np.float32).T
+
+    results = runner.postprocess(output, (64, 64))
+
+    assert [(x["prediction"], x["confidence"]) for x in results] == [
+        ("person", pytest.approx(0.9)), ("vehicle", pytest.approx(0.7))]
+    assert np.allclose(results[0]["bbox"], [22, 22, 42, 42])
+    assert results[0]["orig_shape"] == [64, 64]
+
+
+def test_unletterbox_boxes():
+    """
+    Test: Are boxes in a letterboxed image converted to pixels of a non-square original image?
+    """
+    # 400 wide and 200 high, scaled to 64 by 32 and padded by 16 above and below
+    boxes = np.array([[0, 16, 64, 48],
+                      [32, 24, 48, 40],
+                      [-4, 0, 8, 20]], dtype=float)
+
+    original_boxes = unletterbox_boxes(boxes, (200, 400), 64)
+
+    assert np.allclose(original_boxes, [[0, 0, 400, 200],
+                                        [200, 50, 300, 150],
+                                        [0, 0, 50, 25]])
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+from ai_integration.model_runners import load_model_input
+from ai_integration.models import PreprocessedImage
+from ai_integration.preprocess_functions import (get_preprocessed_path,
+                                                 preprocess_images)
+from data_models.factories import DataFileFactory
+from data_models.models import DataFile
+
+
+@pytest.mark.django_db
+def test_preprocess_images_sizes():
+    """
+    Test: Are arrays of an image at different sizes kept side by side, and is the matching size loaded?
+    """
+    new_file = DataFileFactory()
+    file_objs = DataFile.objects.filter(pk=new_file.pk)
+
+    assert preprocess_images(file_objs, 64) == 1
+    assert preprocess_images(file_objs, 32) == 1
+    # Both sizes are already preprocessed
+    assert preprocess_images(file_objs, 64) == 0
+    assert preprocess_images(file_objs, 32) == 0
+
+    for image_size in [64, 32]:
+        preprocessed_image = new_file.preprocessed_images.get(
+            image_size=image_size)
+        assert preprocessed_image.path == get_preprocessed_path(
+            new_file.full_path(), image_size)
+        assert os.path.exists(preprocessed_image.path)
+
+        letterboxed, _ = load_model_input(new_file.full_path(), image_size)
+        assert isinstance(letterboxed, np.memmap)
+        assert letterboxed.shape == (image_size, image_size, 3)
+
+    new_file.delete()
+    assert not PreprocessedImage.objects.exists()
@@ -0,0 +1,114 @@
+import pytest
+from ai_integration.result_functions import save_ultra_results
+from data_models.factories import DataFileFactory, DeploymentFactory
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from observation_editor.factories import TaxonFactory
+from observation_editor.models import Taxon
+
+
+def to_chunk_files(file_objs):
+    """
+    Pk, full path and recording datetime of each file, as submitted to the ultralytics worker.
+    """
+    return [[x.pk, x.full_path(), x.recording_dt.isoformat()] for x in file_objs]
+
+
+@pytest.mark.django_db
+def test_save_ultra_results():
+    """
+    Test: Are pk-keyed and name-keyed results saved as observations of the right files?
+    """
+    TaxonFactory(species_name="person", taxon_code=settings.HUMAN_TAXON_CODE)
+    TaxonFactory(species_name="vehicle")
+    new_deployment = DeploymentFactory()
+    pk_file = DataFileFactory(file_name="pk_file", deployment=new_deployment)
+    empty_file = DataFileFactory(
+        file_name="empty_file", deployment=new_deployment)
+    name_file = DataFileFactory(
+        file_name="name_file", deployment=new_deployment)
+    new_files = [pk_file, empty_file, name_file]
+
+    person_result = {"prediction": "person", "confidence": 0.9,
+                     "bbox": [1, 2, 3, 4], "orig_shape": [500, 500]}
+    vehicle_result = {"prediction": "vehicle", "confidence": 0.8,
+                      "bbox": [5, 6, 7, 8], "orig_shape": [500, 500]}
+    bird_result = {"prediction": "bird", "confidence": 0.7,
+                   "bbox": [1, 1, 2, 2], "orig_shape": [500, 500]}
+    all_results = [
+        # Worker that returns results keyed by pk
+        {"source": "test_model",
+         "files": {str(pk_file.pk): [person_result, vehicle_result],
+                   str(empty_file.pk): []}},
+        # Worker that returns results keyed by file name, of a file that was not submitted in this chunk
+        {"source": "test_model",
+         "files": {name_file.file_name: [vehicle_result, bird_result]}}]
+
+    n_observations = save_ultra_results(
+        all_results, ["person", "vehicle"], to_chunk_files([pk_file, empty_file]))
+
+    assert n_observations == 4
+
+    # Each observation is attached to the file it was detected in, and only that file
+    for new_file in new_files:
+        for observation in new_file.observations.all():
+            assert list(observation.data_files.all()) == [new_file]
+            assert observation.source == "test_model"
+            assert observation.obs_dt == new_file.recording_dt
+
+    assert set(pk_file.observations.values_list(
+        "taxon__species_name", flat=True)) == {"person", "vehicle"}
+    person_observation = pk_file.observations.get(
+        taxon__species_name="person")
+    assert person_observation.bounding_box == {
+        "x1": 1, "y1": 2, "x2": 3, "y2": 4}
+    assert person_observation.confidence == pytest.approx(0.9)
+    assert person_observation.extra_data == {"orig_shape": [500, 500]}
+
+    assert list(empty_file.observations.values_list(
+        "taxon__species_name", flat=True)) == ["No detection"]
+
+    # Labels that are not targeted are left out
+    assert list(name_file.observations.values_list(
+        "taxon__species_name", flat=True)) == ["vehicle"]
+    assert not Taxon.objects.filter(species_name="bird").exists()
+
+    for new_file in new_files:
+        new_file.refresh_from_db()
+    assert pk_file.has_human
+    assert not empty_file.has_human
+    assert not name_file.has_human
+
+    for new_file in new_files:
+        new_file.delete()
+
+
+@pytest.mark.django_db
+def test_save_ultra_results_query_count():
+    """
+    Test: Does saving results take the same number of queries, however many files they are for?
+    """
+    TaxonFactory(species_name="vehicle")
+    TaxonFactory(species_name="No detection")
+    new_deployment = DeploymentFactory()
+    vehicle_result = {"prediction": "vehicle", "confidence": 0.8,
+                      "bbox": [5, 6, 7, 8], "orig_shape": [500, 500]}
+
+    def count_queries(file_objs):
+        all_results = [{"source": "test_model",
+                        "files": {str(x.pk): [vehicle_result] if i % 2 == 0 else []
+                                  for i, x in enumerate(file_objs)}}]
+        with CaptureQueriesContext(connection) as context:
+            save_ultra_results(all_results, None, to_chunk_files(file_objs))
+        return len(context.captured_queries)
+
+    few_files = [DataFileFactory(file_name=f"few_file_{i}", deployment=new_deployment)
+                 for i in range(2)]
+    many_files = [DataFileFactory(file_name=f"many_file_{i}", deployment=new_deployment)
+                  for i in range(10)]
+
+    assert count_queries(few_files) == count_queries(many_files)
+
+    for new_file in few_files + many_files:
+        new_file.delete()
@@ -2,7 +2,8 @@ from django.contrib import admin
 from utils.admin import AddOwnerAdmin, GenericAdmin
 
 from .forms import ArchiveForm
-from .models import Archive, TarFile
+from .models import (Archive, ArchiveSpan, RestoreRequest, TarFile,
+                     TarRestore)
 
 
 @admin.register(Archive)
@@ -13,3 +14,25 @@ class ArchiveAdmin(AddOwnerAdmin):
 @admin.register(TarFile)
 class TarFileAdmin(GenericAdmin):
     readonly_fields = ['archive']
+
+
+@admin.register(TarRestore)
+class TarRestoreAdmin(GenericAdmin):
+    readonly_fields = ['tar_file', 'requests']
+    list_display = ['tar_file', 'status', 'attempts', 'modified_on']
+
+
+@admin.register(RestoreRequest)
+class RestoreRequestAdmin(GenericAdmin):
+    readonly_fields = ['callback']
+    exclude = ['data_files']
+    list_display = ['pk', 'status', 'created_on', 'modified_on']
+
+
+@admin.register(ArchiveSpan)
+class ArchiveSpanAdmin(GenericAdmin):
+    readonly_fields = ['operation', 'tar_file', 'tar_restore', 'started_on',
+                       'seconds', 'size', 'file_n', 'mb_per_s', 'success']
+    list_display = ['operation', 'tar_file', 'started_on',
+                    'seconds', 'size', 'file_n', 'mb_per_s', 'success']
+    list_filter = ['operation', 'success']
@@ -1,59 +1,79 @@
+import hashlib
 import os
+from typing import Iterable, Optional
 
-from data_models.models import DataFile
-from utils.general import get_md5
 
+def bagit_txt() -> str:
+    """
+    Contents of the bagit.txt declaration file.
 
-def bag_info_from_files(file_objs: DataFile, output_path: str) -> list[str]:
+    Returns:
+        str: contents of bagit.txt
     """
-    This should generate neccesary files for a bagit object.
-    The bagit python implementation requires files to be moved.
-    With this script, these text files can be generated an appended straight to a TAR.
+    bagit_txt_lines = ["BagIt-Version: 0.97\n",
+                       "Tag-File-Character-Encoding: UTF-8\n"]
+    return "".join(bagit_txt_lines)
+
+
+def manifest_txt(checksums: Iterable[tuple[str, str]]) -> str:
+    """
+    Contents of a payload manifest.
 
     Args:
-        file_objs (DataFile): queryset of DataFile objects
-        output_folder (str): output folder for generated files
+        checksums (Iterable[tuple[str, str]]): md5 checksum and path inside the bag of each payload file
 
     Returns:
-        list[str] : list of paths of the generated bag files
+        str: contents of manifest-md5.txt
     """
-    os.makedirs(output_path, exist_ok=True)
+    return "".join([f"{checksum}  {path}\n" for checksum, path in checksums])
 
-    # bag.txt
-    bagit_txt_lines = ["BagIt-Version: 0.97\n",
-                       "Tag-File-Character-Encoding: UTF-8\n"]
 
-    bag_path = os.path.join(output_path, "bagit.txt")
-    # export file
-    with open(bag_path, "w") as f:
-        f.writelines(bagit_txt_lines)
+def tag_manifest_txt(tag_files: dict[str, str]) -> str:
+    """
+    Contents of a tag manifest.
 
-    # manifest-md5.txt
-    file_objs = file_objs.full_paths()
+    Args:
+        tag_files (dict[str, str]): tag file names and their contents
 
-    all_full_paths = file_objs.values_list("full_path", flat=True)
-    all_relative_paths = file_objs.values_list("relative_path", flat=True)
+    Returns:
+        str: contents of tagmanifest-md5.txt
+    """
+    return "".join([f"{hashlib.md5(content.encode('utf-8')).hexdigest()}  {name}\n"
+                    for name, content in tag_files.items()])
 
-    manifest_lines = [f"{get_md5(x)}  {os.path.join('data',y)}\n" for x, y in zip(
-        all_full_paths, all_relative_paths)]
 
-    manifest_path = os.path.join(output_path, "manifest-md5.txt")
-    with open(manifest_path, "w") as f:
-        f.writelines(manifest_lines)
+def bag_files_from_checksums(checksums: Iterable[tuple[str, str]]) -> dict[str, str]:
+    """
+    Generate the contents of all bagit tag files from the checksums of the payload.
+    These can be written straight into a TAR, without first being written to disk.
 
-    # tagmanifest-md5.txt
-    # run checksums on previously exported bag txt files
+    Args:
+        checksums (Iterable[tuple[str, str]]): md5 checksum and path inside the bag of each payload file
 
-    all_paths = [bag_path, manifest_path]
-    tag_manifest_lines = [
-        f"{get_md5(x)}  {os.path.split(x)[1]}\n" for x in all_paths]
+    Returns:
+        dict[str, str]: tag file names and their contents
+    """
+    bag_files = {"bagit.txt": bagit_txt(),
+                 "manifest-md5.txt": manifest_txt(checksums)}
+    bag_files["tagmanifest-md5.txt"] = tag_manifest_txt(bag_files)
+    return bag_files
 
-    tag_manifest_path = os.path.join(output_path, "tagmanifest-md5.txt")
 
-    with open(tag_manifest_path, "w") as f:
-        f.writelines(tag_manifest_lines)
+def get_stored_checksum(file_path: str, file_size: int, md5_checksum: Optional[str]) -> Optional[str]:
+    """
+    Get the md5 checksum calculated when a file was ingested, if the file still matches it.
 
-    all_paths.append(tag_manifest_path)
+    Args:
+        file_path (str): path of the file on disk
+        file_size (int): size of the file in bytes, as stored in the database
+        md5_checksum (Optional[str]): checksum stored in the file's extra_data
 
-    # return paths to these files
-    return all_paths
+    Returns:
+        Optional[str]: the stored checksum, or None if the file must be hashed
+    """
+    if not md5_checksum:
+        return None
+    # A file that has changed size since ingest has been altered, so its checksum is stale
+    if os.path.getsize(file_path) != file_size:
+        return None
+    return md5_checksum
@@ -1,2 +1,6 @@
 class TAROffline(Exception):
     pass
+
+
+class ArchiveChecksumMismatch(Exception):
+    pass
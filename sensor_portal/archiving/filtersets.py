@@ -0,0 +1,16 @@
+import django_filters.rest_framework
+
+from .models import ArchiveSpan, span_operations
+
+
+class ArchiveSpanFilter(django_filters.FilterSet):
+    operation = django_filters.ChoiceFilter(choices=span_operations)
+    tar_file = django_filters.NumberFilter(field_name="tar_file__pk")
+    restore_request = django_filters.NumberFilter(
+        field_name="tar_restore__requests__pk")
+    started_after = django_filters.IsoDateTimeFilter(
+        field_name="started_on", lookup_expr="gte")
+
+    class Meta:
+        model = ArchiveSpan
+        fields = ["operation", "tar_file", "restore_request", "started_after"]
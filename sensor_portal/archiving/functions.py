@@ -1,57 +1,46 @@
+import hashlib
 import logging
 import os
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
+import paramiko
 from celery import chord, group
-from data_models.models import DataFile
 from django.conf import settings
-from scp import SCPException
+from django.db.models import Count, QuerySet, Sum
+from utils.general import convert_unit
+from utils.ssh_client import SSH_client
 
-from .models import Archive
+from .exceptions import ArchiveChecksumMismatch
+from .models import Archive, ArchiveLedger, ArchiveSpan, span_operations
 
 logger = logging.getLogger(__name__)
 
+# Size of blocks read from a local TAR when uploading
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
 
 def check_archive_projects(archive: Archive):
     from .tasks import check_archive_upload_task, create_tar_files_task
 
-    # Get all projects linked to this archive
-    all_project_combos = list(archive.linked_projects.values_list(
-        "deployments__combo_project", flat=True).distinct())
-    all_tasks = []
-    for project_combo in all_project_combos:
-        logger.info(f"Check {project_combo} for archiving")
-        all_file_objs = DataFile.objects.filter(
-            deployment__combo_project=project_combo, tar_file__isnull=True)
-
-        if not all_file_objs.exists():
-            logger.info(f"Check {project_combo} for archiving: No files")
-            continue
-
-        device_types = list(all_file_objs.values_list(
-            "deployment__device__type", flat=True).distinct())
-        for device_type in device_types:
-            logger.info(
-                f"Check {project_combo} for archiving: check {device_type}")
-            # Get datafiles for this project, sensor type
-            file_objs = all_file_objs.filter(
-                deployment__device__type=device_type)
-            if not file_objs.exists():
-                logger.info(
-                    f"Check {project_combo} for archiving: check {device_type}: No files")
-                continue
+    # Get project combinations and device types linked to this archive with enough files to archive,
+    # from the running totals rather than aggregating the files themselves
+    min_archive_size = int(settings.MIN_ARCHIVE_SIZE_GB * 1024 * 1024 * 1024)
+    ledger_values = ArchiveLedger.objects.filter(
+        combo_project__in=archive.linked_projects.values(
+            "deployments__combo_project"),
+        total_size__gt=min_archive_size).values_list("combo_project", "device_type", "total_size")
 
-            # check files for archiving
-            total_file_size = file_objs.file_size_unit("GB")
-            if total_file_size > settings.MIN_ARCHIVE_SIZE_GB:
-                logger.info(
-                    f"Check {project_combo} for archiving: check {device_type}: Sufficient files")
-                file_pks = list(file_objs.values_list('pk', flat=True))
-                tar_task = create_tar_files_task.si(file_pks, archive.pk)
-                all_tasks.append(tar_task)
-            else:
-                logger.info(
-                    f"Check {project_combo} for archiving: check {device_type}: Insufficient files")
+    all_tasks = []
+    for project_combo, device_type, total_size in ledger_values:
+        logger.info(
+            f"Check {project_combo} for archiving: check {device_type}: Sufficient files "
+            f"({convert_unit(total_size, 'GB')} GB)")
+        tar_task = create_tar_files_task.si(
+            project_combo, device_type, archive.pk)
+        all_tasks.append(tar_task)
 
     if len(all_tasks) > 0:
         logger.info("Submitting archiving jobs")
@@ -59,6 +48,118 @@ def check_archive_projects(archive: Archive):
         task_chord = chord(
             task_group, check_archive_upload_task.si(archive.pk))
         task_chord.apply_async()
+    else:
+        logger.info(f"Check {archive} for archiving: Insufficient files")
+
+
+def get_remote_md5(archive_ssh: SSH_client, remote_path: str) -> Optional[str]:
+    """
+    Calculate the md5 checksum of a file on the archive.
+
+    Args:
+        archive_ssh (SSH_client): client of the archive, connected to SSH
+        remote_path (str): path of the file on the archive
+
+    Returns:
+        Optional[str]: md5 checksum of the file, or None if it could not be calculated
+    """
+    status_code, stdout, stderr = archive_ssh.send_ssh_command(
+        f"md5sum '{remote_path}'")
+    if status_code != 0 or len(stdout) == 0:
+        logger.info(f"{remote_path}: could not get checksum {stderr}")
+        return None
+    return stdout[0].split(" ")[0]
+
+
+def upload_tar_file(archive_ssh: SSH_client, local_path: str, remote_path: str) -> dict:
+    """
+    Upload a TAR to the archive over its own SFTP channel, resuming a partial upload if one exists.
+    The upload is verified against the checksum of the remote file.
+
+    Args:
+        archive_ssh (SSH_client): client of the archive, connected to FTP and SSH
+        local_path (str): path of the local TAR
+        remote_path (str): path to upload the TAR to
+
+    Raises:
+        ArchiveChecksumMismatch: The remote file does not match the local TAR.
+
+    Returns:
+        dict: upload metrics
+    """
+    local_size = os.path.getsize(local_path)
+    hash_md5 = hashlib.md5()
+
+    # Each upload gets its own channel on the shared transport
+    sftp = paramiko.SFTPClient.from_transport(archive_ssh.ftp_t)
+    try:
+        try:
+            remote_size = sftp.stat(remote_path).st_size
+        except FileNotFoundError:
+            remote_size = 0
+        if remote_size > local_size:
+            # This is not a partial upload of this TAR
+            remote_size = 0
+        if remote_size > 0:
+            logger.info(
+                f"{remote_path}: resuming upload from {convert_unit(remote_size, 'MB')} MB")
+
+        start_time = time.perf_counter()
+        with open(local_path, "rb") as local_file, \
+                sftp.open(remote_path, "r+b" if remote_size > 0 else "wb") as remote_file:
+            remote_file.set_pipelined(True)
+            # Hash the part that has already been uploaded
+            remaining = remote_size
+            while remaining > 0:
+                chunk = local_file.read(min(UPLOAD_BLOCK_SIZE, remaining))
+                hash_md5.update(chunk)
+                remaining -= len(chunk)
+
+            remote_file.seek(remote_size)
+            for chunk in iter(lambda: local_file.read(UPLOAD_BLOCK_SIZE), b""):
+                remote_file.write(chunk)
+                hash_md5.update(chunk)
+        upload_time = time.perf_counter() - start_time
+
+        local_stat = os.stat(local_path)
+        sftp.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
+
+        remote_md5 = get_remote_md5(archive_ssh, remote_path)
+        if remote_md5 != hash_md5.hexdigest():
+            # Remove the remote file, so that the next attempt starts again
+            sftp.remove(remote_path)
+            raise ArchiveChecksumMismatch(
+                f"{remote_path}: remote checksum {remote_md5} does not match local checksum {hash_md5.hexdigest()}")
+    finally:
+        sftp.close()
+
+    sent_mb = convert_unit(local_size - remote_size, "MB")
+    return {"sent_bytes": local_size - remote_size,
+            "size_mb": round(convert_unit(local_size, "MB"), 1),
+            "sent_mb": round(sent_mb, 1),
+            "resumed_from_mb": round(convert_unit(remote_size, "MB"), 1),
+            "seconds": round(upload_time, 1),
+            "mb_per_s": round(sent_mb / upload_time, 2) if upload_time > 0 else None}
+
+
+def measure_tar_upload(span: ArchiveSpan, archive_ssh: SSH_client, local_path: str, remote_path: str) -> dict:
+    """
+    Upload a TAR to the archive, timing the upload in a span. The span is left to be saved by the caller,
+    as this runs in an upload thread.
+
+    Args:
+        span (ArchiveSpan): unsaved span to record the upload in
+        archive_ssh (SSH_client): client of the archive, connected to FTP and SSH
+        local_path (str): path of the local TAR
+        remote_path (str): path to upload the TAR to
+
+    Returns:
+        dict: upload metrics
+    """
+    with span.measure():
+        upload_metrics = upload_tar_file(archive_ssh, local_path, remote_path)
+        span.size = upload_metrics["sent_bytes"]
+    return upload_metrics
 
 
 def check_archive_upload(archive: Archive):
@@ -66,57 +167,127 @@ def check_archive_upload(archive: Archive):
 
     archive_ssh = archive.init_ssh_client()
     connect_ftp_success = archive_ssh.connect_to_ftp()
-    connect_scp_success = archive_ssh.connect_to_scp()
-    if not connect_scp_success or not connect_ftp_success:
+    connect_ssh_success = archive_ssh.connect_to_ssh()
+    if not connect_ssh_success or not connect_ftp_success:
         return
 
-    for tar_obj in tars_to_upload:
+    uploads = {}
+    with ThreadPoolExecutor(max_workers=settings.ARCHIVE_UPLOAD_CONCURRENCY) as executor:
+        for tar_obj in tars_to_upload:
 
-        if tar_obj.uploading or tar_obj.archived:
-            continue
-        logger.info(f"{tar_obj.name} uploading")
-        tar_obj.uploading = True
-        tar_obj.save()
+            if tar_obj.uploading or tar_obj.archived:
+                continue
+            logger.info(f"{tar_obj.name} uploading")
+            tar_obj.uploading = True
+            tar_obj.save()
 
-        tar_full_name = tar_obj.name+".tar.gz"
+            tar_full_name = tar_obj.name+tar_obj.file_format
 
-        upload_path = os.path.join(archive.root_folder,
-                                   os.path.relpath(tar_obj.path,
-                                                   os.path.join(settings.FILE_STORAGE_ROOT,
-                                                                "archiving")))
+            upload_path = os.path.join(archive.root_folder,
+                                       os.path.relpath(tar_obj.path,
+                                                       os.path.join(settings.FILE_STORAGE_ROOT,
+                                                                    "archiving")))
 
-        full_tar_upload_path = os.path.join(
-            upload_path, tar_full_name)
+            full_tar_upload_path = os.path.join(
+                upload_path, tar_full_name)
 
-        full_tar_local_path = os.path.join(
-            settings.FILE_STORAGE_ROOT, tar_obj.path, tar_full_name)
-        success = False
-        try:
-            archive_ssh.mkdir_p(upload_path)
-
-            archive_ssh.scp_c.put(full_tar_local_path,
-                                  full_tar_upload_path,
-                                  preserve_times=True)
-            success = True
-        except SCPException as e:
-            logger.info("SCP error:")
-            logger.info(repr(e))
-            traceback.print_exc()
-
-        except Exception as e:
-            logger.info(repr(e))
-            traceback.print_exc()
-
-        tar_obj.uploading = False
-        if success:
-            logger.info(f"{tar_obj.name} uploading succesful")
-            tar_obj.clean_tar()
-            tar_obj.archived = True
-            tar_obj.path = upload_path
-            tar_obj.files.update(archived=True)
-
-        else:
-            logger.info(f"{tar_obj.name} uploading failed")
-        tar_obj.save()
-
-        archive_ssh.close_connection()
+            full_tar_local_path = os.path.join(
+                settings.FILE_STORAGE_ROOT, tar_obj.path, tar_full_name)
+            try:
+                archive_ssh.mkdir_p(upload_path)
+            except Exception as e:
+                logger.info(f"{tar_obj.name} uploading failed")
+                logger.info(repr(e))
+                tar_obj.uploading = False
+                tar_obj.save()
+                continue
+
+            span = ArchiveSpan(operation=1, tar_file=tar_obj, file_n=1)
+            upload = executor.submit(measure_tar_upload, span, archive_ssh,
+                                     full_tar_local_path, full_tar_upload_path)
+            uploads[upload] = (tar_obj, upload_path, span)
+
+        # Database updates stay in this thread, as uploads finish
+        for upload in as_completed(uploads):
+            tar_obj, upload_path, span = uploads[upload]
+            success = False
+            try:
+                upload_metrics = upload.result()
+                success = True
+            except Exception as e:
+                logger.info(repr(e))
+                traceback.print_exc()
+            span.save()
+
+            tar_obj.uploading = False
+            if success:
+                logger.info(
+                    f"{tar_obj.name} uploading succesful {upload_metrics}")
+                tar_obj.clean_tar()
+                tar_obj.archived = True
+                tar_obj.path = upload_path
+                tar_obj.files.update(archived=True)
+
+            else:
+                logger.info(f"{tar_obj.name} uploading failed")
+            tar_obj.save()
+
+    archive_ssh.close_connection_to_ftp()
+    archive_ssh.close_connection()
+
+
+def get_archive_span_totals(span_objs: QuerySet[ArchiveSpan]) -> list[dict]:
+    """
+    Total the timing spans of each archiving operation.
+
+    Args:
+        span_objs (QuerySet[ArchiveSpan]): spans to total
+
+    Returns:
+        list[dict]: operation, success, number of spans, seconds, bytes and files of each combination of
+        operation and success, with the mean throughput in MB/s
+    """
+    totals = span_objs.values("operation", "success").annotate(
+        span_n=Count("pk"),
+        seconds=Sum("seconds"),
+        size=Sum("size"),
+        file_n=Sum("file_n")).order_by("operation", "success")
+
+    operation_names = dict(span_operations)
+    all_totals = []
+    for total in totals:
+        total["operation"] = operation_names[total["operation"]]
+        total["mb_per_s"] = round(convert_unit(total["size"], "MB") / total["seconds"], 2) \
+            if total["seconds"] else None
+        all_totals.append(total)
+    return all_totals
+
+
+def archive_span_metrics(span_objs: QuerySet[ArchiveSpan]) -> str:
+    """
+    Export the totals of archiving timing spans as Prometheus counters.
+
+    Args:
+        span_objs (QuerySet[ArchiveSpan]): spans to total
+
+    Returns:
+        str: counters in the Prometheus text exposition format
+    """
+    counters = [("archive_operations_total", "span_n", "Number of archiving operations."),
+                ("archive_operation_seconds_total", "seconds",
+                 "Time spent on archiving operations."),
+                ("archive_operation_bytes_total", "size",
+                 "Bytes processed by archiving operations."),
+                ("archive_operation_files_total", "file_n", "Files processed by archiving operations.")]
+    totals = get_archive_span_totals(span_objs)
+
+    lines = []
+    for name, key, help_text in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for total in totals:
+            operation = total["operation"].lower().replace(" ", "_")
+            success = str(total["success"]).lower()
+            lines.append(
+                f'{name}{{operation="{operation}",success="{success}"}} {total[key] or 0}')
+    return "\n".join(lines) + "\n"
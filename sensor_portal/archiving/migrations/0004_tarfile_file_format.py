@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archiving', '0003_remove_tarfile_comboproject_alter_tarfile_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarfile',
+            name='file_format',
+            field=models.CharField(default='.tar.gz', max_length=20),
+        ),
+    ]
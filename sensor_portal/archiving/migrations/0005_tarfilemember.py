@@ -0,0 +1,24 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0036_ingestjob'),
+        ('archiving', '0004_tarfile_file_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarFileMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('offset', models.BigIntegerField(null=True)),
+                ('size', models.BigIntegerField(null=True)),
+                ('data_file', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tar_members', to='data_models.datafile')),
+                ('tar_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='archiving.tarfile')),
+            ],
+        ),
+    ]
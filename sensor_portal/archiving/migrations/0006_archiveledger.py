@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_archive_ledger(apps, schema_editor):
+    """
+    Total the files that are not yet in a TAR.
+    """
+    DataFile = apps.get_model("data_models", "DataFile")
+    ArchiveLedger = apps.get_model("archiving", "ArchiveLedger")
+
+    totals = DataFile.objects.filter(
+        tar_file__isnull=True, deployment__device__type__isnull=False).values(
+        "deployment__combo_project", "deployment__device__type").annotate(
+        file_n=Count("pk"), total_size=Sum("file_size"))
+
+    ArchiveLedger.objects.bulk_create(
+        [ArchiveLedger(combo_project=x["deployment__combo_project"] or "",
+                       device_type_id=x["deployment__device__type"],
+                       file_n=x["file_n"],
+                       total_size=x["total_size"] or 0)
+         for x in totals],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0037_datatype_archive_compressed'),
+        ('archiving', '0005_tarfilemember'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('combo_project', models.CharField(blank=True, max_length=100)),
+                ('file_n', models.BigIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('device_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_ledgers', to='data_models.datatype')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='archiveledger',
+            constraint=models.UniqueConstraint(fields=('combo_project', 'device_type'), name='unique_archive_ledger'),
+        ),
+        migrations.RunPython(build_archive_ledger, migrations.RunPython.noop),
+    ]
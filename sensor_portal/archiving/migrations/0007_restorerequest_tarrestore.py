@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0037_datatype_archive_compressed'),
+        ('archiving', '0006_archiveledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestoreRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('callback', models.JSONField(blank=True, null=True)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Staging'), (2, 'Restoring'), (3, 'Complete'), (4, 'Failed')], default=0)),
+                ('data_files', models.ManyToManyField(blank=True, related_name='restore_requests', to='data_models.datafile')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TarRestore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Staging'), (2, 'Restoring'), (3, 'Complete'), (4, 'Failed')], default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('requests', models.ManyToManyField(blank=True, related_name='tar_restores', to='archiving.restorerequest')),
+                ('tar_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='restores', to='archiving.tarfile')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archiving', '0007_restorerequest_tarrestore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSpan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.IntegerField(choices=[(0, 'Create TAR'), (1, 'Upload'), (2, 'Tape recall'), (3, 'Restore')])),
+                ('started_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('seconds', models.FloatField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('file_n', models.IntegerField(default=0)),
+                ('success', models.BooleanField(default=True)),
+                ('tar_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='spans', to='archiving.tarfile')),
+                ('tar_restore', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='spans', to='archiving.tarrestore')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['operation', 'started_on'], name='archive_span_operation_idx')],
+            },
+        ),
+    ]
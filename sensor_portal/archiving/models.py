@@ -1,9 +1,14 @@
 import logging
 import os
+import time
+from collections import Counter
+from contextlib import contextmanager
 from posixpath import join as posixjoin
+from typing import Iterable, Iterator, Optional
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 from django.utils import timezone as djtimezone
@@ -52,6 +57,8 @@ class TarFile(BaseModel):
     local_storage = models.BooleanField(default=True)
     archived = models.BooleanField(default=False)
     path = models.CharField(max_length=500, blank=True)
+    # Extension of the archive, which depends on the compression used to create it
+    file_format = models.CharField(max_length=20, default=".tar.gz")
     archive = models.ForeignKey(
         Archive, related_name="tar_files", on_delete=models.PROTECT, null=True)
 
@@ -67,8 +74,8 @@ class TarFile(BaseModel):
             return True
         if self.local_storage:
             tar_name = self.name
-            if ".tar.gz" not in tar_name:
-                tar_name = tar_name+".tar.gz"
+            if self.file_format not in tar_name:
+                tar_name = tar_name+self.file_format
             tar_path = os.path.join(
                 settings.FILE_STORAGE_ROOT, self.path, tar_name)
             logger.info(
@@ -103,7 +110,7 @@ class TarFile(BaseModel):
             ssh_connect_success = ssh_client.connect_to_ssh()
             if not ssh_connect_success:
                 return
-            remote_path = posixjoin(self.path, self.name+".tar.gz")
+            remote_path = posixjoin(self.path, self.name+self.file_format)
             status_code, stdout, stderr = ssh_client.send_ssh_command(
                 f"rm {remote_path}")
             if status_code != 0:
@@ -125,6 +132,225 @@ class TarFile(BaseModel):
             return False
 
 
+class TarFileMember(models.Model):
+    """
+    Index of the data files in a TAR, recorded when the TAR is created, so that files can be restored
+    without listing the whole TAR.
+    """
+    tar_file = models.ForeignKey(
+        TarFile, related_name="members", on_delete=models.CASCADE)
+    data_file = models.ForeignKey(
+        "data_models.DataFile", related_name="tar_members", on_delete=models.SET_NULL, null=True)
+    # Path of the file inside the TAR
+    path = models.CharField(max_length=500)
+    # Offset and size in bytes of the file's data in the uncompressed TAR
+    offset = models.BigIntegerField(null=True)
+    size = models.BigIntegerField(null=True)
+
+    def __str__(self):
+        return self.path
+
+
+class ArchiveLedger(models.Model):
+    """
+    Running total of files that are not yet in a TAR, for each combination of projects and device type.
+    Kept up to date as files are ingested, deleted and archived, so that checking for files to archive
+    does not need to aggregate the whole DataFile table.
+    """
+    combo_project = models.CharField(max_length=100, blank=True)
+    device_type = models.ForeignKey(
+        "data_models.DataType", related_name="archive_ledgers", on_delete=models.CASCADE)
+    file_n = models.BigIntegerField(default=0)
+    # Total size in bytes
+    total_size = models.BigIntegerField(default=0)
+    modified_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['combo_project', 'device_type'], name='unique_archive_ledger')
+        ]
+
+    def __str__(self):
+        return f"{self.combo_project} {self.device_type}"
+
+    @classmethod
+    def add_files(cls, file_values: Iterable[tuple[str, int, int]], sign: int = 1):
+        """
+        Add files to, or remove files from, the ledger.
+
+        Args:
+            file_values (Iterable[tuple[str, int, int]]): combo project, device type pk and size of each file
+            sign (int, optional): 1 to add the files, -1 to remove them. Defaults to 1.
+        """
+        file_ns = Counter()
+        total_sizes = Counter()
+        for combo_project, device_type_pk, file_size in file_values:
+            if device_type_pk is None:
+                continue
+            key = (combo_project or "", device_type_pk)
+            file_ns[key] += 1
+            total_sizes[key] += file_size or 0
+
+        for (combo_project, device_type_pk), file_n in file_ns.items():
+            ledger, created = cls.objects.get_or_create(
+                combo_project=combo_project, device_type_id=device_type_pk)
+            # Update in the database, as other workers may be updating the same row
+            cls.objects.filter(pk=ledger.pk).update(
+                file_n=F("file_n") + sign * file_n,
+                total_size=F("total_size") +
+                sign * total_sizes[(combo_project, device_type_pk)],
+                modified_on=djtimezone.now())
+
+    @classmethod
+    def rebuild(cls, combo_projects: Optional[list[str]] = None):
+        """
+        Recalculate the ledger from the files that are not in a TAR.
+
+        Args:
+            combo_projects (Optional[list[str]], optional): only recalculate these combo projects.
+            Defaults to None, which recalculates the whole ledger.
+        """
+        from data_models.models import DataFile
+
+        file_objs = DataFile.objects.filter(
+            tar_file__isnull=True, deployment__device__type__isnull=False)
+        ledger_objs = cls.objects.all()
+        if combo_projects is not None:
+            combo_projects = [x or "" for x in combo_projects]
+            combo_project_filter = Q(
+                deployment__combo_project__in=combo_projects)
+            if "" in combo_projects:
+                combo_project_filter |= Q(
+                    deployment__combo_project__isnull=True)
+            file_objs = file_objs.filter(combo_project_filter)
+            ledger_objs = ledger_objs.filter(combo_project__in=combo_projects)
+
+        totals = file_objs.values("deployment__combo_project", "deployment__device__type").annotate(
+            file_n=Count("pk"), total_size=Sum("file_size"))
+
+        with transaction.atomic():
+            ledger_objs.delete()
+            cls.objects.bulk_create([cls(combo_project=x["deployment__combo_project"] or "",
+                                         device_type_id=x["deployment__device__type"],
+                                         file_n=x["file_n"],
+                                         total_size=x["total_size"] or 0)
+                                     for x in totals])
+
+
+restore_status = (
+    (0, 'Pending'),
+    (1, 'Staging'),
+    (2, 'Restoring'),
+    (3, 'Complete'),
+    (4, 'Failed'),
+)
+
+
+class RestoreRequest(BaseModel):
+    """
+    Request to restore archived files. Completed once every TAR holding its files has been restored.
+    """
+    data_files = models.ManyToManyField(
+        "data_models.DataFile", related_name="restore_requests", blank=True)
+    # Serialized celery signature to run once the files have been restored
+    callback = models.JSONField(null=True, blank=True)
+    status = models.IntegerField(choices=restore_status, default=0)
+
+    def __str__(self):
+        return f"Restore request {self.pk}"
+
+
+class TarRestore(BaseModel):
+    """
+    Restore of files from a single TAR. Requests for files in the same TAR are added to the same restore
+    until it starts, so that the TAR is recalled from tape and extracted once.
+    """
+    tar_file = models.ForeignKey(
+        TarFile, related_name="restores", on_delete=models.CASCADE)
+    requests = models.ManyToManyField(
+        RestoreRequest, related_name="tar_restores", blank=True)
+    status = models.IntegerField(choices=restore_status, default=0)
+    attempts = models.IntegerField(default=0)
+    # Error of the last failed attempt
+    message = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.tar_file} restore {self.pk}"
+
+
+span_operations = (
+    (0, 'Create TAR'),
+    (1, 'Upload'),
+    (2, 'Tape recall'),
+    (3, 'Restore'),
+)
+
+
+class ArchiveSpan(models.Model):
+    """
+    Timing of a single archiving operation, such as creating or uploading a TAR, or restoring files from it.
+    """
+    operation = models.IntegerField(choices=span_operations)
+    tar_file = models.ForeignKey(
+        TarFile, related_name="spans", on_delete=models.SET_NULL, null=True, blank=True)
+    tar_restore = models.ForeignKey(
+        TarRestore, related_name="spans", on_delete=models.SET_NULL, null=True, blank=True)
+    started_on = models.DateTimeField(default=djtimezone.now)
+    seconds = models.FloatField(default=0)
+    # Bytes processed by this operation
+    size = models.BigIntegerField(default=0)
+    file_n = models.IntegerField(default=0)
+    success = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [models.Index(
+            fields=['operation', 'started_on'], name='archive_span_operation_idx')]
+
+    def __str__(self):
+        return f"{self.get_operation_display()} {self.tar_file} {self.seconds:.1f}s"
+
+    @property
+    def mb_per_s(self) -> Optional[float]:
+        if self.seconds <= 0:
+            return None
+        return round(self.size / (1024 * 1024) / self.seconds, 2)
+
+    @contextmanager
+    def measure(self) -> Iterator["ArchiveSpan"]:
+        """
+        Time the code run in this context, marking the span as failed if it raises. The span is not saved,
+        so this can be used in a thread that has no database connection.
+        """
+        self.started_on = djtimezone.now()
+        start = time.perf_counter()
+        try:
+            yield self
+        except BaseException:
+            self.success = False
+            raise
+        finally:
+            self.seconds = time.perf_counter() - start
+
+    @classmethod
+    @contextmanager
+    def record(cls, operation: int, **kwargs) -> Iterator["ArchiveSpan"]:
+        """
+        Time the code run in this context and save it as a span. Size and file count can be set on the
+        yielded span.
+
+        Args:
+            operation (int): operation being timed, from span_operations
+            **kwargs: other fields of the span
+        """
+        span = cls(operation=operation, **kwargs)
+        try:
+            with span.measure():
+                yield span
+        finally:
+            span.save()
+
+
 @receiver(pre_delete, sender=TarFile)
 def pre_remove_tar(sender, instance: TarFile, **kwargs):
     success = instance.clean_tar(True)
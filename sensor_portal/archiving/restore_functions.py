@@ -0,0 +1,266 @@
+import logging
+import traceback
+from collections import defaultdict
+from typing import Optional
+
+import paramiko.ssh_exception
+from celery import signature
+from data_models.models import DataFile
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as djtimezone
+
+from .models import ArchiveSpan, RestoreRequest, TarRestore, restore_status
+from .tar_functions import (ONLINE_TAR_STATUSES, find_remote_tar,
+                            restore_files_from_tar)
+
+logger = logging.getLogger(__name__)
+
+
+def request_restore(file_pks: list[int], callback: Optional[dict] = None) -> RestoreRequest:
+    """
+    Request that archived files are restored. The request is added to a pending restore of each TAR holding its
+    files, so that concurrent requests for the same TAR share a single recall and extraction.
+
+    Args:
+        file_pks (list[int]): pks of the files to restore
+        callback (Optional[dict], optional): celery signature to run once the files have been restored.
+        Defaults to None.
+
+    Returns:
+        RestoreRequest: the new restore request
+    """
+    file_objs = DataFile.objects.filter(
+        pk__in=file_pks, archived=True, local_storage=False)
+
+    with transaction.atomic():
+        restore_request = RestoreRequest.objects.create(callback=callback)
+        restore_request.data_files.set(file_objs)
+
+        tar_file_pks = file_objs.values_list(
+            'tar_file__pk', flat=True).distinct()
+        for tar_file_pk in tar_file_pks:
+            # Lock the waiting restore of this TAR, so it cannot start while the request is being added
+            tar_restore = TarRestore.objects.select_for_update().filter(
+                tar_file__pk=tar_file_pk, status__in=[0, 1]).first()
+            if tar_restore is None:
+                tar_restore = TarRestore.objects.create(
+                    tar_file_id=tar_file_pk)
+            tar_restore.requests.add(restore_request)
+
+    logger.info(
+        f"Restore request {restore_request.pk}: {len(file_pks)} files from {len(tar_file_pks)} TARs")
+
+    if len(tar_file_pks) == 0:
+        # Nothing needs restoring
+        finish_restore_request(restore_request)
+
+    return restore_request
+
+
+def schedule_restores():
+    """
+    Check the tape status of the TARs with pending restores. Restores of TARs that are on disk are started, and
+    TARs that are only on tape are recalled, in one recall per archive so that the archive can order reads by tape.
+    """
+    from .tasks import restore_tar_task
+
+    tar_restores_by_archive = defaultdict(list)
+    for tar_restore in TarRestore.objects.filter(status__in=[0, 1]).select_related("tar_file__archive"):
+        tar_restores_by_archive[tar_restore.tar_file.archive].append(
+            tar_restore)
+
+    for archive_obj, tar_restores in tar_restores_by_archive.items():
+        ssh_client = archive_obj.init_ssh_client()
+        if not ssh_client.connect_to_ssh():
+            # The archive may be briefly unavailable, its restores wait for the next round
+            logger.info(f"{archive_obj}: Unable to connect, skip restores")
+            continue
+
+        to_recall = []
+        for tar_restore in tar_restores:
+            try:
+                tar_path, tar_status = find_remote_tar(
+                    ssh_client, tar_restore.tar_file, settings.ARCHIVE_RESTORE_SSH_TRIES)
+            except paramiko.ssh_exception.SSHException as e:
+                # Lost the connection, the remaining restores of this archive wait for the next round
+                logger.info(
+                    f"{archive_obj}: Connection lost, skip restores {repr(e)}")
+                to_recall = []
+                break
+            except Exception as e:
+                retry_tar_restore(tar_restore, repr(e))
+                continue
+
+            if tar_status is None:
+                # The status could not be read, which does not mean the TAR is on tape
+                retry_tar_restore(
+                    tar_restore, f"{tar_path}: Unable to get TAR status")
+            elif tar_status in ONLINE_TAR_STATUSES:
+                # Claim the restore, so that no request is added to it after it starts
+                claimed = TarRestore.objects.filter(
+                    pk=tar_restore.pk, status__in=[0, 1]).update(status=2)
+                if claimed:
+                    logger.info(f"{tar_path}: Online, start restore")
+                    if tar_restore.status == 1:
+                        # Staging started when the restore was last modified
+                        ArchiveSpan.objects.create(operation=2,
+                                                   tar_file=tar_restore.tar_file,
+                                                   tar_restore=tar_restore,
+                                                   started_on=tar_restore.modified_on,
+                                                   seconds=(djtimezone.now() -
+                                                            tar_restore.modified_on).total_seconds(),
+                                                   file_n=1)
+                    restore_tar_task.apply_async([tar_restore.pk])
+            elif tar_status == '(UNM)':
+                # TAR is already being recalled from tape
+                TarRestore.objects.filter(
+                    pk=tar_restore.pk, status=0).update(status=1, modified_on=djtimezone.now())
+            elif tar_restore.status == 0:
+                to_recall.append((tar_restore, tar_path))
+
+        if len(to_recall) > 0:
+            tar_paths = [x[1] for x in to_recall]
+            try:
+                status_code, stdout, stderr = ssh_client.send_ssh_command(
+                    f"daget {' '.join(tar_paths)}", max_tries=settings.ARCHIVE_RESTORE_SSH_TRIES)
+                logger.info(
+                    f"{archive_obj}: Get {len(tar_paths)} TARs from tape {status_code} {stdout}")
+                TarRestore.objects.filter(
+                    pk__in=[x[0].pk for x in to_recall], status=0).update(status=1, modified_on=djtimezone.now())
+            except paramiko.ssh_exception.SSHException as e:
+                # Left waiting, to be recalled in the next round
+                logger.info(
+                    f"{archive_obj}: Connection lost, skip recall {repr(e)}")
+
+        ssh_client.close_connection()
+
+
+def restore_tar(tar_restore: TarRestore, temp_name: str):
+    """
+    Restore the files of all requests waiting on a TAR, in a single pass over the TAR.
+
+    Args:
+        tar_restore (TarRestore): restore to run, which should already be claimed
+        temp_name (str): name of the temporary directory on the archive, if the files must be extracted
+    """
+    tar_file_obj = tar_restore.tar_file
+    # Files restored by an earlier restore of this TAR do not need restoring again
+    file_objs = DataFile.objects.filter(
+        restore_requests__tar_restores=tar_restore, tar_file=tar_file_obj, local_storage=False).distinct()
+
+    if file_objs.exists():
+        ssh_client = tar_file_obj.archive.init_ssh_client()
+        try:
+            tar_path, tar_status = find_remote_tar(ssh_client, tar_file_obj)
+            if tar_status is None:
+                raise Exception(f"{tar_path}: Unable to get TAR status")
+            if tar_status not in ONLINE_TAR_STATUSES:
+                # Migrated back to tape before the restore started, so must be recalled again
+                logger.info(f"{tar_path}: Offline, return to queue")
+                TarRestore.objects.filter(
+                    pk=tar_restore.pk).update(status=0)
+                return
+
+            ftp_connection_success = ssh_client.connect_to_ftp()
+            if not ftp_connection_success:
+                raise Exception("Unable to connect to FTP")
+
+            with ArchiveSpan.record(3, tar_file=tar_file_obj, tar_restore=tar_restore) as span:
+                retrieved_file_objs = restore_files_from_tar(
+                    ssh_client, tar_file_obj, tar_path, file_objs, temp_name)
+                span.file_n = len(retrieved_file_objs)
+                span.size = sum([x.file_size or 0 for x in retrieved_file_objs])
+        except Exception as e:
+            logger.info(f"{tar_file_obj}: Restore failed {repr(e)}")
+            logger.info(traceback.format_exc())
+            retry_tar_restore(tar_restore, repr(e))
+            return
+        finally:
+            ssh_client.close_connection()
+
+    tar_restore.status = 3
+    tar_restore.save()
+    finish_tar_restore(tar_restore)
+
+
+def retry_tar_restore(tar_restore: TarRestore, message: str):
+    """
+    Return a TAR restore that hit an error to the queue, to be tried again, or fail it if it has been tried
+    ARCHIVE_RESTORE_MAX_ATTEMPTS times.
+
+    Args:
+        tar_restore (TarRestore): restore that hit an error
+        message (str): error message
+    """
+    tar_restore.attempts += 1
+    if tar_restore.attempts < settings.ARCHIVE_RESTORE_MAX_ATTEMPTS:
+        logger.info(
+            f"{tar_restore}: Attempt {tar_restore.attempts} failed {message}")
+        tar_restore.status = 0
+        tar_restore.message = message
+        tar_restore.save()
+    else:
+        fail_tar_restore(tar_restore, message)
+
+
+def fail_tar_restore(tar_restore: TarRestore, message: str):
+    """
+    Mark a TAR restore as failed, which fails the requests waiting on it.
+
+    Args:
+        tar_restore (TarRestore): restore that failed
+        message (str): error message
+    """
+    logger.info(f"{tar_restore}: Failed {message}")
+    tar_restore.status = 4
+    tar_restore.message = message
+    tar_restore.save()
+    finish_tar_restore(tar_restore)
+
+
+def finish_tar_restore(tar_restore: TarRestore):
+    """
+    Finish the requests that were waiting on a TAR restore, if they are no longer waiting on any other TAR.
+
+    Args:
+        tar_restore (TarRestore): restore that has finished
+    """
+    for restore_request in tar_restore.requests.filter(status=0):
+        if restore_request.tar_restores.filter(status__in=[0, 1, 2]).exists():
+            continue
+        finish_restore_request(restore_request)
+
+
+def finish_restore_request(restore_request: RestoreRequest):
+    """
+    Run the post download tasks and callback of a restore request whose TARs have all been restored,
+    or the error callbacks if any of them failed.
+
+    Args:
+        restore_request (RestoreRequest): request to finish
+    """
+    from .tasks import post_get_file_from_archive_task
+
+    failed = restore_request.tar_restores.filter(status=4).exists()
+    new_status = 4 if failed else 3
+    # Only one worker should run the callback, if restores finish together
+    claimed = RestoreRequest.objects.filter(
+        pk=restore_request.pk, status=0).update(status=new_status)
+    if not claimed:
+        return
+
+    logger.info(
+        f"Restore request {restore_request.pk}: {dict(restore_status)[new_status]}")
+    if failed:
+        if restore_request.callback is not None:
+            callback = signature(restore_request.callback)
+            for error_callback in callback.options.get("link_error") or []:
+                signature(error_callback).apply_async()
+        return
+
+    file_pks = list(restore_request.data_files.values_list("pk", flat=True))
+    post_get_file_from_archive_task.apply_async([[file_pks]])
+    if restore_request.callback is not None:
+        signature(restore_request.callback).apply_async()
+
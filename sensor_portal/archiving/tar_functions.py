@@ -1,31 +1,56 @@
 
+import gzip
+import hashlib
+import json
 import logging
 import os
+import subprocess
+import tarfile
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from io import BytesIO
 from posixpath import join as posixjoin
+from posixpath import split as posixsplit
+from typing import IO, Iterator, Optional
 
 from data_models.file_handling_functions import group_files_by_size
-from data_models.metadata_functions import metadata_json_from_files
+from data_models.metadata_functions import create_metadata_dict
 from data_models.models import DataFile
 from django.conf import settings
 from django.db.models import QuerySet
-from utils.general import call_with_output, try_remove_file_clean_dirs
+from django.utils import timezone as djtimezone
+from utils.general import try_remove_file_clean_dirs
 from utils.ssh_client import SSH_client
 
-from .bagit_functions import bag_info_from_files
-from .models import Archive, TarFile
+from .bagit_functions import bag_files_from_checksums, get_stored_checksum
+from .models import (Archive, ArchiveLedger, ArchiveSpan, TarFile,
+                     TarFileMember)
 
 logger = logging.getLogger(__name__)
 
+# Archive extension produced by each compression backend
+ARCHIVE_COMPRESSION_FORMATS = {"none": ".tar",
+                               "gzip": ".tar.gz",
+                               "pigz": ".tar.gz",
+                               "zstd": ".tar.zst"}
 
-def create_tar_files(file_pks, archive_pk):
-    file_objs = DataFile.objects.filter(pk__in=file_pks)
+# Tape statuses (from dmls) of a TAR that is on disk and can be read
+ONLINE_TAR_STATUSES = ['(REG)', '(DUL)', '(MIG)']
+
+
+def create_tar_files(combo_project, device_type_pk, archive_pk):
+    file_filter = {"deployment__combo_project": combo_project,
+                   "deployment__device__type__pk": device_type_pk}
 
     # Assign these files to a dummy TAR
     in_progress_tar, created = TarFile.objects.get_or_create(
         name="in_progress", uploading=True)
-    file_objs.update(tar_file=in_progress_tar)
+    DataFile.objects.filter(tar_file__isnull=True,
+                            **file_filter).update(tar_file=in_progress_tar)
+    ArchiveLedger.rebuild([combo_project])
 
+    file_objs = DataFile.objects.filter(tar_file=in_progress_tar, **file_filter)
     file_splits_ok = get_tar_splits(file_objs)
     archive_obj = Archive.objects.get(pk=archive_pk)
 
@@ -34,10 +59,36 @@ def create_tar_files(file_pks, archive_pk):
         file_split_objs = DataFile.objects.filter(pk__in=file_split_pks)
         create_tar_file_and_obj(file_split_objs, archive_obj, idx)
 
+    # Files that were left over, or whose TAR failed, are back in the ledger
+    ArchiveLedger.rebuild([combo_project])
+
+
+def get_archive_compression(file_objs: QuerySet[DataFile]) -> str:
+    """
+    Get the compression to use for a TAR of files, as set on their data type.
+
+    Args:
+        file_objs (QuerySet[DataFile]): files of a single data type
+
+    Returns:
+        str: compression backend, one of ARCHIVE_COMPRESSION_FORMATS
+    """
+    archive_compressed = file_objs.values_list(
+        "deployment__device__type__archive_compressed", flat=True).first()
+    if archive_compressed is False:
+        return "none"
+    return settings.ARCHIVE_COMPRESSION
+
 
 def create_tar_file_and_obj(file_objs, archive_obj, name_suffix=0):
-    success, tar_name, full_tar_path = create_tar_file(
-        file_objs, name_suffix)
+    compression = get_archive_compression(file_objs)
+    with ArchiveSpan.record(0) as span:
+        success, tar_name, full_tar_path, members = create_tar_file(
+            file_objs, name_suffix, compression)
+        span.success = success
+        span.file_n = len(members)
+        if success:
+            span.size = os.path.getsize(full_tar_path)
     if not success:
         # Free data file objects
         file_objs.update(tar_file=None)
@@ -46,18 +97,26 @@ def create_tar_file_and_obj(file_objs, archive_obj, name_suffix=0):
         new_tar_obj = TarFile.objects.create(
             name=tar_name,
             path=os.path.split(full_tar_path)[0],
+            file_format=ARCHIVE_COMPRESSION_FORMATS[compression],
             archive=archive_obj)
+        ArchiveSpan.objects.filter(pk=span.pk).update(tar_file=new_tar_obj)
         file_objs.update(tar_file=new_tar_obj)
+        # Index the members, so they can be found without listing the TAR when restoring
+        TarFileMember.objects.bulk_create(
+            [TarFileMember(tar_file=new_tar_obj, data_file_id=file_pk, path=path, offset=offset, size=size)
+             for file_pk, path, offset, size in members],
+            batch_size=2000)
         return True
 
 
 def get_tar_splits(file_objs):
-    file_splits = group_files_by_size(file_objs)
+    file_splits = group_files_by_size(file_objs, min_size=settings.MIN_ARCHIVE_SIZE_GB)
 
     too_small_split_pks = [
         x for y in file_splits if y["total_size_gb"] < settings.MIN_ARCHIVE_SIZE_GB for x in y['file_pks']]
 
-    # Remove files whose TAR would not be large enough from the in progress tar
+    # Remove files whose TAR would not be large enough from the in progress tar.
+    # These are carried over into the first TAR of a later run.
     too_small_file_objs = DataFile.objects.filter(pk__in=too_small_split_pks)
     n_removed_files = too_small_file_objs.update(tar_file=None)
     logger.info(f"{n_removed_files} in too small a grouping")
@@ -85,11 +144,133 @@ def get_tar_name(file_objs: QuerySet[DataFile], suffix=0):
     return tar_name
 
 
-def create_tar_file(file_objs, name_suffix=0):
+class HashingReader:
+    """
+    Wraps a file so that its md5 checksum is calculated as it is read into a TAR.
+    """
+
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+        self.hash_md5 = hashlib.md5()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.hash_md5.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash_md5.hexdigest()
+
+
+@contextmanager
+def open_compressed_stream(full_tar_path: str, compression: str) -> Iterator[IO[bytes]]:
+    """
+    Open a file for writing, compressing everything written to the returned stream.
+
+    Args:
+        full_tar_path (str): path of the compressed file to write
+        compression (str): compression backend, one of ARCHIVE_COMPRESSION_FORMATS
+
+    Yields:
+        IO[bytes]: stream to write uncompressed bytes to
+    """
+    with open(full_tar_path, "wb") as f:
+        if compression == "none":
+            yield f
+            return
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=f, mode="wb") as gzip_stream:
+                yield gzip_stream
+            return
+
+        threads = str(settings.ARCHIVE_COMPRESSION_THREADS)
+        if compression == "pigz":
+            command = ["pigz", "-p", threads, "-c"]
+        elif compression == "zstd":
+            command = ["zstd", f"-T{threads}", "-q", "-c"]
+        else:
+            raise ValueError(f"Unknown archive compression {compression}")
+
+        # Pipe the TAR stream through a parallel compressor, which writes straight to the file
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f)
+        try:
+            yield process.stdin
+        finally:
+            process.stdin.close()
+            return_code = process.wait()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command)
+
+
+def add_file_to_tar(tar: tarfile.TarFile, file_path: str, arcname: str,
+                    file_size: Optional[int] = None, md5_checksum: Optional[str] = None) -> tuple[str, int, int]:
+    """
+    Add a file to a TAR, calculating its md5 checksum while it is read unless a checksum from ingest can be reused.
+
+    Args:
+        tar (tarfile.TarFile): open TAR to add the file to
+        file_path (str): path of the file to add
+        arcname (str): path of the file inside the TAR
+        file_size (Optional[int]): size of the file in bytes, as stored in the database
+        md5_checksum (Optional[str]): checksum stored in the file's extra_data at ingest
+
+    Returns:
+        tuple[str, int, int]: md5 checksum of the file, offset of the file's data in the uncompressed TAR
+        and size of the file's data
+    """
+    tarinfo = tar.gettarinfo(file_path, arcname)
+    md5_checksum = get_stored_checksum(file_path, file_size, md5_checksum)
+    with open(file_path, "rb") as f:
+        if md5_checksum is None:
+            reader = HashingReader(f)
+            tar.addfile(tarinfo, reader)
+            md5_checksum = reader.hexdigest()
+        else:
+            tar.addfile(tarinfo, f)
+
+    # The TAR offset is now at the end of the file's data, which is padded to a whole number of blocks
+    data_blocks = -(-tarinfo.size // tarfile.BLOCKSIZE)
+    data_offset = tar.offset - data_blocks * tarfile.BLOCKSIZE
+    return md5_checksum, data_offset, tarinfo.size
+
+
+def add_bytes_to_tar(tar: tarfile.TarFile, content: bytes, arcname: str):
+    """
+    Add a file generated in memory to a TAR.
+
+    Args:
+        tar (tarfile.TarFile): open TAR to add the file to
+        content (bytes): contents of the file
+        arcname (str): path of the file inside the TAR
+    """
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(content)
+    tarinfo.mtime = int(time.time())
+    tar.addfile(tarinfo, BytesIO(content))
+
+
+def create_tar_file(file_objs, name_suffix=0,
+                    compression: Optional[str] = None) -> tuple[bool, str, Optional[str], list[tuple[int, str, int, int]]]:
+    """
+    Write a TAR of data files, with bagit and metadata files at its root.
+
+    Args:
+        file_objs (QuerySet[DataFile]): files to add to the TAR
+        name_suffix (int, optional): suffix to add to the TAR name. Defaults to 0.
+        compression (Optional[str], optional): compression backend, one of ARCHIVE_COMPRESSION_FORMATS.
+            Defaults to settings.ARCHIVE_COMPRESSION.
+
+    Returns:
+        tuple[bool, str, Optional[str], list[tuple[int, str, int, int]]]: success, TAR name, full path of the TAR,
+        and the pk, path, data offset and size of each data file in the TAR
+    """
+
+    if compression is None:
+        compression = settings.ARCHIVE_COMPRESSION
 
     # get TAR name
     tar_name = get_tar_name(file_objs, name_suffix)
-    tar_name_format = tar_name+".tar.gz"
+    tar_name_format = tar_name + ARCHIVE_COMPRESSION_FORMATS[compression]
 
     device_type = file_objs.device_type().values_list(
         "device_type", flat=True).first().replace(" ", "")
@@ -100,48 +281,282 @@ def create_tar_file(file_objs, name_suffix=0):
                             datetime.now().strftime("%Y%m%d"))
     os.makedirs(tar_path, exist_ok=True)
     full_tar_path = os.path.join(tar_path, tar_name_format)
-    # get list of file paths
-    relative_paths = file_objs.relative_paths().values_list("relative_path", flat=True)
-
-    metadata_dir_path = os.path.join(tar_path, tar_name)
-    relative_metadata_dir_path = os.path.relpath(
-        metadata_dir_path, settings.FILE_STORAGE_ROOT)
-
-    logger.info(f"{tar_name}: generating bagit data")
-    # Generate bagit metadata
-    all_metadata_paths = bag_info_from_files(file_objs, metadata_dir_path)
-
-    # Generate metadata file
-
-    metadata_json_path = metadata_json_from_files(file_objs, metadata_dir_path)
-
-    all_metadata_paths.append(metadata_json_path)
-
-    relative_metadata_paths = [os.path.relpath(
-        x, settings.FILE_STORAGE_ROOT) for x in all_metadata_paths]
-
-    # TAR files
-    # Use transform command to generate data dir inside the TAR, move metadata files to root
 
-    tar_command = ["tar", "zcvf", full_tar_path,
-                   "--transform", f"s,^,data/,;s,data/{relative_metadata_dir_path}/,,",] + relative_paths + relative_metadata_paths
-    success, output = call_with_output(tar_command, settings.FILE_STORAGE_ROOT)
-
-    # regardless of status, we remove the metadata files
-    [try_remove_file_clean_dirs(x) for x in all_metadata_paths]
-
-    if not success:
+    # Stream file paths from the database, rather than passing them all to a command
+    file_values = file_objs.full_paths().values_list(
+        "pk", "full_path", "relative_path", "file_size", "extra_data__md5_checksum").iterator(chunk_size=2000)
+
+    logger.info(
+        f"{tar_name}: writing TAR with {compression} compression")
+    try:
+        with open_compressed_stream(full_tar_path, compression) as stream, \
+                tarfile.open(fileobj=stream, mode="w|") as tar:
+            # Data files go in the data dir of the bag, checksummed as they are written
+            # so that each file is only read once
+            checksums = []
+            members = []
+            for file_pk, full_path, relative_path, file_size, md5_checksum in file_values:
+                arcname = posixjoin("data", relative_path)
+                md5_checksum, data_offset, data_size = add_file_to_tar(
+                    tar, full_path, arcname, file_size, md5_checksum)
+                checksums.append((md5_checksum, arcname))
+                members.append((file_pk, arcname, data_offset, data_size))
+
+            logger.info(f"{tar_name}: generating bagit data")
+            # Bagit and metadata files go in the root of the TAR
+            bag_files = bag_files_from_checksums(checksums)
+            bag_files["metadata.json"] = json.dumps(
+                create_metadata_dict(file_objs), indent=2)
+            for name, content in bag_files.items():
+                add_bytes_to_tar(tar, content.encode("utf-8"), name)
+
+    except Exception as e:
         logger.info(f"{tar_name}: Error creating TAR")
-        logger.info(output)
-        return False, tar_name, None
+        logger.info(repr(e))
+        try_remove_file_clean_dirs(full_tar_path)
+        return False, tar_name, None, []
+
     logger.info(f"{tar_name}: succesfully created")
-    return True, tar_name, full_tar_path
+    return True, tar_name, full_tar_path, members
 
 
-def check_tar_status(ssh_client: SSH_client, tar_path: str) -> tuple[int, str]:
+def check_tar_status(ssh_client: SSH_client, tar_path: str, max_tries: int = 100) -> tuple[int, str]:
     status_code, stdout, stderr = ssh_client.send_ssh_command(
-        f"dmls -l {posixjoin(tar_path)}")
+        f"dmls -l {posixjoin(tar_path)}", max_tries=max_tries)
     if status_code != 0:
         return status_code, None
     target_tar_status = stdout[0].split(" ")[-2]
     return status_code, target_tar_status
+
+
+def find_remote_tar(ssh_client: SSH_client, tar_file_obj: TarFile, max_tries: int = 100) -> tuple[str, str]:
+    """
+    Find a TAR on the archive and get its tape status.
+
+    Args:
+        ssh_client (SSH_client): client of the archive
+        tar_file_obj (TarFile): TAR to find
+        max_tries (int, optional): attempts at sending each command, reconnecting between them. Defaults to 100.
+
+    Returns:
+        tuple[str, str]: path of the TAR on the archive and its tape status, which is None if it could not be read
+    """
+    tar_path = posixjoin(tar_file_obj.path,
+                         tar_file_obj.name+tar_file_obj.file_format)
+    status_code, target_tar_status = check_tar_status(
+        ssh_client, tar_path, max_tries)
+    logger.info(
+        f"{tar_path}: Get TAR status {status_code}")
+
+    if status_code == 1:
+        # Older TARs may have been uploaded without an extension
+        tar_path = posixjoin(tar_file_obj.path, tar_file_obj.name)
+        status_code, target_tar_status = check_tar_status(
+            ssh_client, tar_path, max_tries)
+        logger.info(
+            f"{tar_path}: Get TAR status  {status_code}")
+        if status_code == 1:
+            raise Exception(f"{tar_path}: TAR file not present at this path")
+
+    logger.info(
+        f"{tar_path}: Get TAR status {status_code} {target_tar_status}")
+    return tar_path, target_tar_status
+
+
+def list_tar_members(ssh_client: SSH_client, tar_path: str, file_objs: QuerySet[DataFile]) -> dict[str, DataFile]:
+    """
+    Find data files in a remote TAR by listing its contents. Used for TARs without a member index.
+
+    Args:
+        ssh_client (SSH_client): connected client of the archive
+        tar_path (str): path of the TAR on the archive
+        file_objs (QuerySet[DataFile]): files to find
+
+    Returns:
+        dict[str, DataFile]: path inside the TAR of each file that was found
+    """
+    file_objs_by_name = {x.file_name+x.file_format: x for x in file_objs}
+
+    status_code, stdout, stderr = ssh_client.send_ssh_command(
+        f"tar tvf {tar_path}", return_strings=False)
+
+    logger.info(f"{tar_path}: List files in TAR")
+
+    in_tar_files = {}
+    for file_line in stdout:
+        # extract the tar output line's filepath
+        split_file_line = file_line.split(" ")
+        line_file_path = split_file_line[-1].replace("\n", "")
+        file_obj = file_objs_by_name.get(posixsplit(line_file_path)[1])
+        if file_obj is not None:
+            # If this file is one of our target file, save the in-tar path
+            in_tar_files[line_file_path] = file_obj
+            logger.info(
+                f"{tar_path}: {len(in_tar_files)}/{len(file_objs_by_name)}")
+
+        if len(in_tar_files) == len(file_objs_by_name):
+            # If we have found all our target_files
+            logger.info(f"{tar_path}: All files_found")
+            break
+
+    return in_tar_files
+
+
+def get_local_file_path(file_obj: DataFile) -> str:
+    """
+    Path to which an archived file is restored, creating its directory.
+    """
+    local_dir = os.path.join(settings.FILE_STORAGE_ROOT, file_obj.path)
+    os.makedirs(local_dir, exist_ok=True)
+    return os.path.join(local_dir, file_obj.file_name+file_obj.file_format)
+
+
+def extract_tar_members(ssh_client: SSH_client, tar_path: str, in_tar_files: dict[str, DataFile],
+                        temp_path: str) -> list[DataFile]:
+    """
+    Restore files from a remote TAR by extracting them to a temporary directory on the archive and copying them back.
+
+    Args:
+        ssh_client (SSH_client): client of the archive, connected to FTP
+        tar_path (str): path of the TAR on the archive
+        in_tar_files (dict[str, DataFile]): path inside the TAR of each file to restore
+        temp_path (str): temporary directory on the archive to extract to
+
+    Returns:
+        list[DataFile]: files that were restored
+    """
+    ssh_client.mkdir_p(temp_path)
+
+    # Extract all target files in a single pass over the TAR, reading their paths from a file
+    member_list_path = posixjoin(temp_path, "members.txt")
+    with ssh_client.ftp_sftp.open(member_list_path, "w") as f:
+        f.write("".join([f"{x}\n" for x in in_tar_files.keys()]))
+    logger.info(f"{tar_path}: Extract {len(in_tar_files)} files")
+    # tar detects the compression (gzip or zstd) from the archive itself
+    status_code, stdout, stderr = ssh_client.send_ssh_command(
+        f"tar -xvf {tar_path} -C {temp_path} -T {member_list_path}"
+    )
+    logger.info(
+        f"{tar_path}: Extract {len(in_tar_files)} files {status_code}")
+
+    ssh_client.connect_to_scp()
+    retrieved_file_objs = []
+    for in_tar_file_path, file_obj in in_tar_files.items():
+        try:
+            local_file_path = get_local_file_path(file_obj)
+            temp_file_path = posixjoin(temp_path, in_tar_file_path)
+            if not os.path.exists(local_file_path):
+                ssh_client.scp_c.get(
+                    temp_file_path, local_file_path, preserve_times=True)
+            retrieved_file_objs.append(file_obj)
+        except Exception as e:
+            logger.info(f"{tar_path}: Error retrieving file: {repr(e)}")
+
+    logger.info(f"{tar_path}: Clear temporary files")
+    status_code, stdout, stderr = ssh_client.send_ssh_command(
+        f"rm -rf {temp_path}")
+
+    return retrieved_file_objs
+
+
+def read_tar_members(ssh_client: SSH_client, tar_path: str, in_tar_files: dict[str, DataFile],
+                     member_ranges: dict[str, tuple[int, int]]) -> list[DataFile]:
+    """
+    Restore files from a remote uncompressed TAR by reading only their bytes, using the offsets in the member index.
+
+    Args:
+        ssh_client (SSH_client): client of the archive, connected to FTP
+        tar_path (str): path of the TAR on the archive
+        in_tar_files (dict[str, DataFile]): path inside the TAR of each file to restore
+        member_ranges (dict[str, tuple[int, int]]): offset and size of each file's data in the TAR
+
+    Returns:
+        list[DataFile]: files that were restored
+    """
+    buffer_size = settings.FILE_INGEST_BUFFER_SIZE
+    retrieved_file_objs = []
+    with ssh_client.ftp_sftp.open(tar_path, "rb") as remote_tar:
+        # Read in order of offset, so the remote file is read forwards
+        for in_tar_file_path in sorted(in_tar_files.keys(), key=lambda x: member_ranges[x][0]):
+            file_obj = in_tar_files[in_tar_file_path]
+            offset, size = member_ranges[in_tar_file_path]
+            try:
+                local_file_path = get_local_file_path(file_obj)
+                if not os.path.exists(local_file_path):
+                    # Write to a partial file, so an interrupted read does not leave a truncated file
+                    partial_file_path = local_file_path+".part"
+                    remote_tar.seek(offset)
+                    with open(partial_file_path, "wb") as f:
+                        remaining = size
+                        while remaining > 0:
+                            chunk = remote_tar.read(
+                                min(buffer_size, remaining))
+                            if not chunk:
+                                raise EOFError(
+                                    f"{in_tar_file_path} is truncated")
+                            f.write(chunk)
+                            remaining -= len(chunk)
+                    os.replace(partial_file_path, local_file_path)
+                retrieved_file_objs.append(file_obj)
+            except Exception as e:
+                logger.info(f"{tar_path}: Error retrieving file: {repr(e)}")
+
+    return retrieved_file_objs
+
+
+def restore_files_from_tar(ssh_client: SSH_client, tar_file_obj: TarFile, tar_path: str,
+                           file_objs: QuerySet[DataFile], temp_name: str) -> list[DataFile]:
+    """
+    Restore files from an online TAR on the archive, and record them as being in local storage.
+
+    Args:
+        ssh_client (SSH_client): client of the archive, connected to FTP
+        tar_file_obj (TarFile): TAR containing the files
+        tar_path (str): path of the TAR on the archive
+        file_objs (QuerySet[DataFile]): files to restore
+        temp_name (str): name of the temporary directory on the archive, if the files must be extracted
+
+    Returns:
+        list[DataFile]: files that were restored
+    """
+    member_ranges = {}
+    if tar_file_obj.members.exists():
+        # Look up target files in the TAR's member index
+        file_objs_by_pk = {x.pk: x for x in file_objs}
+        in_tar_files = {}
+        for path, data_file_pk, offset, size in tar_file_obj.members.filter(
+                data_file__pk__in=file_objs_by_pk.keys()).values_list("path", "data_file__pk", "offset", "size"):
+            in_tar_files[path] = file_objs_by_pk[data_file_pk]
+            if offset is not None:
+                member_ranges[path] = (offset, size)
+    else:
+        # TARs created before the member index must be listed
+        in_tar_files = list_tar_members(ssh_client, tar_path, file_objs)
+
+    if len(in_tar_files) == 0:
+        raise Exception(f"{tar_path}: No files found in TAR")
+    else:
+        found_file_pks = set([x.pk for x in in_tar_files.values()])
+        missing_files = [
+            x.file_name for x in file_objs if x.pk not in found_file_pks]
+        if len(missing_files) > 0:
+            logger.info(f"{tar_path}: Files not found: {missing_files}")
+
+    if tar_file_obj.file_format == ".tar" and len(member_ranges) == len(in_tar_files):
+        # Uncompressed TAR, so files can be read straight from it
+        logger.info(f"{tar_path}: Read {len(in_tar_files)} files")
+        retrieved_file_objs = read_tar_members(
+            ssh_client, tar_path, in_tar_files, member_ranges)
+    else:
+        retrieved_file_objs = extract_tar_members(
+            ssh_client, tar_path, in_tar_files, posixjoin(tar_file_obj.path, "temp", temp_name))
+
+    for file_obj in retrieved_file_objs:
+        file_obj.modified_on = djtimezone.now()
+        file_obj.local_path = settings.FILE_STORAGE_ROOT
+        file_obj.local_storage = True
+    logger.info(f"{tar_path}: Update database")
+    DataFile.objects.bulk_update(retrieved_file_objs, fields=[
+                                 "local_path", "local_storage", "modified_on"])
+
+    return retrieved_file_objs
@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+import pytest
+from archiving.models import ArchiveSpan, TarFile
+from django.utils import timezone as djtimezone
+from rest_framework.test import APIClient
+from user_management.factories import UserFactory
+
+
+@pytest.fixture
+def admin_api_client(db):
+    api_client = APIClient()
+    api_client.force_authenticate(user=UserFactory(is_staff=True))
+    yield api_client
+    api_client.force_authenticate(user=None)
+
+
+@pytest.fixture
+def archive_spans(db):
+    """
+    A create and an upload span of one TAR, and an older upload span of another.
+    """
+    tar_file = TarFile.objects.create(name="test_tar")
+    other_tar_file = TarFile.objects.create(name="other_test_tar")
+    now = djtimezone.now()
+    return [ArchiveSpan.objects.create(operation=0, tar_file=tar_file, started_on=now,
+                                       seconds=2, size=4 * 1024 * 1024, file_n=3),
+            ArchiveSpan.objects.create(operation=1, tar_file=tar_file, started_on=now,
+                                       seconds=1, size=4 * 1024 * 1024, file_n=1),
+            ArchiveSpan.objects.create(operation=1, tar_file=other_tar_file, started_on=now - timedelta(days=2),
+                                       seconds=1, size=1024 * 1024, file_n=1, success=False)]
+
+
+@pytest.mark.django_db
+def test_archive_spans(admin_api_client, archive_spans):
+    """
+    Test: Are archiving timing spans totalled, and filtered by the query parameters?
+    """
+    api_url = '/api/archive/spans'
+    response = admin_api_client.get(api_url)
+    assert response.status_code == 200
+    assert len(response.data["spans"]) == 3
+    create_total = [x for x in response.data["totals"]
+                    if x["operation"] == "Create TAR"][0]
+    assert create_total["file_n"] == 3
+    assert create_total["mb_per_s"] == 2
+
+    response = admin_api_client.get(api_url, {"operation": 1})
+    assert response.status_code == 200
+    assert {x["operation"] for x in response.data["spans"]} == {"Upload"}
+    assert len(response.data["spans"]) == 2
+
+    response = admin_api_client.get(
+        api_url, {"tar_file": archive_spans[0].tar_file.pk})
+    assert response.status_code == 200
+    assert len(response.data["spans"]) == 2
+
+    response = admin_api_client.get(
+        api_url, {"started_after": (djtimezone.now() - timedelta(days=1)).isoformat()})
+    assert response.status_code == 200
+    assert len(response.data["spans"]) == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("query_params", [{"operation": "abc"},
+                                          {"operation": 9},
+                                          {"tar_file": "abc"},
+                                          {"restore_request": "abc"},
+                                          {"started_after": "not a date"}])
+def test_archive_spans_invalid_filter(admin_api_client, query_params):
+    """
+    Test: Are invalid query parameters rejected, rather than raising an error?
+    """
+    response = admin_api_client.get('/api/archive/spans', query_params)
+    assert response.status_code == 400
+    assert list(query_params.keys())[0] in response.data
+
+
+@pytest.mark.django_db
+def test_archive_metrics(admin_api_client, archive_spans):
+    """
+    Test: Are the totals of archiving timing spans exported as Prometheus counters?
+    """
+    response = admin_api_client.get('/api/archive/metrics')
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    metrics = response.content.decode()
+    assert 'archive_operations_total{operation="upload",success="true"} 1' in metrics
+    assert 'archive_operations_total{operation="upload",success="false"} 1' in metrics
+    assert 'archive_operation_files_total{operation="create_tar",success="true"} 3' in metrics
+
+
+@pytest.mark.django_db
+def test_archive_spans_admin_only(api_client_with_credentials):
+    """
+    Test: Are archiving timing spans only available to admins?
+    """
+    assert api_client_with_credentials.get(
+        '/api/archive/spans').status_code == 403
+    assert api_client_with_credentials.get(
+        '/api/archive/metrics').status_code == 403
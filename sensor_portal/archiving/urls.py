@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import ArchiveMetricsView, ArchiveSpanView
+
+urlpatterns = [
+    path('archive/spans', ArchiveSpanView, name='archive_spans'),
+    path('archive/metrics', ArchiveMetricsView, name='archive_metrics'),
+]
@@ -0,0 +1,52 @@
+from django.http import HttpResponse
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .filtersets import ArchiveSpanFilter
+from .functions import archive_span_metrics, get_archive_span_totals
+from .models import ArchiveSpan
+
+
+@extend_schema(
+    exclude=True
+)
+@api_view()
+@permission_classes([IsAdminUser])
+def ArchiveSpanView(request):
+    """
+    Return the totals and most recent of the archiving timing spans.
+    Can be filtered by operation, tar_file, restore_request and started_after.
+    """
+    span_filter = ArchiveSpanFilter(
+        request.query_params, queryset=ArchiveSpan.objects.all())
+    if not span_filter.is_valid():
+        return Response(span_filter.errors, status=status.HTTP_400_BAD_REQUEST)
+    span_objs = span_filter.qs
+    recent_spans = [{"operation": x.get_operation_display(),
+                     "tar_file": x.tar_file_id,
+                     "tar_restore": x.tar_restore_id,
+                     "started_on": x.started_on,
+                     "seconds": x.seconds,
+                     "size": x.size,
+                     "file_n": x.file_n,
+                     "mb_per_s": x.mb_per_s,
+                     "success": x.success}
+                    for x in span_objs.order_by("-started_on")[:500]]
+    return Response({"totals": get_archive_span_totals(span_objs),
+                     "spans": recent_spans})
+
+
+@extend_schema(
+    exclude=True
+)
+@api_view()
+@permission_classes([IsAdminUser])
+def ArchiveMetricsView(request):
+    """
+    Return the totals of the archiving timing spans as Prometheus counters.
+    """
+    return HttpResponse(archive_span_metrics(ArchiveSpan.objects.all()),
+                        content_type="text/plain; version=0.0.4")
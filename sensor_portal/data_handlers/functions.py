@@ -2,17 +2,88 @@ import logging
 import os
 from datetime import datetime as dt
 
+from django.conf import settings
 from PIL import ExifTags, Image, TiffImagePlugin, UnidentifiedImageError
 
 logger = logging.getLogger(__name__)
 
 
+def read_exif_segment(file_obj, max_bytes=None):
+    """
+    Read the raw EXIF APP1 segment of a JPEG without decoding the image.
+
+    Args:
+        file_obj: Seekable binary file-like object.
+        max_bytes (int, optional): Stop searching for the segment after this many bytes.
+            Defaults to settings.DATA_HANDLER_EXIF_MAX_BYTES.
+
+    Returns:
+        bytes or None: The APP1 segment payload (starting with b"Exif\x00\x00"),
+        or None if the file is not a JPEG or no EXIF segment was found within max_bytes.
+    """
+    if max_bytes is None:
+        max_bytes = settings.DATA_HANDLER_EXIF_MAX_BYTES
+
+    start_position = file_obj.tell()
+    try:
+        file_obj.seek(0)
+        if file_obj.read(2) != b"\xff\xd8":
+            # Not a JPEG
+            return None
+
+        while file_obj.tell() < max_bytes:
+            if file_obj.read(1) != b"\xff":
+                return None
+            # Markers may be preceded by any number of 0xFF fill bytes
+            marker_type = file_obj.read(1)
+            while marker_type == b"\xff" and file_obj.tell() < max_bytes:
+                marker_type = file_obj.read(1)
+            if len(marker_type) < 1 or marker_type == b"\xff":
+                return None
+            marker_type = marker_type[0]
+            # Start of scan or end of image, no more metadata segments
+            if marker_type in (0xDA, 0xD9):
+                return None
+            # Markers without a length
+            if marker_type == 0x01 or 0xD0 <= marker_type <= 0xD7:
+                continue
+
+            segment_length = file_obj.read(2)
+            if len(segment_length) < 2:
+                return None
+            segment_length = int.from_bytes(segment_length, "big") - 2
+            if segment_length < 0:
+                # The length includes its own 2 bytes, so this is not a valid segment
+                return None
+
+            if marker_type == 0xE1:
+                segment = file_obj.read(segment_length)
+                if len(segment) < segment_length:
+                    # Truncated file
+                    return None
+                if segment[:6] == b"Exif\x00\x00":
+                    return segment
+            else:
+                file_obj.seek(segment_length, os.SEEK_CUR)
+
+        return None
+    finally:
+        file_obj.seek(start_position)
+
+
 def open_exif(uploaded_file):
     try:
         si = uploaded_file.file
-        image = Image.open(si)
+        # Fast path, read only the EXIF segment of JPEGs
+        exif_segment = read_exif_segment(si)
+        if exif_segment is not None:
+            exif = Image.Exif()
+            exif.load(exif_segment)
+        else:
+            image = Image.open(si)
+            exif = image.getexif()
         image_exif = {ExifTags.TAGS[k]: v for k,
-                      v in image.getexif().items() if k in ExifTags.TAGS}
+                      v in exif.items() if k in ExifTags.TAGS}
 
         return image_exif
     except OSError:
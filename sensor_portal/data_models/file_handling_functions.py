@@ -1,17 +1,27 @@
+import hashlib
 import itertools
 import logging
 import os
+import re
+import shutil
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from datetime import datetime as dt
-from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+from typing import IO, TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from celery import chain
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import UploadedFile
+from django.db import connection, transaction
 from django.db.models import QuerySet
 from django.utils import timezone as djtimezone
 from rest_framework import status
-from utils.general import convert_unit, get_md5
+from utils.general import (convert_unit, get_md5,
+                           try_remove_file_clean_dirs)
 
 from sensor_portal.celery import app
 
@@ -21,7 +31,9 @@ logger = logging.getLogger(__name__)
 
 # To avoid ciruclar imports
 if TYPE_CHECKING:
-    from data_models.models import DataFile, Deployment, Device
+    from data_handlers.base_data_handler_class import DataTypeHandler
+    from data_models.models import (DataFile, DataType, Deployment, Device,
+                                    IngestJob, UploadSession)
     from user_management.models import User
 
 
@@ -74,7 +86,8 @@ def create_file_objects(
         - Supports automated tasks and checksum validation for multipart uploads.
     """
 
-    from data_models.models import DataFile, DataType, ProjectJob
+    from archiving.models import ArchiveLedger
+    from data_models.models import DataFile, DataType, Deployment, ProjectJob
 
     invalid_files = []
     existing_files = []
@@ -150,9 +163,11 @@ def create_file_objects(
                 logger.info(
                     "Checking for duplicate filenames in the database...")
 
-            # Query the database for filenames that already exist
-            db_filenames = list(
-                DataFile.objects.filter(original_name__in=filenames).values_list('original_name', flat=True))
+            # Query the database for filenames that already exist on this device
+            if device_object is None and deployment_object:
+                device_object = deployment_object.device
+            db_filenames = find_existing_names(
+                filenames, device=device_object)
 
             # Identify files that are not duplicated
             not_duplicated = [x not in db_filenames for x in filenames]
@@ -235,13 +250,9 @@ def create_file_objects(
                     extra_data = [x for x, y in zip(
                         extra_data, valid_files_bool) if y]
 
-            # Initialize lists to store updated metadata for valid files
-            new_recording_dt = []
-            new_extra_data = []
-            new_data_types = []
-            new_tasks = []
-
-            # Process each valid file using the data handler
+            # Gather recording_dt and extra_data for each valid file
+            file_recording_dts = []
+            file_extra_datas = []
             for i in range(len(files)):
                 # Retrieve extra_data for the current file
                 if len(extra_data) > 1:
@@ -257,26 +268,28 @@ def create_file_objects(
                 else:
                     file_recording_dt = recording_dt[0]
 
-                file = files[i]
+                file_recording_dts.append(file_recording_dt)
+                # Copy extra_data, as handlers update it in place and it may be shared between files
+                file_extra_datas.append(dict(file_extra_data or {}))
 
-                if verbose:
-                    logger.info(
-                        f"Handling file {file.name} with data handler...")
-
-                # Use the data handler to process the file and extract updated metadata
-                new_file_recording_dt, new_file_extra_data, new_file_data_type, new_file_task = \
-                    data_handler.handle_file(
-                        file,
-                        file_recording_dt,
-                        file_extra_data,
-                        device_model_object.type.name
-                    )
-
-                # Append the updated metadata to the respective lists
-                new_recording_dt.append(new_file_recording_dt)
-                new_extra_data.append(new_file_extra_data)
-                new_data_types.append(new_file_data_type)
-                new_tasks.append(new_file_task)
+            if verbose:
+                logger.info(
+                    f"Handling {len(files)} files with data handler...")
+
+            # Use the data handler to process the files and extract updated metadata
+            handler_results = handle_files(
+                data_handler,
+                files,
+                file_recording_dts,
+                file_extra_datas,
+                device_model_object.type.name
+            )
+
+            # Unpack the updated metadata into the respective lists
+            new_recording_dt = [x[0] for x in handler_results]
+            new_extra_data = [x[1] for x in handler_results]
+            new_data_types = [x[2] for x in handler_results]
+            new_tasks = [x[3] for x in handler_results]
 
             # Update recording_dt, extra_data, data_types, and handler_tasks with the processed values
             recording_dt = new_recording_dt
@@ -332,8 +345,8 @@ def create_file_objects(
             logger.info(
                 "Determining deployments from device_object and recording dates...")
         # Use the device object to find deployments based on recording dates
-        deployment_objects = [device_object.deployment_from_date(
-            x) for x in recording_dt]
+        deployment_objects = device_object.deployments_for_dates(
+            recording_dt)
         # Check which deployments are valid (not None)
         file_valid = [x is not None for x in deployment_objects]
         # Filter out None values from deployment_objects
@@ -380,312 +393,522 @@ def create_file_objects(
     all_new_objects = []
     all_handler_tasks = []
 
-    # Process each valid file
+    # Determine the deployment object and data type for each file
+    file_deployments = []
+    file_data_types = []
+    # Data types are looked up once per name in the batch
+    data_type_memo = {}
     for i in range(len(files)):
-        file = files[i]
-        filename = file.name
-
-        # Determine the deployment object for the current file
         if len(deployment_objects) > 1:
             file_deployment = deployment_objects[i]
         else:
             file_deployment = deployment_objects[0]
 
+        if data_types is None:
+            file_data_type = file_deployment.device_type
+        else:
+            if len(data_types) > 1:
+                data_type_name = data_types[i]
+            else:
+                data_type_name = data_types[0]
+            if data_type_name not in data_type_memo:
+                data_type_memo[data_type_name], created = DataType.objects.get_or_create(
+                    name=data_type_name)
+            file_data_type = data_type_memo[data_type_name]
+
+        file_deployments.append(file_deployment)
+        file_data_types.append(file_data_type)
+
+    # Permissions and project tasks only depend on the deployment, so resolve them once per deployment
+    deployment_perm_memo = {}
+    deployment_task_pks = {x.pk: [] for x in file_deployments}
+    deployment_task_values = Deployment.objects.filter(pk__in=list(deployment_task_pks.keys())).values_list(
+        'pk', 'project__automated_tasks__pk')
+    for deployment_pk, task_pk in deployment_task_values:
+        if task_pk is not None:
+            deployment_task_pks[deployment_pk].append(task_pk)
+
+    # Reserve file numbers for new files in one go, rather than counting files on disk per file
+    if not multipart or (multipart and multipart_obj is None):
         if verbose:
-            logger.info(
-                f"Processing file: {filename} for deployment: {file_deployment.deployment_device_ID}")
+            logger.info("Reserving file numbers for new files...")
+        file_numbers = reserve_file_numbers(
+            file_data_types, file_deployments, upload_dt.date())
+
+    # File numbers are reserved before the files are written in a transaction, so that the counters are
+    # not locked while the files are written
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Remove db limits during this function.
+        cursor.execute('SET LOCAL statement_timeout TO 0;')
+
+        # Files that passed the per-file checks, waiting to be validated and saved
+        pending_files = []
+
+        # Process each valid file
+        for i in range(len(files)):
+            file = files[i]
+            filename = file.name
+            file_deployment = file_deployments[i]
+            file_data_type = file_data_types[i]
 
-        # Check if the user has permission to attach the file to the deployment
-        if request_user:
-            if not request_user.has_perm('data_models.change_deployment', file_deployment):
-                if verbose:
-                    logger.info(
-                        f"User does not have permission to attach file {filename} to {file_deployment.deployment_device_ID}.")
-                invalid_files.append(
-                    {filename: {"message": f"Not allowed to attach files to {file_deployment.deployment_device_ID}", "status": 403}})
-                continue
+            if verbose:
+                logger.info(
+                    f"Processing file: {filename} for deployment: {file_deployment.deployment_device_ID}")
+
+            # Check if the user has permission to attach the file to the deployment
+            if request_user:
+                if file_deployment.pk not in deployment_perm_memo:
+                    deployment_perm_memo[file_deployment.pk] = request_user.has_perm(
+                        'data_models.change_deployment', file_deployment)
+                if not deployment_perm_memo[file_deployment.pk]:
+                    if verbose:
+                        logger.info(
+                            f"User does not have permission to attach file {filename} to {file_deployment.deployment_device_ID}.")
+                    invalid_files.append(
+                        {filename: {"message": f"Not allowed to attach files to {file_deployment.deployment_device_ID}", "status": 403}})
+                    continue
+
+            # Determine the recording datetime for the current file
+            if len(recording_dt) > 1:
+                file_recording_dt = recording_dt[i]
+            else:
+                file_recording_dt = recording_dt[0]
 
-        # Determine the recording datetime for the current file
-        if len(recording_dt) > 1:
-            file_recording_dt = recording_dt[i]
-        else:
-            file_recording_dt = recording_dt[0]
+            # Retrieve the handler task for the current file, if available
+            if handler_tasks is not None:
+                file_handler_task = handler_tasks[i]
+            else:
+                file_handler_task = None
 
-        # Retrieve the handler task for the current file, if available
-        if handler_tasks is not None:
-            file_handler_task = handler_tasks[i]
-        else:
-            file_handler_task = None
+            if verbose:
+                logger.info(
+                    f"Localizing recording date time for file: {filename}...")
+            # Localize the recording datetime based on the deployment's timezone
+            file_recording_dt = check_dt(
+                file_recording_dt, file_deployment.time_zone)
+
+            # Retrieve extra data for the current file
+            if len(extra_data) > 1:
+                file_extra_data = extra_data[i]
+            else:
+                file_extra_data = extra_data[0]
 
-        if verbose:
-            logger.info(
-                f"Localizing recording date time for file: {filename}...")
-        # Localize the recording datetime based on the deployment's timezone
-        file_recording_dt = check_dt(
-            file_recording_dt, file_deployment.time_zone)
+            if verbose:
+                logger.info(f"Setting local path for file: {filename}...")
+            # Set the local path for the file based on the storage root
+            file_local_path = os.path.join(settings.FILE_STORAGE_ROOT)
 
-        # Retrieve extra data for the current file
-        if len(extra_data) > 1:
-            file_extra_data = extra_data[i]
-        else:
-            file_extra_data = extra_data[0]
+            # Check if the file is not part of a multipart upload or if it's a new multipart object
+            if not multipart or (multipart and multipart_obj is None):
 
-        # Determine the data type for the current file
-        if data_types is None:
-            file_data_type = file_deployment.device_type
-        else:
-            if len(data_types) > 1:
-                file_data_type, created = DataType.objects.get_or_create(
-                    name=data_types[i])
-            else:
-                file_data_type, created = DataType.objects.get_or_create(
-                    name=data_types[0])
+                # Log the process of setting the path for the file
+                if verbose:
+                    logger.info(f"Setting path for file: {filename}...")
 
-        if verbose:
-            logger.info(f"Setting local path for file: {filename}...")
-        # Set the local path for the file based on the storage root
-        file_local_path = os.path.join(settings.FILE_STORAGE_ROOT)
+                # Construct the file path using the data type name, deployment device ID, and upload date
+                file_path = os.path.join(file_data_type.name,
+                                         file_deployment.deployment_device_ID, str(upload_dt.date()))
 
-        # Check if the file is not part of a multipart upload or if it's a new multipart object
-        if not multipart or (multipart and multipart_obj is None):
+                # Extract the file extension from the original filename
+                file_extension = os.path.splitext(filename)[1]
 
-            # Log the process of setting the path for the file
-            if verbose:
-                logger.info(f"Setting path for file: {filename}...")
+                # Generate a new unique name for the file based on deployment, recording datetime, and reserved file number
+                new_file_name = get_new_name(file_deployment,
+                                             file_recording_dt,
+                                             file_numbers[i]
+                                             )
+
+                # Get the size of the file
+                file_size = file.size
 
-            # Construct the file path using the data type name, deployment device ID, and upload date
-            file_path = os.path.join(file_data_type.name,
-                                     file_deployment.deployment_device_ID, str(upload_dt.date()))
+                # Construct the full path where the file will be stored locally
+                file_fullpath = os.path.join(
+                    file_local_path, file_path, f"{new_file_name}{file_extension}")
 
-            # Extract the file extension from the original filename
-            file_extension = os.path.splitext(filename)[1]
+                # Log the creation of the database object for the file
+                if verbose:
+                    logger.info(f"Creating database object for: {filename}...")
+
+                # If the file is part of a multipart upload, mark it as incomplete in the extra data
+                if multipart:
+                    file_extra_data["multipart_complete"] = False
+
+                # Create a new DataFile object with all the relevant metadata
+                new_datafile_obj = DataFile(
+                    deployment=file_deployment,  # Associated deployment
+                    file_type=file_data_type,  # Type of the file
+                    file_name=new_file_name,  # Generated unique name for the file
+                    original_name=filename,  # Original name of the file
+                    file_format=file_extension,  # File extension
+                    upload_dt=upload_dt,  # Upload datetime
+                    recording_dt=file_recording_dt,  # Recording datetime
+                    path=file_path,  # Relative path for the file
+                    local_path=file_local_path,  # Local storage path
+                    file_size=file_size,  # Size of the file
+                    extra_data=file_extra_data  # Additional metadata
+                )
 
-            # Generate a new unique name for the file based on deployment, recording datetime, and file count
-            new_file_name = get_new_name(file_deployment,
-                                         file_recording_dt,
-                                         file_local_path,
-                                         file_path
-                                         )
+            else:
+                # Retrieve the full path for the multipart object
+                file_fullpath = multipart_obj.full_path()
+                new_datafile_obj = None
 
-            # Get the size of the file
-            file_size = file.size
+            pending_files.append((file, filename, file_deployment, file_handler_task,
+                                  new_datafile_obj, file_fullpath))
 
-            # Construct the full path where the file will be stored locally
-            file_fullpath = os.path.join(
-                file_local_path, file_path, f"{new_file_name}{file_extension}")
+        # Validate all new DataFile objects together, before any files are written
+        new_datafile_objs = [x[4] for x in pending_files if x[4] is not None]
+        if verbose:
+            logger.info(f"Validating {len(new_datafile_objs)} new DataFile objects...")
+        datafile_errors = iter(validate_new_datafiles(new_datafile_objs))
+
+        # Save each valid file
+        for file, filename, file_deployment, file_handler_task, new_datafile_obj, file_fullpath in pending_files:
+            if new_datafile_obj is not None:
+                validation_error = next(datafile_errors)
+                if validation_error is not None:
+                    if verbose:
+                        logger.info(
+                            f"Error creating database objects for: {filename}...")
+                    # Add the file to the invalid_files list with a detailed error message
+                    invalid_files.append(
+                        {filename: {"message": f"Error creating database records {repr(validation_error)}", "status": 400}})
+                    # Skip further processing for this file
+                    continue
 
-            # Log the creation of the database object for the file
-            if verbose:
-                logger.info(f"Creating database object for: {filename}...")
-
-            # If the file is part of a multipart upload, mark it as incomplete in the extra data
-            if multipart:
-                file_extra_data["multipart_complete"] = False
-
-            # Create a new DataFile object with all the relevant metadata
-            new_datafile_obj = DataFile(
-                deployment=file_deployment,  # Associated deployment
-                file_type=file_data_type,  # Type of the file
-                file_name=new_file_name,  # Generated unique name for the file
-                original_name=filename,  # Original name of the file
-                file_format=file_extension,  # File extension
-                upload_dt=upload_dt,  # Upload datetime
-                recording_dt=file_recording_dt,  # Recording datetime
-                path=file_path,  # Relative path for the file
-                local_path=file_local_path,  # Local storage path
-                file_size=file_size,  # Size of the file
-                extra_data=file_extra_data  # Additional metadata
-            )
             try:
-                # Validate the new DataFile object to ensure all fields meet the model's constraints
-                new_datafile_obj.full_clean()
-            except ValidationError as e:
-                # Handle validation errors specific to the DataFile model
                 if verbose:
-                    logger.info(
-                        f"Error creating database objects for: {filename}...")
-                # Add the file to the invalid_files list with a detailed error message
-                invalid_files.append(
-                    {filename: {"message": f"Error creating database records {repr(e)}", "status": 400}})
-                # Skip further processing for this file
-                continue
+                    logger.info(f"Saving file to path: {file_fullpath}...")
+                # Try to save the file
+                file_checksums = handle_uploaded_file(
+                    file, file_fullpath, multipart, verbose)
             except Exception as e:
-                # Handle any other unexpected exceptions during validation
+                if verbose:
+                    logger.info(
+                        f"Error handling uploaded file for: {filename} - {repr(e)}")
                 invalid_files.append(
                     {filename: {"message": repr(e), "status": 400}})
-                # Skip further processing for this file
+                if multipart:
+                    # This is a complete failure when multipart
+                    return (uploaded_files, invalid_files, existing_files, status.HTTP_400_BAD_REQUEST)
+
                 continue
 
-        else:
-            # Retrieve the full path for the multipart object
-            file_fullpath = multipart_obj.full_path()
+            if not multipart or (multipart and multipart_obj is None):
+                # Set the file URL when first registered in the database
+                if verbose:
+                    logger.info(f"Setting file URL for: {filename}...")
+                new_datafile_obj.set_file_url()
+                if not multipart:
+                    # Store the checksums computed while writing, so they never need recomputing
+                    new_datafile_obj.extra_data = {
+                        **new_datafile_obj.extra_data, **file_checksums}
+                all_new_objects.append(new_datafile_obj)
+
+            # If a single file or a completing (checksum received) multipart
+            if not multipart or (multipart and multipart_checksum is not None):
+                # Flag to append tasks for processing
+                append_tasks = True
+
+                if multipart:
+                    # Perform MD5 checksum validation for multipart file uploads
+                    if verbose:
+                        logger.info(
+                            f"Performing MD5 checksum validation for multipart file: {multipart_obj.original_name}...")
+                    # Calculate the server-side checksum of the uploaded file
+                    server_checksum = get_md5(multipart_obj.full_path())
+                    if verbose:
+                        logger.info(
+                            f"Server checksum: {server_checksum}, Client checksum: {multipart_checksum}")
+                    # Compare the server checksum with the client-provided checksum
+                    if not multipart_checksum == server_checksum:
+                        # If the checksums do not match, log the mismatch and add an error to invalid_files
+                        if verbose:
+                            logger.info(
+                                f"Checksum mismatch for multipart file: {multipart_obj.original_name}")
+                        invalid_files += [{multipart_obj.original_name: {
+                            "message": "Multipart file upload checksum mismatch", "status": 400}}]
+                        # Return early with an HTTP 400 Bad Request status
+                        return (uploaded_files, invalid_files, existing_files, status.HTTP_400_BAD_REQUEST)
+                    else:
+                        # If the checksums match, log the success and update the multipart file metadata
+                        if verbose:
+                            logger.info(
+                                f"Checksum validation passed for multipart file: {multipart_obj.original_name}")
+                        # Update the extra_data field with the validated checksum
+                        multipart_extra_data = multipart_obj.extra_data
+                        multipart_extra_data['md5_checksum'] = server_checksum
+                        # Remove the multipart_complete flag from the metadata
+                        multipart_extra_data.pop("multipart_complete")
+                        # Save the updated metadata to the database
+                        multipart_obj.extra_data = multipart_extra_data
+                        multipart_obj.save()
 
-        try:
-            if verbose:
-                logger.info(f"Saving file to path: {file_fullpath}...")
-            # Try to save the file
-            handle_uploaded_file(file, file_fullpath, multipart, verbose)
-        except Exception as e:
-            if verbose:
-                logger.info(
-                    f"Error handling uploaded file for: {filename} - {repr(e)}")
-            invalid_files.append(
-                {filename: {"message": repr(e), "status": 400}})
-            if multipart:
-                # This is a complete failure when multipart
-                return (uploaded_files, invalid_files, existing_files, status.HTTP_400_BAD_REQUEST)
+            else:
+                # Do not perform post upload tasks
+                append_tasks = False
 
-            continue
+            # If post upload tasks are to be performed
+            if append_tasks:
+                # Fetch deployment tasks associated with the current file's deployment
+                if verbose:
+                    logger.info(
+                        f"Fetching deployment tasks for file: {filename}...")
+                # Primary keys of automated tasks linked to the deployment's projects
+                file_deployment_tasks = deployment_task_pks[file_deployment.pk]
+                if verbose:
+                    logger.info(
+                        f"Deployment tasks for file {filename}: {file_deployment_tasks}")
 
-        if not multipart or (multipart and multipart_obj is None):
-            # Set the file URL when first registered in the database
-            if verbose:
-                logger.info(f"Setting file URL for: {filename}...")
-            new_datafile_obj.set_file_url()
-            all_new_objects.append(new_datafile_obj)
+                # Append the handler task for the current file to the list of all handler tasks
+                all_handler_tasks.append(file_handler_task)
+                if verbose:
+                    logger.info(
+                        f"Handler task for file {filename}: {file_handler_task}")
+
+                # Append the deployment tasks for the current file to the list of project task primary keys
+                project_task_pks.append(file_deployment_tasks)
 
-        # If a single file or a completing (checksum received) multipart
-        if not multipart or (multipart and multipart_checksum is not None):
-            # Flag to append tasks for processing
-            append_tasks = True
+        final_status = status.HTTP_200_OK
 
-            if multipart:
-                # Perform MD5 checksum validation for multipart file uploads
+        if len(all_new_objects) > 0 or multipart:
+            # If new objects are to be created
+            if len(all_new_objects) > 0:
                 if verbose:
                     logger.info(
-                        f"Performing MD5 checksum validation for multipart file: {multipart_obj.original_name}...")
-                # Calculate the server-side checksum of the uploaded file
-                server_checksum = get_md5(multipart_obj.full_path())
+                        f"Bulk creating {len(all_new_objects)} new DataFile objects...")
+                # Names were validated as unique, so conflicts only come from concurrent uploads.
+                # These are skipped rather than failing the whole batch.
+                DataFile.objects.bulk_create(
+                    all_new_objects, ignore_conflicts=True)
+                # Conflicting rows keep their own upload datetime, so only this batch's rows match
+                created_pks = dict(DataFile.objects.filter(
+                    file_name__in=[x.file_name for x in all_new_objects],
+                    upload_dt=upload_dt).values_list('file_name', 'pk'))
+                is_created = [x.file_name in created_pks for x in all_new_objects]
+                # Paths of the rows these files conflicted with, whose files must not be removed
+                conflict_names = [x.file_name for x, y in zip(
+                    all_new_objects, is_created) if not y]
+                conflict_paths = set()
+                if len(conflict_names) > 0:
+                    conflict_paths = set(DataFile.objects.filter(file_name__in=conflict_names).full_paths(
+                    ).values_list('full_path', flat=True))
+                for new_datafile_obj, created in zip(all_new_objects, is_created):
+                    if created:
+                        new_datafile_obj.pk = created_pks[new_datafile_obj.file_name]
+                        new_datafile_obj._state.adding = False
+                        new_datafile_obj._state.db = DataFile.objects.db
+                    else:
+                        # The file was already written, but no DataFile points at it
+                        if new_datafile_obj.full_path() not in conflict_paths:
+                            try_remove_file_clean_dirs(new_datafile_obj.full_path())
+                        invalid_files.append({new_datafile_obj.original_name: {
+                            "message": f"Error creating database records, {new_datafile_obj.file_name} already exists",
+                            "status": 400}})
+                uploaded_files = [x for x, y in zip(all_new_objects, is_created) if y]
+                if not multipart:
+                    # Keep post upload tasks aligned with the created files
+                    all_handler_tasks = [
+                        x for x, y in zip(all_handler_tasks, is_created) if y]
+                    project_task_pks = [
+                        x for x, y in zip(project_task_pks, is_created) if y]
+                uploaded_files_pks = [x.pk for x in uploaded_files]
+                # New files are waiting to be archived
+                ArchiveLedger.add_files([(x.deployment.combo_project, x.deployment.device.type_id, x.file_size)
+                                         for x in uploaded_files])
                 if verbose:
                     logger.info(
-                        f"Server checksum: {server_checksum}, Client checksum: {multipart_checksum}")
-                # Compare the server checksum with the client-provided checksum
-                if not multipart_checksum == server_checksum:
-                    # If the checksums do not match, log the mismatch and add an error to invalid_files
-                    if verbose:
-                        logger.info(
-                            f"Checksum mismatch for multipart file: {multipart_obj.original_name}")
-                    invalid_files += [{multipart_obj.original_name: {
-                        "message": "Multipart file upload checksum mismatch", "status": 400}}]
-                    # Return early with an HTTP 400 Bad Request status
-                    return (uploaded_files, invalid_files, existing_files, status.HTTP_400_BAD_REQUEST)
+                        f"Created DataFile objects with primary keys: {uploaded_files_pks}")
+                if len(uploaded_files) > 0:
+                    final_status = status.HTTP_201_CREATED
                 else:
-                    # If the checksums match, log the success and update the multipart file metadata
-                    if verbose:
-                        logger.info(
-                            f"Checksum validation passed for multipart file: {multipart_obj.original_name}")
-                    # Update the extra_data field with the validated checksum
-                    multipart_extra_data = multipart_obj.extra_data
-                    multipart_extra_data['md5_checksum'] = server_checksum
-                    # Remove the multipart_complete flag from the metadata
-                    multipart_extra_data.pop("multipart_complete")
-                    # Save the updated metadata to the database
-                    multipart_obj.extra_data = multipart_extra_data
-                    multipart_obj.save()
+                    final_status = status.HTTP_400_BAD_REQUEST
+            # Otherwise if this part of a multipart upload
+            elif multipart:
+                if verbose:
+                    logger.info(
+                        f"Using existing multipart object with primary key: {multipart_obj.pk}")
+                uploaded_files = [multipart_obj]
+                uploaded_files_pks = [multipart_obj.pk]
+                # Is multipart completing
+                if multipart_checksum is not None:
+                    # Multipart done
+                    final_status = status.HTTP_200_OK
+                else:
+                    # Multipart continues
+                    final_status = status.HTTP_100_CONTINUE
+
+            # Get all tasks
+            all_tasks = []
+
+            # For unique data handler tasks, fire off jobs to perform them
+            unique_tasks = list(
+                set([x for x in all_handler_tasks if x is not None]))
+
+            if len(unique_tasks) > 0:
+                for task_name in unique_tasks:
+                    # get pks for this task
+                    task_file_pks = [x for x,
+                                     y in zip(uploaded_files_pks, all_handler_tasks) if y == task_name]
+                    if len(task_file_pks) > 0:
+                        new_task = app.signature(
+                            task_name, [task_file_pks], immutable=True)
+                        all_tasks.append(new_task)
+
+            # For unique project tasks, fire off jobs to perform them
+            flat_project_task_pks = [
+                x for internal_list in project_task_pks for x in internal_list]
+
+            unique_project_task_pks = list(set(flat_project_task_pks))
+            if len(unique_project_task_pks) > 0:
+                # Fetch all project jobs at once
+                project_task_objs = ProjectJob.objects.in_bulk(
+                    unique_project_task_pks)
+                for project_task_pk in unique_project_task_pks:
+                    # get pks for this task
+                    task_file_pks = [x for x,
+                                     y in zip(uploaded_files_pks, project_task_pks) if project_task_pk in y]
+                    if len(task_file_pks) > 0:
+                        # get signature from the project job db object
+                        task_obj = project_task_objs[project_task_pk]
+                        new_task = task_obj.get_job_signature(task_file_pks)
+                        all_tasks.append(new_task)
+
+            if len(all_tasks) > 0:
+                task_chain = chain(all_tasks)
+                task_chain.apply_async()
 
         else:
-            # Do not perform post upload tasks
-            append_tasks = False
-
-        # If post upload tasks are to be performed
-        if append_tasks:
-            # Fetch deployment tasks associated with the current file's deployment
-            if verbose:
-                logger.info(
-                    f"Fetching deployment tasks for file: {filename}...")
-            file_deployment_tasks = list(file_deployment.project.all().values_list(
-                'automated_tasks__pk', flat=True))  # Retrieve primary keys of automated tasks linked to the deployment
-            file_deployment_tasks = [
-                x for x in file_deployment_tasks if x is not None]  # Filter out None values from the task list
             if verbose:
-                logger.info(
-                    f"Deployment tasks for file {filename}: {file_deployment_tasks}")
+                logger.info("Determining final status based on invalid files...")
+            final_status = status.HTTP_400_BAD_REQUEST
+            if all([[y[x].get('status') == 403 for x in y.keys()][0] for y in invalid_files]):
+                if verbose:
+                    logger.info(
+                        "All invalid files have a status of 403. Setting final status to HTTP_403_FORBIDDEN.")
+                final_status = status.HTTP_403_FORBIDDEN
+        return (uploaded_files, invalid_files, existing_files, final_status)
 
-            # Append the handler task for the current file to the list of all handler tasks
-            all_handler_tasks.append(file_handler_task)
-            if verbose:
-                logger.info(
-                    f"Handler task for file {filename}: {file_handler_task}")
 
-            # Append the deployment tasks for the current file to the list of project task primary keys
-            project_task_pks.append(file_deployment_tasks)
+def validate_new_datafiles(new_datafile_objs: List["DataFile"]) -> List[Optional[ValidationError]]:
+    """
+    Validates a batch of new DataFile objects before they are bulk created, in place of calling `full_clean`
+    on each of them. Recording datetimes have already been checked against deployments when files were
+    matched to them, so only field values and file name uniqueness are checked:
+        - Character fields are checked against their maximum length, and for being blank, in memory.
+        - File names are checked for uniqueness with a single query, and against each other.
 
-    final_status = status.HTTP_200_OK
+    Args:
+        new_datafile_objs (List[DataFile]): Unsaved DataFile objects.
 
-    if len(all_new_objects) > 0 or multipart:
-        # If new objects are to be created
-        if len(all_new_objects) > 0:
-            if verbose:
-                logger.info(
-                    f"Bulk creating {len(all_new_objects)} new DataFile objects...")
-            uploaded_files = DataFile.objects.bulk_create(all_new_objects)
-            uploaded_files_pks = [x.pk for x in uploaded_files]
-            if verbose:
-                logger.info(
-                    f"Created DataFile objects with primary keys: {uploaded_files_pks}")
-            final_status = status.HTTP_201_CREATED
-        # Otherwise if this part of a multipart upload
-        elif multipart:
-            if verbose:
-                logger.info(
-                    f"Using existing multipart object with primary key: {multipart_obj.pk}")
-            uploaded_files = [multipart_obj]
-            uploaded_files_pks = [multipart_obj.pk]
-            # Is multipart completing
-            if multipart_checksum is not None:
-                # Multipart done
-                final_status = status.HTTP_200_OK
-            else:
-                # Multipart continues
-                final_status = status.HTTP_100_CONTINUE
-
-        # Get all tasks
-        all_tasks = []
-
-        # For unique data handler tasks, fire off jobs to perform them
-        unique_tasks = list(
-            set([x for x in all_handler_tasks if x is not None]))
-
-        if len(unique_tasks) > 0:
-            for task_name in unique_tasks:
-                # get pks for this task
-                task_file_pks = [x for x,
-                                 y in zip(uploaded_files_pks, handler_tasks) if y == task_name]
-                if len(task_file_pks) > 0:
-                    new_task = app.signature(
-                        task_name, [task_file_pks], immutable=True)
-                    all_tasks.append(new_task)
-
-        # For unique project tasks, fire off jobs to perform them
-        flat_project_task_pks = [
-            x for internal_list in project_task_pks for x in internal_list]
-
-        unique_project_task_pks = list(set(flat_project_task_pks))
-        if len(unique_project_task_pks) > 0:
-            for project_task_pk in unique_project_task_pks:
-                # get pks for this task
-                task_file_pks = [x for x,
-                                 y in zip(uploaded_files_pks, project_task_pks) if project_task_pk in y]
-                if len(task_file_pks) > 0:
-                    # get signature from the project job db object
-                    task_obj = ProjectJob.objects.get(pk=project_task_pk)
-                    new_task = task_obj.get_job_signature(task_file_pks)
-                    all_tasks.append(new_task)
-
-        if len(all_tasks) > 0:
-            task_chain = chain(all_tasks)
-            task_chain.apply_async()
+    Returns:
+        List[Optional[ValidationError]]: The validation error of each object, or None if it is valid.
+    """
+    from data_models.models import DataFile
+
+    if len(new_datafile_objs) == 0:
+        return []
+
+    char_fields = [x for x in DataFile._meta.concrete_fields
+                   if x.get_internal_type() == "CharField"]
+
+    file_names = [x.file_name for x in new_datafile_objs]
+    file_name_counts = Counter(file_names)
+    existing_file_names = set(DataFile.objects.filter(
+        file_name__in=set(file_names)).values_list('file_name', flat=True))
+
+    errors = []
+    for new_datafile_obj in new_datafile_objs:
+        obj_errors = {}
+        for field in char_fields:
+            value = getattr(new_datafile_obj, field.attname)
+            if value in field.empty_values:
+                if not field.blank:
+                    obj_errors[field.name] = ["This field cannot be blank."]
+            elif field.max_length is not None and len(value) > field.max_length:
+                obj_errors[field.name] = [
+                    f"Ensure this value has at most {field.max_length} characters (it has {len(value)})."]
+
+        if new_datafile_obj.file_name in existing_file_names or \
+                file_name_counts[new_datafile_obj.file_name] > 1:
+            obj_errors.setdefault("file_name", []).append(
+                "Data file with this File name already exists.")
+
+        errors.append(ValidationError(obj_errors) if obj_errors else None)
+
+    return errors
+
+
+def find_existing_names(
+    names: List[str],
+    field: str = "original_name",
+    device: Optional["Device"] = None,
+    queryset: Optional[QuerySet] = None
+) -> set:
+    """
+    Finds which of a list of file names are already in the database.
+    Original names such as `IMG_0001.JPG` repeat across devices, so the lookup can be scoped to a device,
+    in which case it is served by the index on deployment and original name.
 
-    else:
-        if verbose:
-            logger.info("Determining final status based on invalid files...")
-        final_status = status.HTTP_400_BAD_REQUEST
-        if all([[y[x].get('status') == 403 for x in y.keys()][0] for y in invalid_files]):
-            if verbose:
-                logger.info(
-                    "All invalid files have a status of 403. Setting final status to HTTP_403_FORBIDDEN.")
-            final_status = status.HTTP_403_FORBIDDEN
-    return (uploaded_files, invalid_files, existing_files, final_status)
+    Args:
+        names (List[str]): File names to look for.
+        field (str, optional): Field to match the names against, `original_name` or `file_name`.
+            Defaults to "original_name".
+        device (Device, optional): Only match files from deployments of this device. Defaults to None.
+        queryset (QuerySet, optional): DataFile queryset to search, for example one already filtered by permissions.
+            Defaults to all DataFiles.
+
+    Returns:
+        set: The names that already exist, for constant time membership checks.
+    """
+    from data_models.models import DataFile
+
+    if queryset is None:
+        queryset = DataFile.objects.all()
+    if device is not None:
+        queryset = queryset.filter(deployment__device=device)
+
+    unique_names = list(set(names))
+    if len(unique_names) == 0:
+        return set()
+
+    # Only fetch the matching column, without ordering, so each name is a single index lookup
+    existing_names = queryset.order_by().filter(
+        **{f"{field}__in": unique_names}).values_list(field, flat=True)
+    return set(existing_names)
+
+
+def handle_files(
+    data_handler: "DataTypeHandler",
+    files: List[Union[object, UploadedFile]],
+    recording_dt: List[Optional[dt]],
+    extra_data: List[Dict[str, Union[str, int, float, bool, None]]],
+    data_type: str,
+    max_workers: Optional[int] = None
+) -> List[Tuple[Optional[dt], Dict[str, Union[str, int, float, bool, None]], str, Optional[str]]]:
+    """
+    Runs a data handler's `handle_file` over a batch of files, concurrently if configured.
+    Args:
+        data_handler (DataTypeHandler): The data handler to process the files with.
+        files (list): List of file objects to be processed.
+        recording_dt (list): Recording datetime for each file.
+        extra_data (list): Extra data for each file.
+        data_type (str): Data type name passed to the handler.
+        max_workers (int, optional): Number of threads to use. Defaults to `settings.DATA_HANDLER_THREADS`.
+    Returns:
+        list: The `(recording_dt, extra_data, data_type, task)` tuple returned by the handler for each file,
+        in the same order as `files`.
+    """
+    if max_workers is None:
+        max_workers = settings.DATA_HANDLER_THREADS
+
+    # Handlers only read the files, so a thread pool is enough to overlap their I/O
+    if max_workers <= 1 or len(files) <= 1:
+        return [data_handler.handle_file(x, y, z, data_type) for x, y, z in zip(files, recording_dt, extra_data)]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        return list(executor.map(data_handler.handle_file, files, recording_dt, extra_data,
+                                 itertools.repeat(data_type)))
 
 
 def handle_uploaded_file(
@@ -693,18 +916,25 @@ def handle_uploaded_file(
     filepath: str,
     multipart: bool = False,
     verbose: bool = False
-) -> None:
+) -> Dict[str, str]:
     """
-    Handles the uploading and saving of a file to the specified filepath.
+    Handles the uploading and saving of a file to the specified filepath, computing checksums as it is written.
     Parameters:
         file (UploadedFile): The file object to be saved. It is expected to have a `chunks()` method for reading data in chunks.
         filepath (str): The full path where the file should be saved.
         multipart (bool, optional): If True, appends the file content to an existing file at the filepath. Defaults to False.
         verbose (bool, optional): If True, prints debug information about the file handling process. Defaults to False.
+    Returns:
+        dict: Checksums of the saved file, keyed as they are stored in `extra_data` (`md5_checksum` and,
+        if `settings.FILE_INGEST_SHA256` is True, `sha256_checksum`). Empty when appending to a multipart file,
+        as the checksums would only cover the appended chunk.
     Behavior:
         - Creates the directory structure for the filepath if it does not exist.
-        - Writes the file in binary mode ('wb+') if `multipart` is False.
         - Appends the file in binary mode ('ab+') if `multipart` is True and the file already exists.
+        - Moves the file into place if the upload handler already wrote it to a temporary file on the same
+          filesystem, hashing the temporary file rather than copying it.
+        - Otherwise writes the file in binary mode ('wb+') in `settings.FILE_INGEST_BUFFER_SIZE` chunks,
+          updating the checksums with each chunk.
         - Prints debug information if `verbose` is True.
     Raises:
         OSError: If there is an issue creating directories or writing to the file.
@@ -712,72 +942,420 @@ def handle_uploaded_file(
         handle_uploaded_file(
             uploaded_file, '/path/to/save/file.txt', multipart=True, verbose=True)
     """
-    os.makedirs(os.path.split(filepath)[0], exist_ok=True)
+    buffer_size = settings.FILE_INGEST_BUFFER_SIZE
+    file_dir = os.path.split(filepath)[0]
+    os.makedirs(file_dir, exist_ok=True)
+
     if multipart and os.path.exists(filepath):
         if verbose:
             logger.info(f"Appending to {filepath}")
         with open(filepath, 'ab+') as destination:
-            for chunk in file.chunks():
+            for chunk in file.chunks(chunk_size=buffer_size):
                 destination.write(chunk)
+        return {}
+
+    hashers = {"md5_checksum": hashlib.md5()}
+    if settings.FILE_INGEST_SHA256:
+        hashers["sha256_checksum"] = hashlib.sha256()
+
+    temporary_file_path = None
+    if hasattr(file, "temporary_file_path"):
+        temporary_file_path = file.temporary_file_path()
+
+    if temporary_file_path is not None and \
+            os.stat(temporary_file_path).st_dev == os.stat(file_dir).st_dev:
+        if verbose:
+            logger.info(f"Moving {temporary_file_path} to {filepath}")
+        with open(temporary_file_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(buffer_size), b""):
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+        os.rename(temporary_file_path, filepath)
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(filepath, settings.FILE_UPLOAD_PERMISSIONS)
     else:
         if verbose:
             logger.info(f"Writing to {filepath}")
         with open(filepath, 'wb+') as destination:
-            for chunk in file.chunks():
+            for chunk in file.chunks(chunk_size=buffer_size):
+                for hasher in hashers.values():
+                    hasher.update(chunk)
                 destination.write(chunk)
 
+    return {k: v.hexdigest() for k, v in hashers.items()}
+
 
 def get_new_name(
     deployment: "Deployment",
     recording_dt: dt,
-    file_local_path: str,
-    file_path: str,
-    file_n: Optional[int] = None
+    file_n: int
 ) -> str:
     """
-    Generates a new unique name for a file based on deployment, recording datetime, and file count.
+    Generates a new unique name for a file based on deployment, recording datetime, and file number.
 
     Args:
         deployment (Deployment): The deployment object associated with the file.
         recording_dt (datetime): The recording datetime of the file.
-        file_local_path (str): The root local path where files are stored.
-        file_path (str): The relative path for the file within the storage root.
-        file_n (Optional[int], optional): The file count for uniqueness. Defaults to None.
+        file_n (int): The file number for uniqueness, as reserved by `reserve_file_numbers`.
 
     Returns:
         str: A unique name for the file in the format:
              "{deployment_device_ID}_{YYYY-MM-DD_HH-MM-SS}_({file_n})"
     """
-    if file_n is None:
-        file_n = get_n_files(os.path.join(file_local_path, file_path)) + 1
     newname = f"{deployment.deployment_device_ID}_{dt.strftime(recording_dt, '%Y-%m-%d_%H-%M-%S')}_({file_n})"
     return newname
 
 
-def get_n_files(dir_path: str) -> int:
+def reserve_file_numbers(
+    file_data_types: List["DataType"],
+    file_deployments: List["Deployment"],
+    upload_date: date
+) -> List[int]:
     """
-    Counts the number of files in a directory that have an extension.
+    Reserves a unique file number for each file in a batch.
+    Numbers are reserved as one contiguous block per data type and deployment on the upload date,
+    so the number of counter updates depends on the number of unique combinations rather than files.
 
     Args:
-        dir_path (str): The path to the directory to count files in.
+        file_data_types (List[DataType]): Data type of each file.
+        file_deployments (List[Deployment]): Deployment of each file.
+        upload_date (date): Upload date of the batch.
 
     Returns:
-        int: The number of files in the directory with an extension.
-             Returns 0 if the directory does not exist.
-    """
-    if os.path.exists(dir_path):
-        all_files = os.listdir(dir_path)
-        # Filter files that have an extension
-        all_files = [x for x in all_files if '.' in x]
-        n_files = len(all_files)
-    else:
-        n_files = 0
-    return n_files
+        List[int]: A file number for each file, in the same order as the input lists.
+    """
+    from data_models.models import DataFileNameCounter
+
+    # Count the files for each data type and deployment
+    keys = [(x.pk, y.pk) for x, y in zip(file_data_types, file_deployments)]
+    key_counts = Counter(keys)
+
+    # Reserve a block of numbers for each combination
+    next_numbers = {}
+    for file_data_type, file_deployment in zip(file_data_types, file_deployments):
+        key = (file_data_type.pk, file_deployment.pk)
+        if key in next_numbers:
+            continue
+        next_numbers[key] = DataFileNameCounter.reserve_numbers(
+            file_data_type, file_deployment, upload_date, key_counts[key])
+
+    # Hand out numbers from each block in file order
+    file_numbers = []
+    for key in keys:
+        file_numbers.append(next_numbers[key])
+        next_numbers[key] += 1
+
+    return file_numbers
+
+
+class StagedUploadFile(UploadedFile):
+    """
+    A completed upload session's staging file, presented as an uploaded file so that it goes through
+    the same handling as a file uploaded in a single request.
+    As it reports its staging path as a temporary file path, it is moved into place rather than copied.
+    """
+
+    def __init__(self, path: str, name: str, size: int):
+        super().__init__(open(path, 'rb'), name=name, size=size)
+        self.path = path
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+
+def parse_content_range(content_range: str) -> Tuple[int, int, int]:
+    """
+    Parses a `Content-Range` header of the form `bytes <start>-<end>/<total>`.
+
+    Args:
+        content_range (str): Value of the header.
+
+    Returns:
+        tuple: The offset of the first byte, the offset one past the last byte, and the total size.
+
+    Raises:
+        ValueError: If the header is malformed or the range is not within the total size.
+    """
+    match = re.fullmatch(r"\s*bytes\s+(\d+)-(\d+)/(\d+)\s*", content_range)
+    if match is None:
+        raise ValueError(f"Malformed Content-Range: {content_range}")
+
+    start, end, total = (int(x) for x in match.groups())
+    if start > end or end >= total:
+        raise ValueError(f"Invalid Content-Range: {content_range}")
+
+    # The header's end offset is inclusive
+    return start, end + 1, total
+
+
+def write_upload_session_chunk(
+    session: "UploadSession",
+    start: int,
+    end: int,
+    stream: IO[bytes],
+    verbose: bool = False
+) -> int:
+    """
+    Writes a chunk of an upload session into its staging file at the chunk's offset and records it.
+    Chunks can arrive in any order, and resending a chunk rewrites the same bytes, so writes are idempotent.
+
+    Args:
+        session (UploadSession): Upload session to which the chunk belongs.
+        start (int): Offset of the first byte of the chunk.
+        end (int): Offset one past the last byte of the chunk.
+        stream (IO[bytes]): Stream from which the chunk's bytes are read.
+        verbose (bool, optional): If True, logs debug information. Defaults to False.
+
+    Returns:
+        int: The session's committed offset after this chunk.
+
+    Raises:
+        ValueError: If the stream ends before the whole chunk is read. The chunk is not recorded.
+        OSError: If the staging file cannot be written.
+    """
+    buffer_size = settings.FILE_INGEST_BUFFER_SIZE
+    staging_path = session.staging_path()
+    os.makedirs(os.path.split(staging_path)[0], exist_ok=True)
+
+    if verbose:
+        logger.info(f"Writing bytes {start}-{end} to {staging_path}")
+
+    fd = os.open(staging_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        offset = start
+        while offset < end:
+            data = stream.read(min(buffer_size, end - offset))
+            if not data:
+                break
+            # Write at an explicit offset, so concurrent chunks never share a file position
+            while data:
+                n_written = os.pwrite(fd, data, offset)
+                data = data[n_written:]
+                offset += n_written
+    finally:
+        os.close(fd)
+
+    if offset != end:
+        raise ValueError(
+            f"Chunk ended after {offset - start} of {end - start} bytes")
+
+    return session.record_chunk(start, end)
+
+
+def complete_upload_session(
+    session: "UploadSession",
+    verbose: bool = False
+) -> Tuple[
+    List["DataFile"],
+    List[Dict[str, Dict[str, Union[str, int]]]],
+    List[Dict[str, Dict[str, Union[str, int]]]],
+    int
+]:
+    """
+    Registers the staging file of a fully received upload session as a DataFile.
+    If the client supplied a checksum that does not match, the received chunks are discarded so the upload can restart.
+
+    Args:
+        session (UploadSession): Upload session, whose committed offset has reached its expected size.
+        verbose (bool, optional): If True, logs debug information. Defaults to False.
+
+    Returns:
+        tuple: The same `(uploaded_files, invalid_files, existing_files, final_status)` as `create_file_objects`.
+    """
+    staging_path = session.staging_path()
+
+    if session.md5_checksum:
+        server_checksum = get_md5(staging_path)
+        if verbose:
+            logger.info(
+                f"Server checksum: {server_checksum}, Client checksum: {session.md5_checksum}")
+        if server_checksum != session.md5_checksum:
+            session.chunks.all().delete()
+            session.committed_offset = 0
+            session.save()
+            return ([], [{session.original_name: {"message": "Upload session checksum mismatch", "status": 400}}],
+                    [], status.HTTP_400_BAD_REQUEST)
+
+    staged_file = StagedUploadFile(
+        staging_path, session.original_name, session.expected_size)
+    try:
+        uploaded_files, invalid_files, existing_files, final_status = create_file_objects(
+            [staged_file],
+            recording_dt=[
+                session.recording_dt] if session.recording_dt is not None else None,
+            extra_data=[dict(session.extra_data)],
+            deployment_object=session.deployment,
+            device_object=session.device,
+            data_types=[
+                session.data_type.name] if session.data_type is not None else None,
+            request_user=session.owner,
+            verbose=verbose)
+    finally:
+        staged_file.close()
+
+    if len(uploaded_files) > 0:
+        session.complete = True
+        session.data_file = uploaded_files[0]
+        session.save()
+        # The offsets are no longer needed once the file is registered
+        session.chunks.all().delete()
+        # If the staging file was copied rather than moved, remove it
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    return (uploaded_files, invalid_files, existing_files, final_status)
+
+
+def stage_ingest_job(
+    files: List[UploadedFile],
+    check_filename: bool = False,
+    recording_dt: Optional[List[Optional[dt]]] = None,
+    extra_data: Optional[List[Dict[str,
+                                   Union[str, int, float, bool, None]]]] = None,
+    deployment_object: Optional["Deployment"] = None,
+    device_object: Optional["Device"] = None,
+    data_types: Optional[List[Union[str, "DataType"]]] = None,
+    request_user: Optional["User"] = None,
+    verbose: bool = False
+) -> "IngestJob":
+    """
+    Accepts an upload for background processing. The files are written to a staging directory and the upload
+    metadata is recorded, so that `run_ingest_job` can later call `create_file_objects` with the same arguments.
+
+    Args:
+        files (list): Uploaded files.
+        check_filename (bool, optional): Flag to check for duplicate filenames in the database. Defaults to False.
+        recording_dt (list, optional): Recording datetime values for the files. Defaults to None.
+        extra_data (list, optional): Additional metadata for the files. Defaults to None.
+        deployment_object (Deployment, optional): Deployment associated with the files. Defaults to None.
+        device_object (Device, optional): Device associated with the files. Defaults to None.
+        data_types (list, optional): Data types, or data type names, for the files. Defaults to None.
+        request_user (User, optional): User who uploaded the files. Defaults to None.
+        verbose (bool, optional): Flag to enable verbose logging. Defaults to False.
+
+    Returns:
+        IngestJob: The saved ingest job.
+    """
+    from data_models.models import IngestJob
+
+    ingest_job = IngestJob(owner=request_user)
+    staging_dir = ingest_job.staging_dir()
+
+    staged_files = []
+    try:
+        for i, file in enumerate(files):
+            # Stage under the file's position, so names from the client never form paths
+            staged_path = os.path.join(staging_dir, str(i))
+            handle_uploaded_file(file, staged_path, verbose=verbose)
+            staged_files.append(
+                {"path": staged_path, "name": file.name, "size": file.size})
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    ingest_job.staged_files = staged_files
+    ingest_job.upload_args = {
+        "check_filename": check_filename,
+        "recording_dt": [x.isoformat() if x is not None else None for x in recording_dt]
+        if recording_dt is not None else None,
+        "extra_data": extra_data,
+        "deployment": deployment_object.pk if deployment_object is not None else None,
+        "device": device_object.pk if device_object is not None else None,
+        "data_types": [getattr(x, "name", x) for x in data_types] if data_types is not None else None,
+    }
+    ingest_job.save()
+
+    return ingest_job
+
+
+def run_ingest_job(ingest_job: "IngestJob", verbose: bool = False) -> "IngestJob":
+    """
+    Registers the staged files of an accepted upload with `create_file_objects`, and records the result.
+    The staging directory is removed afterwards, whether or not the files could be registered.
+
+    Args:
+        ingest_job (IngestJob): Ingest job to process.
+        verbose (bool, optional): Flag to enable verbose logging. Defaults to False.
+
+    Returns:
+        IngestJob: The processed ingest job, with its status and result updated.
+    """
+    from data_models.models import Deployment, Device
+
+    ingest_job.status = 1
+    ingest_job.save()
+
+    upload_args = ingest_job.upload_args
+    files = [StagedUploadFile(x["path"], x["name"], x["size"])
+             for x in ingest_job.staged_files]
+    try:
+        recording_dt = upload_args.get("recording_dt")
+        if recording_dt is not None:
+            recording_dt = [dt.fromisoformat(x) if x is not None else None
+                            for x in recording_dt]
+
+        deployment_object = None
+        if upload_args.get("deployment") is not None:
+            deployment_object = Deployment.objects.get(
+                pk=upload_args["deployment"])
+        device_object = None
+        if upload_args.get("device") is not None:
+            device_object = Device.objects.get(pk=upload_args["device"])
+
+        # Runs its own transaction, once file numbers have been reserved
+        uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+            files, upload_args.get("check_filename", False), recording_dt, upload_args.get("extra_data"),
+            deployment_object, device_object, upload_args.get("data_types"), ingest_job.owner,
+            verbose=verbose)
+
+        ingest_job.result = {"uploaded_files": [x.pk for x in uploaded_files],
+                             "invalid_files": invalid_files,
+                             "existing_files": existing_files,
+                             "status_code": status_code}
+        ingest_job.status = 2
+    except Exception as e:
+        logger.error(f"Ingest job {ingest_job.job_id} failed: {repr(e)}")
+        ingest_job.result = {"detail": repr(e)}
+        ingest_job.status = 3
+    finally:
+        for file in files:
+            file.close()
+        # Staged files that were registered have been moved; anything left was rejected
+        shutil.rmtree(ingest_job.staging_dir(), ignore_errors=True)
+
+    ingest_job.save()
+    return ingest_job
+
+
+def pack_contiguous(cumulative_sizes: np.ndarray, capacity: int) -> List[int]:
+    """
+    Pack files, in order, into as few groups as possible without any group exceeding a capacity.
+    Files larger than the capacity are put in a group of their own.
+    Args:
+        cumulative_sizes (np.ndarray): Cumulative sum of the file sizes in bytes.
+        capacity (int): The maximum size of a group in bytes.
+    Returns:
+        List[int]: The index after the last file of each group.
+    """
+    group_ends = []
+    start = 0
+    start_total = 0
+    n_files = len(cumulative_sizes)
+    while start < n_files:
+        # Find the last file that fits, rather than stepping through files one at a time
+        end = int(np.searchsorted(cumulative_sizes,
+                  start_total + capacity, side='right'))
+        end = max(end, start + 1)
+        group_ends.append(end)
+        start_total = cumulative_sizes[end - 1]
+        start = end
+    return group_ends
 
 
 def group_files_by_size(
     file_objs: QuerySet,
-    max_size: float = settings.MAX_ARCHIVE_SIZE_GB
+    max_size: float = settings.MAX_ARCHIVE_SIZE_GB,
+    min_size: float = 0
 ) -> list[dict[str, float | list[int]]]:
     """
     Groups files into batches based on their size, ensuring that the total size
@@ -787,56 +1365,161 @@ def group_files_by_size(
             Each file object must have 'pk' (primary key) and 'file_size' attributes.
         max_size (float, optional): The maximum size (in GB) allowed for each group.
             Defaults to `settings.MAX_ARCHIVE_SIZE_GB`.
+        min_size (float, optional): The minimum size (in GB) of a group. Groups are adjusted so that the
+            last group reaches this size where possible. Defaults to 0.
     Returns:
         list[dict[str, float | list[int]]]: A list of dictionaries, where each dictionary
         represents a group of files. Each dictionary contains:
             - "file_pks" (list[int]): A list of primary keys of the files in the group.
             - "total_size_gb" (float): The total size of the files in the group (in GB).
     Notes:
-        - Files are grouped in order of their 'recording_dt' attribute.
-        - The `itertools.groupby` function is used to group files by their assigned key.
+        - Files are grouped in order of their 'recording_dt' attribute, so each group covers a contiguous date range.
+        - Files are packed into as few groups as possible.
+        - If the last group is smaller than `min_size` and cannot be balanced with the one before it,
+          it is returned as it is, so those files can be left for the first group of a later run.
     """
+    # Order the file objects by their recording datetime to ensure logical grouping
+    file_objs = file_objs.order_by('recording_dt', 'pk')
+
+    # Stream primary keys and file sizes into arrays
+    file_pks = array('q')
+    file_sizes = array('q')
+    for file_pk, file_size in file_objs.values_list('pk', 'file_size').iterator(chunk_size=10000):
+        file_pks.append(file_pk)
+        file_sizes.append(file_size)
+
+    if len(file_pks) == 0:
+        return []
+
+    file_sizes = np.frombuffer(file_sizes, dtype=np.int64)
+    cumulative_sizes = np.cumsum(file_sizes)
+    total_size = int(cumulative_sizes[-1])
+    max_bytes = int(max_size * 1024 * 1024 * 1024)
+    min_bytes = int(np.ceil(min_size * 1024 * 1024 * 1024))
+
+    # Packing groups in order gives the fewest groups
+    group_ends = pack_contiguous(cumulative_sizes, max_bytes)
+
+    if len(group_ends) > 1 and total_size - int(cumulative_sizes[group_ends[-2] - 1]) < min_bytes:
+        # The last group is too small to archive. Move the boundary with the previous group
+        # to balance them, if that leaves both within the size limits.
+        start = group_ends[-3] if len(group_ends) > 2 else 0
+        start_total = int(cumulative_sizes[start - 1]) if start > 0 else 0
+        middle = int(np.searchsorted(cumulative_sizes,
+                     start_total + (total_size - start_total) / 2, side='right'))
+        best_cut = None
+        for cut in [middle, middle + 1]:
+            if cut <= start or cut >= len(file_pks):
+                continue
+            first_size = int(cumulative_sizes[cut - 1]) - start_total
+            last_size = total_size - int(cumulative_sizes[cut - 1])
+            if first_size > max_bytes or last_size > max_bytes or last_size < min_bytes:
+                continue
+            if best_cut is None or abs(first_size - last_size) < best_cut[1]:
+                best_cut = (cut, abs(first_size - last_size))
+        if best_cut is not None:
+            group_ends[-2] = best_cut[0]
 
-    # Initialize variables to track the current group key, total size, and file information
-    curr_key = 0
-    curr_total = 0
-    file_info = []
+    groups = []
+    start = 0
+    for end in group_ends:
+        group_total = int(cumulative_sizes[end - 1]) - \
+            (int(cumulative_sizes[start - 1]) if start > 0 else 0)
+        groups.append({"file_pks": file_pks[start:end].tolist(),
+                       "total_size_gb": convert_unit(group_total, "GB")})
+        start = end
 
-    # Order the file objects by their recording datetime to ensure logical grouping
-    file_objs = file_objs.order_by('recording_dt')
-
-    # Extract primary key and file size values from the file objects
-    file_values = file_objs.values('pk', 'file_size')
-    for file_value in file_values:
-        # Convert the file size to GB for comparison
-        file_size = convert_unit(file_value['file_size'], "GB")
-
-        # Check if adding the current file would exceed the maximum allowed size for a group
-        if (curr_total + file_size) > max_size:
-            # If the new file would push over the max size, start a new group
-            curr_total = file_size  # Reset the current total size to the new file's size
-            curr_key += 1  # Increment the group key to start a new group
-        else:
-            # Otherwise, add the file's size to the current group's total size
-            curr_total += file_size
+    return groups
 
-        # Append the file's information along with its assigned group key
-        file_info.append(
-            {"pk": file_value['pk'], "file_size": file_size, "key": curr_key})
 
-    # Initialize an empty list to store the grouped file information
-    groups = []
+def remove_local_file(full_path: str, thumb_path: Optional[str], linked_file_paths: List[str]) -> bool:
+    """
+    Remove a file from local storage, along with its thumbnail and linked files.
+
+    Args:
+        full_path (str): path of the file
+        thumb_path (Optional[str]): path of the file's thumbnail, if it has one
+        linked_file_paths (List[str]): paths of the file's linked files
 
-    # Use itertools.groupby to group files by their assigned group key
-    for k, g in itertools.groupby(file_info, lambda x: x.get("key")):
-        # Convert the group iterator into a list for processing
-        files = list(g)
+    Returns:
+        bool: True if the file itself was removed
+    """
+    success = try_remove_file_clean_dirs(full_path)
+    if not success:
+        return False
+    # Failing to remove a thumbnail or linked file does not stop the file being cleaned, as in DataFile.clean_file
+    if thumb_path is not None:
+        try_remove_file_clean_dirs(thumb_path)
+    for linked_file_path in linked_file_paths:
+        try_remove_file_clean_dirs(linked_file_path)
+    return True
+
+
+def clean_local_files(file_objs: QuerySet, chunk_size: int = 2000) -> int:
+    """
+    Remove archived files from local storage in bulk. Equivalent to calling `DataFile.clean_file` on each file,
+    but protected files are excluded in the query, files are removed in parallel, the database is updated once per
+    chunk and each deployment's thumbnail is updated once at the end.
 
-        # Calculate the total size of the files in the current group
-        total_size_gb = sum([x.get('file_size') for x in files])
-        # Extract the primary keys of the files in the current group
-        file_pks = [x.get('pk') for x in files]
-        # Append the group information (file primary keys and total size) to the groups list
-        groups.append({"file_pks": file_pks, "total_size_gb": total_size_gb})
+    Args:
+        file_objs (QuerySet): DataFile objects to clean
+        chunk_size (int, optional): number of files removed between database updates. Defaults to 2000.
 
-    return groups
+    Returns:
+        int: number of files cleaned
+    """
+    from data_models.models import DataFile, Deployment
+
+    # Exclude protected files with subqueries, rather than checking each file
+    file_objs = file_objs.filter(local_storage=True, archived=True, do_not_remove=False).exclude(
+        pk__in=Deployment.objects.filter(last_image__isnull=False).values("last_image")).exclude(
+        pk__in=DataFile.favourite_of.through.objects.values("datafile"))
+
+    file_values = file_objs.values_list(
+        "pk", "local_path", "path", "file_name", "file_format", "thumb_url", "linked_files", "deployment")
+
+    n_cleaned = 0
+    deployment_pks = set()
+    with ThreadPoolExecutor(max_workers=settings.FILE_CLEAN_THREADS) as executor:
+        file_values_iterator = file_values.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(itertools.islice(file_values_iterator, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            file_paths = []
+            for pk, local_path, path, file_name, file_format, thumb_url, linked_files, deployment_pk in chunk:
+                file_dir = os.path.join(local_path, path)
+                file_paths.append((os.path.join(file_dir, file_name+file_format),
+                                   os.path.join(
+                                       file_dir, file_name+"_THUMB.jpg") if thumb_url else None,
+                                   [x["path"] for x in (linked_files or {}).values()]))
+            removed = executor.map(
+                lambda x: remove_local_file(*x), file_paths)
+
+            modified_on = djtimezone.now()
+            cleaned_file_objs = []
+            for (pk, *_, deployment_pk), success in zip(chunk, removed):
+                if not success:
+                    logger.error(f"Clean {pk} - Failed - Cannot delete local file")
+                    continue
+                cleaned_file_objs.append(DataFile(pk=pk,
+                                                  local_storage=False,
+                                                  local_path="",
+                                                  linked_files={},
+                                                  thumb_url=None,
+                                                  file_url=None,
+                                                  modified_on=modified_on))
+                deployment_pks.add(deployment_pk)
+
+            DataFile.objects.bulk_update(cleaned_file_objs, fields=[
+                "local_storage", "local_path", "linked_files", "thumb_url", "file_url", "modified_on"])
+            n_cleaned += len(cleaned_file_objs)
+            logger.info(f"Cleaned {n_cleaned} files")
+
+    # bulk_update does not send post_save, so update each deployment's thumbnail once
+    for deployment in Deployment.objects.filter(pk__in=deployment_pks).exclude(thumb_url__isnull=True).exclude(thumb_url=""):
+        deployment.set_thumb_url()
+        deployment.save()
+
+    return n_cleaned
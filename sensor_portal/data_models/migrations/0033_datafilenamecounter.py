@@ -0,0 +1,55 @@
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_file_name_counters(apps, schema_editor):
+    """
+    Set each counter to the highest file number already used for that data type, deployment and upload date.
+    """
+    DataFile = apps.get_model("data_models", "DataFile")
+    DataFileNameCounter = apps.get_model("data_models", "DataFileNameCounter")
+
+    file_n_pattern = re.compile(r"_\((\d+)\)$")
+    last_n = {}
+    file_values = DataFile.objects.filter(file_type__isnull=False).values_list(
+        "file_type_id", "deployment_id", "upload_dt", "file_name")
+    for file_type_id, deployment_id, upload_dt, file_name in file_values.iterator(chunk_size=10000):
+        match = file_n_pattern.search(file_name)
+        if match is None:
+            continue
+        key = (file_type_id, deployment_id, upload_dt.date())
+        last_n[key] = max(last_n.get(key, 0), int(match.group(1)))
+
+    DataFileNameCounter.objects.bulk_create(
+        [DataFileNameCounter(file_type_id=k[0], deployment_id=k[1], upload_date=k[2], last_n=v)
+         for k, v in last_n.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0032_deployment_annotators_deployment_managers_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataFileNameCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('upload_date', models.DateField(help_text='Upload date of counted files.')),
+                ('last_n', models.IntegerField(default=0, help_text='Last file number reserved.')),
+                ('deployment', models.ForeignKey(help_text='Deployment of counted files.', on_delete=django.db.models.deletion.CASCADE, related_name='file_name_counters', to='data_models.deployment')),
+                ('file_type', models.ForeignKey(help_text='Data type of counted files.', on_delete=django.db.models.deletion.CASCADE, related_name='file_name_counters', to='data_models.datatype')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='datafilenamecounter',
+            constraint=models.UniqueConstraint(fields=('file_type', 'deployment', 'upload_date'), name='unique_file_name_counter'),
+        ),
+        migrations.RunPython(backfill_file_name_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data_models', '0033_datafilenamecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('session_id', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Upload session ID.', unique=True)),
+                ('original_name', models.CharField(help_text='Original name of the uploaded file.', max_length=100)),
+                ('expected_size', models.BigIntegerField(help_text='Total size of the file in bytes.')),
+                ('committed_offset', models.BigIntegerField(default=0, help_text='Contiguous bytes received from the start of the file.')),
+                ('md5_checksum', models.CharField(blank=True, help_text='MD5 checksum of the complete file, supplied by the client.', max_length=32)),
+                ('recording_dt', models.DateTimeField(blank=True, help_text='Datetime at which the file was recorded.', null=True)),
+                ('extra_data', models.JSONField(blank=True, default=dict, help_text='Extra data of the uploaded file.')),
+                ('complete', models.BooleanField(default=False, help_text='Has the upload completed?')),
+                ('data_file', models.OneToOneField(blank=True, help_text='Datafile created by this upload.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='data_models.datafile')),
+                ('data_type', models.ForeignKey(blank=True, help_text='Data type of the uploaded file.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='data_models.datatype')),
+                ('deployment', models.ForeignKey(blank=True, help_text='Deployment of the uploaded file.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='data_models.deployment')),
+                ('device', models.ForeignKey(blank=True, help_text='Device of the uploaded file.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='data_models.device')),
+                ('owner', models.ForeignKey(help_text='User who started the upload.', on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadSessionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('start', models.BigIntegerField(help_text='Offset of the first byte.')),
+                ('end', models.BigIntegerField(help_text='Offset one past the last byte.')),
+                ('session', models.ForeignKey(help_text='Upload session of this chunk.', on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='data_models.uploadsession')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='uploadsessionchunk',
+            constraint=models.UniqueConstraint(fields=('session', 'start', 'end'), name='unique_upload_session_chunk'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0034_uploadsession_uploadsessionchunk'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datafile',
+            index=models.Index(fields=['deployment', 'original_name'], name='deployment_original_name_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data_models', '0035_datafile_deployment_original_name_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Ingest job ID.', unique=True)),
+                ('status', models.IntegerField(choices=[(0, 'Accepted'), (1, 'Processing'), (2, 'Complete'), (3, 'Failed')], default=0, help_text='Processing status.')),
+                ('staged_files', models.JSONField(blank=True, default=list, help_text='Staged files.')),
+                ('upload_args', models.JSONField(blank=True, default=dict, help_text='Upload metadata.')),
+                ('result', models.JSONField(blank=True, default=dict, help_text='Result of processing the upload.')),
+                ('owner', models.ForeignKey(help_text='User who uploaded the files.', on_delete=django.db.models.deletion.CASCADE, related_name='ingest_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
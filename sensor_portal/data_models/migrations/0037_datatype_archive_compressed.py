@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_models', '0036_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datatype',
+            name='archive_compressed',
+            field=models.BooleanField(default=True, help_text='Compress archive TARs of this data type. Already compressed data (e.g. JPEG or MP3) gains little from compression, and uncompressed TARs allow files to be restored without extracting the TAR.'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 
+import bisect
+import itertools
 import logging
 import os
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 from typing import TYPE_CHECKING, List, Optional
 
 from archiving.models import Archive, TarFile
@@ -11,9 +14,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.geos import Point
 from django.contrib.postgres.indexes import GinIndex, OpClass
-from django.core.exceptions import (MultipleObjectsReturned,
-                                    ObjectDoesNotExist, ValidationError)
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
 from django.db.models import (BooleanField, Case, Count, DateTimeField,
                               ExpressionWrapper, F, Max, Min, Q, Sum, Value,
                               When)
@@ -73,6 +75,7 @@ class DataType(BaseModel):
         name (CharField): The name of the data type, limited to 20 characters.
         colour (ColorField): The color associated with the data type, defaults to white (#FFFFFF).
         symbol (IconField): An optional icon representing the data type, can be left blank.
+        archive_compressed (BooleanField): Whether archive TARs of this data type are compressed, defaults to True.
     Methods:
         __str__(): Returns the name of the data type as its string representation.
     """
@@ -82,6 +85,10 @@ class DataType(BaseModel):
                         help_text="Colour to use for this data type.")
     symbol = IconField(
         blank=True, help_text="Symbol to use for this data type.")
+    archive_compressed = models.BooleanField(
+        default=True, help_text="Compress archive TARs of this data type. "
+        "Already compressed data (e.g. JPEG or MP3) gains little from compression, "
+        "and uncompressed TARs allow files to be restored without extracting the TAR.")
 
     def __str__(self):
         return self.name
@@ -250,6 +257,8 @@ class Device(BaseModel):
             Validates the device type against the model type using custom validators.
         deployment_from_date(dt):
             Finds the deployment associated with the device for a given datetime.
+        deployments_for_dates(dt_list):
+            Finds the deployments associated with the device for a list of datetimes.
         check_overlap(new_start, new_end, deployment_pk):
             Checks for overlapping deployments within the specified date range, excluding a given deployment.
     """
@@ -322,9 +331,7 @@ class Device(BaseModel):
     def deployment_from_date(self, dt: datetime) -> "Deployment":
         """
         Determines the deployment associated with the device for a given datetime.
-        This method attempts to find the deployment that corresponds to the provided
-        datetime (`dt`) for the current device instance. It handles deployments with
-        indefinite end dates by shifting the end date 100 years into the future.
+        This is a convenience wrapper around `deployments_for_dates` for a single datetime.
         Args:
             dt (datetime): The datetime for which the deployment is to be determined.
                    If `None`, the method returns `None`.
@@ -332,72 +339,86 @@ class Device(BaseModel):
             Deployment: The deployment object that matches the given datetime, or `None`
                 if no matching deployment is found or if there is ambiguity
                 (multiple deployments match the datetime).
-        Raises:
-            ObjectDoesNotExist: If no deployment matches the given datetime.
-            MultipleObjectsReturned: If multiple deployments match the given datetime.
+        """
+
+        return self.deployments_for_dates([dt])[0]
+
+    def deployments_for_dates(self, dt_list: List[Optional[datetime]]) -> List[Optional["Deployment"]]:
+        """
+        Determines the deployment associated with the device for each datetime in a list.
+        The device's deployments are loaded once and every datetime is then matched in memory,
+        so the number of queries does not grow with the length of `dt_list`.
+        Args:
+            dt_list (List[datetime]): The datetimes for which deployments are to be determined.
+                   Entries may be `None` or strings parseable by `check_dt`.
+        Returns:
+            List[Deployment]: A list the same length as `dt_list`. Each entry is the deployment
+                that matches the corresponding datetime, or `None` if no matching deployment is
+                found, if there is ambiguity (multiple deployments match the datetime) or if the
+                datetime is `None`.
         Notes:
-            - Deployments are annotated with a calculated datetime (`dt`) based on the
-              provided timezone.
+            - Naive datetimes are localised to the time zone of each deployment before comparison.
             - Deployments with no end date are treated as having an indefinite end date
               (100 years from the start date).
-            - The method uses annotations and filters to determine whether the datetime
-              falls within the deployment range.
-            - If ambiguity arises (multiple deployments match), the method logs the
-              number of matching deployments and returns `None`.
+            - Deployments are indexed by start datetime. For each datetime, only the deployments
+              starting before it are considered, and the scan stops as soon as no earlier
+              deployment can still be running.
         """
 
         logger.info(
-            f"Attempt to find deployment for device {self.device_ID} for {dt}")
-
-        if dt is None:
-            return None
-
-        # logger.info(dt)
-        all_deploys = self.deployments.all()
-
-        all_tz = all_deploys.values('time_zone', 'pk')
-
-        all_tz = [{'time_zone': x.get(
-            'time_zone', settings.TIME_ZONE), 'pk': x['pk']} for x in all_tz]
-
-        all_dt = {x['pk']: check_dt(dt, x['time_zone']) for x in all_tz}
-
-        whens = [When(pk=k, then=Value(v)) for k, v in all_dt.items()]
-
-        all_deploys = all_deploys.annotate(
-            dt=Case(*whens, output_field=DateTimeField(), default=Value(None)))
-
-        # For deployments that have not ended - end date is shifted 100 years
-
-        all_deploys = all_deploys.annotate(deployment_end_indefinite=Case(
-            When(deployment_end__isnull=True,
-                 then=ExpressionWrapper(
-                     F('deployment_start') + timedelta(days=365 * 100),
-                     output_field=DateTimeField()
-                 )
-                 ),
-            default=F('deployment_end')
-        )
-        )
+            f"Attempt to find deployments for device {self.device_ID} for {len(dt_list)} datetimes")
+
+        results = [None] * len(dt_list)
+
+        # Parse any strings once, localisation happens per deployment time zone
+        parsed_dt_list = [check_dt(x, localise=False) for x in dt_list]
+        if all([x is None for x in parsed_dt_list]):
+            return results
+
+        # Group deployments by time zone, as naive datetimes must be localised per deployment
+        deployments_by_tz = {}
+        for deployment in self.deployments.all():
+            deployment_end = deployment.deployment_end
+            # For deployments that have not ended - end date is shifted 100 years
+            if deployment_end is None:
+                deployment_end = deployment.deployment_start + \
+                    timedelta(days=365 * 100)
+            deployments_by_tz.setdefault(str(deployment.time_zone), []).append(
+                (deployment.deployment_start, deployment_end, deployment))
+
+        # Build an interval index for each time zone, sorted by deployment start
+        tz_indexes = []
+        for deployments in deployments_by_tz.values():
+            deployments.sort(key=lambda x: x[0])
+            starts = [x[0] for x in deployments]
+            # Running maximum of deployment ends, so that the backwards scan can stop early
+            max_ends = list(itertools.accumulate(
+                [x[1] for x in deployments], max))
+            tz_indexes.append(
+                (deployments[0][2].time_zone, starts, max_ends, deployments))
+
+        for i, dt in enumerate(parsed_dt_list):
+            if dt is None:
+                continue
+
+            matches = []
+            for time_zone, starts, max_ends, deployments in tz_indexes:
+                local_dt = check_dt(dt, time_zone)
+                # Deployments at positions < idx start on or before this datetime
+                idx = bisect.bisect_right(starts, local_dt)
+                while idx > 0 and max_ends[idx - 1] >= local_dt:
+                    idx -= 1
+                    if deployments[idx][1] >= local_dt:
+                        matches.append(deployments[idx][2])
+
+            if len(matches) == 1:
+                results[i] = matches[0]
+            else:
+                # Check for complete failure or ambiguity
+                logger.info(
+                    f"Error: found {len(matches)} deployments for {dt}")
 
-        # Annotate by whether the datetime lies in the deployment range
-
-        all_deploys = all_deploys.annotate(in_deployment=ExpressionWrapper(
-            Q(Q(deployment_start__lte=F('dt')) & Q(
-                deployment_end_indefinite__gte=F('dt'))),
-            output_field=BooleanField()
-        )
-        )
-
-        try:
-            correct_deployment = all_deploys.get(in_deployment=True)
-            return correct_deployment
-        except (ObjectDoesNotExist, MultipleObjectsReturned):
-            # Check for complete failure or ambiguity
-            all_true_deployments = all_deploys.filter(in_deployment=True)
-            logger.info(
-                f"Error: found {all_true_deployments.count()} deployments")
-            return None
+        return results
 
     def check_overlap(self, new_start: datetime, new_end: Optional[datetime], deployment_pk: Optional[int]) -> List[str]:
         """
@@ -904,6 +925,11 @@ class DataFile(BaseModel):
             GinIndex(
                 OpClass(Upper('file_name'), name='gin_trgm_ops'),
                 name='upper_file_name_gin_idx',
+            ),
+            # Duplicate checks match original names within the deployments of a device
+            models.Index(
+                fields=['deployment', 'original_name'],
+                name='deployment_original_name_idx',
             )
         ]
 
@@ -1133,6 +1159,241 @@ class DataFile(BaseModel):
         super(DataFile, self).clean()
 
 
+class UploadSession(BaseModel):
+    """
+    Represents a resumable upload of a single large file, sent in chunks that may arrive in any order.
+    Chunks are written into a staging file at their offsets. Once every byte up to the expected size
+    has been received, the staging file is registered as a DataFile like any other upload.
+    Attributes:
+        session_id (UUIDField): Public identifier of the session, used in upload URLs.
+        owner (ForeignKey): User who started the session, and the only user allowed to add to it.
+        original_name (CharField): Original name of the file being uploaded.
+        expected_size (BigIntegerField): Total size of the file in bytes.
+        committed_offset (BigIntegerField): Number of contiguous bytes received from the start of the file.
+        md5_checksum (CharField): Optional client checksum, checked once the file is complete.
+        deployment (ForeignKey): Deployment the file is uploaded to, optional.
+        device (ForeignKey): Device the file is uploaded from, optional.
+        recording_dt (DateTimeField): Recording datetime of the file, optional.
+        extra_data (JSONField): Extra data of the file.
+        data_type (ForeignKey): Data type of the file, optional.
+        data_file (OneToOneField): DataFile created when the upload completed.
+        complete (BooleanField): Has the upload completed?
+    Methods:
+        __str__(): Returns a string representation of the session.
+        staging_path(): Returns the path of the file into which chunks are written.
+        record_chunk(start, end): Records a received byte range and updates the committed offset.
+    """
+
+    session_id = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False, help_text="Upload session ID.")
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                              related_name="upload_sessions", help_text="User who started the upload.")
+    original_name = models.CharField(
+        max_length=100, help_text="Original name of the uploaded file.")
+    expected_size = models.BigIntegerField(
+        help_text="Total size of the file in bytes.")
+    committed_offset = models.BigIntegerField(
+        default=0, help_text="Contiguous bytes received from the start of the file.")
+    md5_checksum = models.CharField(
+        max_length=32, blank=True, help_text="MD5 checksum of the complete file, supplied by the client.")
+    deployment = models.ForeignKey(Deployment, on_delete=models.CASCADE, null=True, blank=True,
+                                   related_name="upload_sessions", help_text="Deployment of the uploaded file.")
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name="upload_sessions", help_text="Device of the uploaded file.")
+    recording_dt = models.DateTimeField(
+        null=True, blank=True, help_text="Datetime at which the file was recorded.")
+    extra_data = models.JSONField(
+        default=dict, blank=True, help_text="Extra data of the uploaded file.")
+    data_type = models.ForeignKey(DataType, on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name="upload_sessions", help_text="Data type of the uploaded file.")
+    data_file = models.OneToOneField(DataFile, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name="upload_session", help_text="Datafile created by this upload.")
+    complete = models.BooleanField(
+        default=False, help_text="Has the upload completed?")
+
+    def __str__(self):
+        return f"{self.original_name} {self.session_id}"
+
+    def staging_path(self) -> str:
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, str(self.session_id))
+
+    def record_chunk(self, start: int, end: int) -> int:
+        """
+        Records that the bytes from `start` up to (not including) `end` have been written to the staging file,
+        and moves the committed offset past any chunks that are now contiguous with it.
+        Recording the same chunk more than once has no effect, so clients can safely resend a chunk.
+        Args:
+            start (int): Offset of the first byte of the chunk.
+            end (int): Offset one past the last byte of the chunk.
+        Returns:
+            int: The committed offset after recording this chunk.
+        """
+
+        with transaction.atomic():
+            # Lock the session so concurrent chunks do not race when moving the offset
+            session = UploadSession.objects.select_for_update().get(pk=self.pk)
+            UploadSessionChunk.objects.get_or_create(
+                session=session, start=start, end=end)
+
+            committed_offset = session.committed_offset
+            if start <= committed_offset < end:
+                # Only chunks starting at or before the offset can move it
+                chunk_ranges = session.chunks.filter(
+                    end__gt=committed_offset).order_by("start").values_list("start", "end")
+                for chunk_start, chunk_end in chunk_ranges:
+                    if chunk_start > committed_offset:
+                        break
+                    committed_offset = max(committed_offset, chunk_end)
+
+                session.committed_offset = committed_offset
+                session.save(update_fields=["committed_offset", "modified_on"])
+
+        self.committed_offset = committed_offset
+        return committed_offset
+
+
+class UploadSessionChunk(BaseModel):
+    """
+    A byte range received as part of an upload session.
+    Attributes:
+        session (ForeignKey): Upload session this chunk belongs to.
+        start (BigIntegerField): Offset of the first byte of the chunk.
+        end (BigIntegerField): Offset one past the last byte of the chunk.
+    Meta:
+        constraints: A byte range is recorded once per session. The index of this constraint also serves
+            lookups of a session's chunks in offset order.
+    """
+
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE,
+                                related_name="chunks", help_text="Upload session of this chunk.")
+    start = models.BigIntegerField(help_text="Offset of the first byte.")
+    end = models.BigIntegerField(help_text="Offset one past the last byte.")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["session", "start", "end"],
+                name="unique_upload_session_chunk"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.session} {self.start}-{self.end}"
+
+
+ingest_status = (
+    (0, 'Accepted'),
+    (1, 'Processing'),
+    (2, 'Complete'),
+    (3, 'Failed'),
+)
+
+
+class IngestJob(BaseModel):
+    """
+    Represents an upload accepted for processing in the background.
+    The uploaded files are staged on disk when the upload is accepted, and a Celery task later registers them
+    exactly as `create_file_objects` would have done during the request.
+    Attributes:
+        job_id (UUIDField): Public identifier of the job, used to check its status.
+        owner (ForeignKey): User who uploaded the files.
+        status (IntegerField): Processing status of the job, one of `ingest_status`.
+        staged_files (JSONField): Path, original name and size of each staged file.
+        upload_args (JSONField): Upload metadata to pass to `create_file_objects`.
+        result (JSONField): Uploaded file primary keys, invalid files, existing files and status code.
+    Methods:
+        __str__(): Returns a string representation of the job.
+        staging_dir(): Returns the directory in which the job's files are staged.
+    """
+
+    job_id = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False, help_text="Ingest job ID.")
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                              related_name="ingest_jobs", help_text="User who uploaded the files.")
+    status = models.IntegerField(
+        choices=ingest_status, default=0, help_text="Processing status.")
+    staged_files = models.JSONField(
+        default=list, blank=True, help_text="Staged files.")
+    upload_args = models.JSONField(
+        default=dict, blank=True, help_text="Upload metadata.")
+    result = models.JSONField(
+        default=dict, blank=True, help_text="Result of processing the upload.")
+
+    def __str__(self):
+        return f"{self.job_id} {self.get_status_display()}"
+
+    def staging_dir(self) -> str:
+        return os.path.join(settings.INGEST_STAGING_ROOT, str(self.job_id))
+
+
+class DataFileNameCounter(BaseModel):
+    """
+    Tracks the last file number used when naming files of a data type, in a deployment, on an upload day.
+    Attributes:
+        file_type (ForeignKey): Data type of the counted files.
+        deployment (ForeignKey): Deployment of the counted files.
+        upload_date (DateField): Upload date of the counted files.
+        last_n (IntegerField): Last file number reserved.
+    Methods:
+        __str__(): Returns a string representation of the counter.
+        reserve_numbers(file_type, deployment, upload_date, n_files):
+            Reserves a contiguous block of file numbers and returns the first one.
+    Meta:
+        constraints: A counter is unique for each data type, deployment and upload date.
+    """
+
+    file_type = models.ForeignKey(
+        DataType, on_delete=models.CASCADE, related_name="file_name_counters", help_text="Data type of counted files.")
+    deployment = models.ForeignKey(
+        Deployment, on_delete=models.CASCADE, related_name="file_name_counters", help_text="Deployment of counted files.")
+    upload_date = models.DateField(help_text="Upload date of counted files.")
+    last_n = models.IntegerField(
+        default=0, help_text="Last file number reserved.")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["file_type", "deployment", "upload_date"],
+                name="unique_file_name_counter"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.file_type} {self.deployment} {self.upload_date} {self.last_n}"
+
+    @classmethod
+    def reserve_numbers(cls, file_type: DataType, deployment: Deployment, upload_date: date, n_files: int = 1) -> int:
+        """
+        Reserves a contiguous block of file numbers for a data type, deployment and upload date.
+        The counter is incremented in a single statement, which locks its row until the enclosing transaction
+        commits. So `create_file_objects` reserves numbers before it starts the transaction that writes the
+        files, and concurrent uploads to the same counter do not wait for each other's files.
+        Numbers reserved by an upload that then fails are never used. These gaps are acceptable, as file numbers
+        only need to be unique.
+        Args:
+            file_type (DataType): Data type of the files to be named.
+            deployment (Deployment): Deployment of the files to be named.
+            upload_date (date): Upload date of the files to be named.
+            n_files (int, optional): Number of file numbers to reserve. Defaults to 1.
+        Returns:
+            int: The first reserved file number. The block runs to this value + `n_files` - 1.
+        """
+
+        table = cls._meta.db_table
+        now = djtimezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (file_type_id, deployment_id, upload_date, last_n, created_on, modified_on) "
+                "VALUES (%s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (file_type_id, deployment_id, upload_date) "
+                f"DO UPDATE SET last_n = {table}.last_n + EXCLUDED.last_n, modified_on = EXCLUDED.modified_on "
+                "RETURNING last_n",
+                [file_type.pk, deployment.pk, upload_date, n_files, now, now])
+            last_n = cursor.fetchone()[0]
+
+        return last_n - n_files + 1
+
+
 class ProjectJob(BaseModel):
     """
     Represents a project-level job configuration in the system.
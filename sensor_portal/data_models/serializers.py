@@ -16,7 +16,7 @@ from utils.validators import check_two_keys
 
 from . import validators
 from .models import (DataFile, DataType, Deployment, Device, DeviceModel,
-                     Project, Site)
+                     IngestJob, Project, Site, UploadSession)
 
 
 class DeploymentFieldsMixIn(InstanceGetMixIn, OwnerMixIn, ManagerMixIn, CreatedModifiedMixIn, CheckFormMixIn,
@@ -530,6 +530,8 @@ class DataFileCheckSerializer(serializers.Serializer):
         Attributes:
             file_names(ListField(CharField)): List of filenames to check in the system.
             original_names(ListField(CharField)): List of original file names to check in the system.
+            device(CharField): Optional device ID, to only check files from this device.
+            device_ID(IntegerField): Optional database ID of device, to only check files from this device.
     """
 
     file_names = serializers.ListField(
@@ -538,6 +540,22 @@ class DataFileCheckSerializer(serializers.Serializer):
     original_names = serializers.ListField(
         child=serializers.CharField(), required=False
     )
+    device = serializers.CharField(required=False)
+    device_ID = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data = super().validate(data)
+        device = data.get('device')
+        device_ID = data.get('device_ID')
+        if device or device_ID:
+            try:
+                data['device_object'] = Device.objects.get(
+                    Q(Q(device_ID=device) | Q(pk=device_ID)))
+            except ObjectDoesNotExist:
+                raise serializers.ValidationError({"device":
+                                                   f"Device {device} does not exist",
+                                                   "device_ID": f"Device ID {device_ID} does not exist"})
+        return data
 
 
 class DataFileSerializer(CreatedModifiedMixIn, serializers.ModelSerializer):
@@ -604,6 +622,47 @@ class DataFileSerializer(CreatedModifiedMixIn, serializers.ModelSerializer):
         return data
 
 
+def get_upload_target(data: dict) -> tuple:
+    """
+    Looks up the deployment or device that files are being uploaded to.
+    Args:
+        data (dict): Serializer data, containing any of `deployment`, `deployment_ID`, `device` and `device_ID`.
+    Returns:
+        tuple: The deployment object (None if a device was supplied instead) and the device object.
+    Raises:
+        serializers.ValidationError: If neither is supplied, or the supplied object does not exist.
+    """
+    deployment = data.get('deployment')
+    deployment_ID = data.get('deployment_ID')
+    device = data.get('device')
+    device_ID = data.get('device_ID')
+
+    #  Check a deployment or device is supplied
+    if deployment is None and deployment_ID is None and device is None and device_ID is None:
+        raise serializers.ValidationError(
+            "A deployment or a device must be supplied")
+
+    # Check if deployment or device exists
+    if deployment or deployment_ID:
+        try:
+            deployment_object = Deployment.objects.get(Q(Q(deployment_device_ID=deployment) |
+                                                         Q(pk=deployment_ID)))
+        except ObjectDoesNotExist:
+            raise serializers.ValidationError({"deployment":
+                                               f"Deployment {deployment} does not exist",
+                                               "deployment_ID": f"Deployment ID {deployment_ID} does not exist"})
+        return deployment_object, deployment_object.device
+
+    try:
+        device_object = Device.objects.get(
+            Q(Q(device_ID=device) | Q(pk=device_ID)))
+    except ObjectDoesNotExist:
+        raise serializers.ValidationError({"device":
+                                           f"Device {device} does not exist",
+                                           "device_ID": f"Device ID {device_ID} does not exist"})
+    return None, device_object
+
+
 class DataFileUploadSerializer(serializers.Serializer):
     """
     Serializer for handling data file uploads with associated metadata.
@@ -620,6 +679,8 @@ class DataFileUploadSerializer(serializers.Serializer):
         rename (BooleanField): Flag indicating whether to rename the uploaded files. Defaults to True.
         check_filename (BooleanField): Flag indicating whether to validate filenames. Defaults to True.
         data_types (ListField): Optional list of data types associated with the upload, linked to DataType objects.
+        async_ingest (BooleanField): Flag indicating whether to stage the files and register them in the background.
+            Defaults to False.
         is_active (BooleanField): Read-only field indicating whether the associated deployment is active.
     Methods:
         create(validated_data):
@@ -653,42 +714,17 @@ class DataFileUploadSerializer(serializers.Serializer):
                                        required=False)
     is_active = serializers.BooleanField(
         source="deployment.is_active", read_only=True)
+    async_ingest = serializers.BooleanField(default=False)
 
     def create(self, validated_data):
         return validated_data
 
     def validate(self, data):
         data = super().validate(data)
-        deployment = data.get('deployment')
-        deployment_ID = data.get('deployment_ID')
-        device = data.get('device')
-        device_ID = data.get('device_ID')
-
-        #  Check a deployment or device is supplied
-        if deployment is None and deployment_ID is None and device is None and device_ID is None:
-            raise serializers.ValidationError(
-                "A deployment or a device must be supplied")
-
-        # Check if deployment or device exists
-        if deployment or deployment_ID:
-            try:
-                deployment_object = Deployment.objects.get(Q(Q(deployment_device_ID=deployment) |
-                                                             Q(pk=deployment_ID)))
-            except ObjectDoesNotExist:
-                raise serializers.ValidationError({"deployment":
-                                                   f"Deployment {deployment} does not exist",
-                                                   "deployment_ID": f"Deployment ID {deployment_ID} does not exist"})
+        deployment_object, device_object = get_upload_target(data)
+        if deployment_object is not None:
             data['deployment_object'] = deployment_object
-            data['device_object'] = deployment_object.device
-        elif device or device_ID:
-            try:
-                device_object = Device.objects.get(
-                    Q(Q(device_ID=device) | Q(pk=device_ID)))
-            except ObjectDoesNotExist:
-                raise serializers.ValidationError({"device":
-                                                   f"Device {device} does not exist",
-                                                   "device_ID": f"Device ID {device_ID} does not exist"})
-            data['device_object'] = device_object
+        data['device_object'] = device_object
 
         files = data.get("files")
         recording_dt = data.get('recording_dt')
@@ -714,6 +750,72 @@ class DataFileUploadSerializer(serializers.Serializer):
         pass
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for starting, and reporting the progress of, a resumable upload session.
+    Attributes:
+        device (CharField): Optional device name associated with the upload.
+        device_ID (IntegerField): Optional device ID associated with the upload.
+        deployment (CharField): Optional deployment name associated with the upload.
+        deployment_ID (IntegerField): Optional deployment ID associated with the upload.
+        data_type (SlugRelatedField): Optional data type of the uploaded file, linked to `DataType`.
+        extra_data (JSONField): Optional extra data of the uploaded file.
+    Methods:
+        validate(data):
+            Checks the specified deployment or device exists, and that the user may attach files to a deployment.
+    """
+
+    device = serializers.CharField(required=False, write_only=True)
+    device_ID = serializers.IntegerField(required=False, write_only=True)
+    deployment = serializers.CharField(required=False, write_only=True)
+    deployment_ID = serializers.IntegerField(required=False, write_only=True)
+    data_type = serializers.SlugRelatedField(slug_field='name', queryset=DataType.objects.all(),
+                                             required=False, allow_null=True)
+    extra_data = serializers.JSONField(binary=True, required=False)
+    expected_size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ["session_id", "original_name", "expected_size", "committed_offset", "md5_checksum",
+                  "device", "device_ID", "deployment", "deployment_ID", "recording_dt", "extra_data",
+                  "data_type", "data_file", "complete"]
+        read_only_fields = ["session_id",
+                            "committed_offset", "data_file", "complete"]
+
+    def validate(self, data):
+        data = super().validate(data)
+        deployment_object, device_object = get_upload_target(data)
+
+        if deployment_object is not None:
+            user = self.context['request'].user
+            if not user.has_perm('data_models.change_deployment', deployment_object):
+                raise serializers.ValidationError({"deployment":
+                                                   f"Not allowed to attach files to {deployment_object.deployment_device_ID}"})
+
+        for key in ['device_ID', 'deployment_ID']:
+            data.pop(key, None)
+        data['deployment'] = deployment_object
+        # Only store the device if it was supplied, so files are matched to deployments by their recording datetime
+        data['device'] = device_object if deployment_object is None else None
+        return data
+
+
+class IngestJobSerializer(CreatedModifiedMixIn, serializers.ModelSerializer):
+    """
+    Serializer for reporting the status of an upload accepted for background processing.
+    Attributes:
+        status (CharField): Current status of the ingest job.
+    """
+
+    status = serializers.CharField(
+        source="get_status_display", read_only=True, help_text="Current status of this ingest job.")
+
+    class Meta:
+        model = IngestJob
+        fields = ["job_id", "status", "result", "created_on", "modified_on"]
+        read_only_fields = fields
+
+
 class SiteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Site
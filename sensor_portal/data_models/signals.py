@@ -1,5 +1,6 @@
 import logging
 
+from archiving.models import ArchiveLedger
 from django.conf import settings
 from django.db.models.signals import (m2m_changed, post_delete, post_save,
                                       pre_delete)
@@ -51,7 +52,12 @@ def update_combo_project(sender, instance, action, reverse, *args, **kwargs):
 
     """
     if (action == 'post_add' or action == 'post_remove') and not reverse:
+        old_combo_project = instance.combo_project
         instance.save()
+        if instance.combo_project != old_combo_project:
+            # This deployment's unarchived files have moved to a different combination of projects
+            ArchiveLedger.rebuild(
+                [old_combo_project, instance.combo_project])
 
 
 # @receiver(m2m_changed, sender=Project.managers.through)
@@ -94,8 +100,13 @@ def pre_remove_file(sender, instance: DataFile, **kwargs):
 @receiver(post_delete, sender=DataFile)
 def post_remove_file(sender, instance: DataFile, **kwargs):
     """
-    Post delete signal for DataFile model to update the deployment's thumbnail URL after a file is deleted.
+    Post delete signal for DataFile model to update the deployment's thumbnail URL after a file is deleted,
+    and to remove the file from the archive ledger if it was not archived.
     """
+    if instance.tar_file_id is None:
+        ArchiveLedger.add_files([(instance.deployment.combo_project,
+                                  instance.deployment.device.type_id,
+                                  instance.file_size)], sign=-1)
     if instance.deployment.thumb_url is not None and instance.deployment.thumb_url != "":
         instance.deployment.set_thumb_url()
         instance.deployment.save()
@@ -1,13 +1,14 @@
 import logging
+import os
 from datetime import datetime, timedelta
 from typing import List
 
 from bridgekeeper import perms
 from celery import shared_task
 from data_models.job_handling_functions import register_job
+from django.conf import settings
 from django.contrib.sites.models import Site
-from django.db.models import (BooleanField, DurationField, ExpressionWrapper,
-                              F, IntegerField, Max, Q)
+from django.db.models import BooleanField, IntegerField, Max, Q
 from django.db.models.functions import ExtractHour
 from django.utils import timezone
 from user_management.models import User
@@ -15,7 +16,9 @@ from utils.email import send_email_to_user
 
 from sensor_portal.celery import app
 
-from .models import DataFile, Deployment, Device, Project
+from .file_handling_functions import clean_local_files, run_ingest_job
+from .models import (DataFile, Deployment, Device, IngestJob, Project,
+                     UploadSession)
 
 logger = logging.getLogger(__name__)
 
@@ -47,26 +50,48 @@ def clean_all_files():
         clean_time = project.clean_time
         logger.info(
             f"Cleaning project: {project.name} with clean time: {clean_time} days.")
+        # Protected files are excluded by clean_local_files
         files_to_clean = DataFile.objects.filter(
+            deployment__project=project,
             local_storage=True,
             archived=True,
-            do_not_remove=False,
-            favourite_of__isnull=True,
-            deployment_last_image__isnull=True)
-
-        files_to_clean = files_to_clean.annotate(file_age=ExpressionWrapper(
-            timezone.now().date() - F('modified_on__date'), output_field=DurationField()))
-        files_to_clean = files_to_clean.filter(
-            file_age__gt=timedelta(days=clean_time))
+            modified_on__date__lt=timezone.now().date() - timedelta(days=clean_time))
+        n_cleaned = clean_local_files(files_to_clean)
         logger.info(
-            f"Found {files_to_clean.count()} files to clean for project: {project.name}.")
-        for file in files_to_clean:
-            try:
-                logger.info(f"Cleaning file: {file.file_name} (ID: {file.pk})")
-                file.clean_file()
-            except Exception as e:
-                logger.info(
-                    f"Error cleaning file {file.file_name} (ID: {file.pk}): {e}")
+            f"Cleaned {n_cleaned} files for project: {project.name}.")
+
+
+@app.task()
+def ingest_files(ingest_job_pk: int):
+    """
+    Register the staged files of an upload that was accepted for background processing.
+    Args:
+        ingest_job_pk (int): Primary key of the ingest job.
+    """
+    ingest_job = IngestJob.objects.get(pk=ingest_job_pk)
+    ingest_job = run_ingest_job(ingest_job)
+    logger.info(f"Ingest job {ingest_job}: {ingest_job.result}")
+
+
+@app.task()
+def clean_upload_sessions():
+    """
+    Remove incomplete upload sessions, and their staged chunks, that have not received data in UPLOAD_SESSION_EXPIRY_DAYS.
+    """
+    expired_sessions = UploadSession.objects.filter(
+        complete=False,
+        modified_on__lt=timezone.now() - timedelta(days=settings.UPLOAD_SESSION_EXPIRY_DAYS))
+    logger.info(f"Found {expired_sessions.count()} expired upload sessions.")
+    for session in expired_sessions:
+        try:
+            os.remove(session.staging_path())
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.info(
+                f"Error removing staged upload {session.session_id}: {e}")
+            continue
+        session.delete()
 
 
 @app.task()
@@ -7,13 +7,14 @@ from datetime import datetime as dt
 from io import BytesIO
 
 import pytest
-from data_models.factories import (DeploymentFactory, DeviceFactory,
-                                   ProjectFactory)
+from data_models.factories import (DataFileFactory, DeploymentFactory,
+                                   DeviceFactory, ProjectFactory)
 from data_models.general_functions import create_image
-from data_models.models import DataFile
+from data_models.file_handling_functions import run_ingest_job
+from data_models.models import DataFile, IngestJob
 from data_models.serializers import (DeploymentSerializer, DeviceSerializer,
                                      ProjectSerializer)
-from utils.general import read_in_chunks
+from utils.general import get_md5, read_in_chunks
 from utils.test_functions import (api_check_delete, api_check_post,
                                   api_check_update)
 
@@ -219,6 +220,9 @@ def test_CRUD_datafile(api_client_with_credentials):
 
     assert os.path.exists(file_path)
 
+    # Checksum is computed while the file is written
+    assert file_object.extra_data["md5_checksum"] == get_md5(file_path)
+
     object_url = f"{api_url}{file_object.pk}/"
     # update the object
     api_check_update(api_client_with_credentials,
@@ -394,3 +398,174 @@ def test_multipart_datafile(api_client_with_credentials):
     assert response_delete.status_code == 204
 
     assert not os.path.exists(file_path)
+
+
+@pytest.mark.django_db
+def test_upload_session_datafile(api_client_with_credentials):
+    """
+    Test: Test resumable upload session, with chunks sent out of order and resent.
+    """
+
+    user = api_client_with_credentials.handler._force_user
+
+    new_item = DeploymentFactory(
+        owner=user, deployment_start=dt(1066, 1, 1, 0, 0, 0))
+
+    # Generate a file
+    temp = BytesIO()
+    test_image = create_image()
+    test_image.save(temp, format="JPEG")
+    content = temp.getvalue()
+    content_size = len(content)
+    checksum = hashlib.md5(content).hexdigest()
+
+    api_url = '/api/datafile/upload_session/'
+    payload = {
+        "deployment": new_item.deployment_device_ID,
+        "original_name": "test_file_session.jpeg",
+        "expected_size": content_size,
+        "md5_checksum": checksum,
+        "recording_dt": dt(1066, 1, 2, 0, 0, 0),
+    }
+    response_start = api_client_with_credentials.post(
+        api_url, data=payload, format='json')
+    print(f"Response: {response_start.data}")
+    assert response_start.status_code == 201
+    session_url = f"{api_url}{response_start.data['session_id']}/"
+
+    # Split content into chunks
+    chunk_size = math.ceil(content_size/3)
+    chunks = [(start, content[start:start+chunk_size])
+              for start in range(0, content_size, chunk_size)]
+
+    def send_chunk(start, chunk):
+        headers = {
+            'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{content_size}'}
+        return api_client_with_credentials.patch(
+            session_url, data=chunk, content_type='application/octet-stream', headers=headers)
+
+    # Send the last chunk first, then the first chunk twice
+    response_chunk = send_chunk(*chunks[2])
+    assert response_chunk.status_code == 200
+    assert response_chunk.headers["Upload-Offset"] == "0"
+
+    for _ in range(2):
+        response_chunk = send_chunk(*chunks[0])
+        assert response_chunk.status_code == 200
+        assert response_chunk.headers["Upload-Offset"] == str(len(chunks[0][1]))
+
+    response_head = api_client_with_credentials.head(session_url)
+    assert response_head.status_code == 200
+    assert response_head.headers["Upload-Offset"] == str(len(chunks[0][1]))
+
+    # Sending the missing chunk completes the upload
+    response_chunk = send_chunk(*chunks[1])
+    print(f"Response: {response_chunk.data}")
+    assert response_chunk.status_code == 201
+    assert response_chunk.headers["Upload-Offset"] == str(content_size)
+
+    file_object = DataFile.objects.get(
+        file_name=response_chunk.data["uploaded_files"][0]["file_name"])
+    file_path = file_object.full_path()
+
+    assert file_object.original_name == "test_file_session.jpeg"
+    assert get_md5(file_path) == checksum
+
+    # delete the object and clear the file
+    response_delete = api_client_with_credentials.delete(
+        f"/api/datafile/{file_object.pk}/", format="json")
+    assert response_delete.status_code == 204
+    assert not os.path.exists(file_path)
+
+
+@pytest.mark.django_db
+def test_check_existing_datafile(api_client_with_credentials):
+    """
+    Test: Are existing original names found, and scoped to a device when one is given.
+    """
+    user = api_client_with_credentials.handler._force_user
+
+    data_file_1 = DataFileFactory(original_name="IMG_0001.JPG")
+    data_file_2 = DataFileFactory(original_name="IMG_0002.JPG")
+    data_file_1.deployment.viewers.add(user)
+    data_file_2.deployment.viewers.add(user)
+
+    api_url = '/api/datafile/check_existing/'
+    original_names = ["IMG_0001.JPG", "IMG_0002.JPG", "IMG_0003.JPG"]
+
+    response_all = api_client_with_credentials.post(
+        api_url, data={"original_names": original_names}, format="json")
+    print(f"Response: {response_all.data}")
+    assert response_all.status_code == 200
+    assert response_all.data == ["IMG_0003.JPG"]
+
+    response_device = api_client_with_credentials.post(
+        api_url, data={"original_names": original_names,
+                       "device_ID": data_file_1.deployment.device.pk}, format="json")
+    print(f"Response: {response_device.data}")
+    assert response_device.status_code == 200
+    assert response_device.data == ["IMG_0002.JPG", "IMG_0003.JPG"]
+
+    response_file_names = api_client_with_credentials.post(
+        api_url, data={"file_names": [data_file_1.file_name, "not_a_file"]}, format="json")
+    assert response_file_names.data == ["not_a_file"]
+
+    data_file_1.delete()
+    data_file_2.delete()
+
+
+@pytest.mark.django_db
+def test_async_ingest_datafile(api_client_with_credentials):
+    """
+    Test: Is an upload accepted for background processing staged, and registered when the job runs.
+    """
+    user = api_client_with_credentials.handler._force_user
+
+    # Generate a file
+    temp = BytesIO()
+    test_image = create_image()
+    test_image.save(temp, format="JPEG")
+    temp.name = "test_file_async.jpeg"
+    temp.seek(0)
+
+    new_item = DeploymentFactory(
+        owner=user, deployment_start=dt(1066, 1, 1, 0, 0, 0))
+
+    api_url = '/api/datafile/'
+    payload = {
+        "deployment": new_item.deployment_device_ID,
+        "files": [temp],
+        "recording_dt": [dt(1066, 1, 2, 0, 0, 0)],
+        "async_ingest": True
+    }
+
+    response_create = api_client_with_credentials.post(
+        api_url, data=payload,  format='multipart')
+    print(f"Response: {response_create.data}")
+    assert response_create.status_code == 202
+    assert response_create.data["status"] == "Accepted"
+
+    # The Celery task is only sent on commit, so run the job here
+    ingest_job = IngestJob.objects.get(job_id=response_create.data["job_id"])
+    assert not DataFile.objects.filter(
+        original_name="test_file_async.jpeg").exists()
+    run_ingest_job(ingest_job)
+    assert not os.path.exists(ingest_job.staging_dir())
+
+    response_status = api_client_with_credentials.get(
+        f"{api_url}ingest/{ingest_job.job_id}/", format="json")
+    print(f"Response: {response_status.data}")
+    assert response_status.status_code == 200
+    assert response_status.data["status"] == "Complete"
+    assert response_status.data["result"]["status_code"] == 201
+
+    file_object = DataFile.objects.get(
+        pk=response_status.data["uploaded_files"][0]["id"])
+    file_path = file_object.full_path()
+    assert os.path.exists(file_path)
+
+    # delete the object and clear the file
+    response_delete = api_client_with_credentials.delete(
+        f"{api_url}{file_object.pk}/", format="json")
+    assert response_delete.status_code == 204
+    assert not os.path.exists(file_path)
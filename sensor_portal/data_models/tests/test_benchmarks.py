@@ -0,0 +1,334 @@
+"""
+Benchmarks of the upload pipeline.
+
+These are excluded from normal test runs. Run them with `pytest -m benchmark`.
+Each scenario records wall time, database query count and peak RSS, and the results of a run are written as JSON
+to the path in the BENCHMARK_RESULTS environment variable (default `benchmark_results.json`).
+"""
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime as dt
+from datetime import timedelta
+from io import BytesIO
+
+import numpy as np
+import pytest
+from data_models.factories import (DataTypeFactory, DeploymentFactory,
+                                   DeviceFactory, DeviceModelFactory)
+from data_models.file_handling_functions import create_file_objects
+from data_models.general_functions import create_image
+from data_models.models import DataFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as djtimezone
+from PIL import Image
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db]
+
+FILE_COUNTS = [10, 100, 1000]
+API_FILE_COUNTS = [10, 100]
+FIRST_RECORDING_DT = dt(2024, 1, 1, 0, 0, 0)
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the peak RSS of this process, so it can be measured per scenario. Only possible on Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss_kb() -> int:
+    """
+    Get the peak RSS of this process in KB, since it was last reset where possible.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is the peak over the whole process, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    """
+    Collect the results of all scenarios, and write them to a JSON file at the end of the session.
+    """
+    results = []
+    yield results
+
+    results_path = os.environ.get(
+        "BENCHMARK_RESULTS", "benchmark_results.json")
+    with open(results_path, "w") as f:
+        json.dump({"created_on": djtimezone.now().isoformat(),
+                   "python": platform.python_version(),
+                   "scenarios": results}, f, indent=2)
+
+
+@contextmanager
+def measure(benchmark_results, scenario, n_files):
+    """
+    Measure wall time, query count and peak RSS of the code run in this context.
+    """
+    reset_peak_rss()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        yield
+        wall_time = time.perf_counter() - start
+
+    result = {"scenario": scenario,
+              "n_files": n_files,
+              "wall_time_s": wall_time,
+              "query_count": len(queries),
+              "peak_rss_kb": get_peak_rss_kb()}
+    print(result)
+    benchmark_results.append(result)
+
+
+def make_deployment(data_type_name, device_model_name):
+    """
+    Create a deployment of a device of a model that is matched to a data handler.
+    """
+    data_type = DataTypeFactory(name=data_type_name)
+    device_model = DeviceModelFactory(name=device_model_name, type=data_type)
+    device = DeviceFactory(model=device_model, type=data_type)
+    return DeploymentFactory(device=device,
+                             device_type=data_type,
+                             deployment_start=FIRST_RECORDING_DT -
+                             timedelta(days=1),
+                             deployment_end=None)
+
+
+def make_jpegs(n_files, prefix="IMG"):
+    """
+    Generate JPEGs with an EXIF recording datetime, one minute apart.
+    """
+    base_image = create_image(64, 64)
+    jpegs = []
+    for i in range(n_files):
+        exif = Image.Exif()
+        # DateTime
+        exif[306] = (FIRST_RECORDING_DT + timedelta(minutes=i)
+                     ).strftime('%Y:%m:%d %H:%M:%S')
+        temp = BytesIO()
+        base_image.save(temp, format="JPEG", exif=exif.tobytes())
+        jpegs.append((f"{prefix}_{i:05d}.JPG", temp.getvalue()))
+    return jpegs
+
+
+def make_snyper_reports(n_files):
+    """
+    Generate Snyper 4G daily report text files.
+    """
+    reports = []
+    for i in range(n_files):
+        report_dt = FIRST_RECORDING_DT + timedelta(days=i)
+        content = (f"Date:{report_dt.strftime('%d/%m/%Y %H:%M:%S')}\n"
+                   "Battery:100%\n"
+                   "Signal:31\n"
+                   "Temperature:20C\n"
+                   "SD:29.5GB/29.7GB\n")
+        reports.append((f"report_{i:05d}.txt", content.encode("utf-8")))
+    return reports
+
+
+def make_bugg_mp3s(n_files):
+    """
+    Generate one second BUGG MP3 recordings, named by their recording datetime.
+    """
+    soundfile = pytest.importorskip("soundfile")
+    if "MP3" not in soundfile.available_formats():
+        pytest.skip("libsndfile was built without MP3 support")
+
+    sample_rate = 16000
+    samples = np.sin(np.linspace(0, 440 * 2 * np.pi, sample_rate)) * 0.1
+    temp = BytesIO()
+    soundfile.write(temp, samples, sample_rate, format="MP3")
+    content = temp.getvalue()
+
+    mp3s = []
+    for i in range(n_files):
+        recording_dt = FIRST_RECORDING_DT + timedelta(minutes=i)
+        mp3s.append(
+            (f"{recording_dt.strftime('%Y-%m-%dT%H_%M_%S')}.mp3", content))
+    return mp3s
+
+
+def to_uploaded_files(file_contents):
+    """
+    Wrap generated files as they would arrive in `create_file_objects`.
+    """
+    return [SimpleUploadedFile(name, content) for name, content in file_contents]
+
+
+def to_named_bytes(file_contents):
+    """
+    Wrap generated files as they would be posted to the API.
+    """
+    named_files = []
+    for name, content in file_contents:
+        temp = BytesIO(content)
+        temp.name = name
+        named_files.append(temp)
+    return named_files
+
+
+@pytest.fixture
+def clean_datafiles():
+    """
+    Remove files written by a scenario. The database is rolled back, but files on disk are not.
+    """
+    yield
+    for data_file in DataFile.objects.all():
+        data_file.delete()
+
+
+@pytest.mark.parametrize("n_files", FILE_COUNTS)
+def test_benchmark_create_file_objects_jpeg(benchmark_results, clean_datafiles, n_files):
+    """
+    Benchmark: `create_file_objects` with camera trap JPEGs, matched to the deployment by EXIF datetime.
+    """
+    deployment = make_deployment("wildlifecamera", "default")
+    files = to_uploaded_files(make_jpegs(n_files))
+
+    with measure(benchmark_results, "create_file_objects_jpeg", n_files):
+        uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+            files, check_filename=True, device_object=deployment.device)
+
+    assert len(uploaded_files) == n_files, invalid_files
+
+
+@pytest.mark.parametrize("n_files", FILE_COUNTS)
+def test_benchmark_create_file_objects_snyper_report(benchmark_results, clean_datafiles, n_files):
+    """
+    Benchmark: `create_file_objects` with Snyper 4G daily report text files.
+    """
+    deployment = make_deployment("wildlifecamera", "4G Wide Pro")
+    files = to_uploaded_files(make_snyper_reports(n_files))
+
+    with measure(benchmark_results, "create_file_objects_snyper_report", n_files):
+        uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+            files, check_filename=True, device_object=deployment.device)
+
+    assert len(uploaded_files) == n_files, invalid_files
+
+
+@pytest.mark.parametrize("n_files", FILE_COUNTS)
+def test_benchmark_create_file_objects_bugg_mp3(benchmark_results, clean_datafiles, n_files):
+    """
+    Benchmark: `create_file_objects` with BUGG MP3 recordings.
+    """
+    deployment = make_deployment("audio", "BUGG")
+    files = to_uploaded_files(make_bugg_mp3s(n_files))
+
+    with measure(benchmark_results, "create_file_objects_bugg_mp3", n_files):
+        uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+            files, check_filename=True, device_object=deployment.device)
+
+    assert len(uploaded_files) == n_files, invalid_files
+
+
+@pytest.mark.parametrize("n_files", API_FILE_COUNTS)
+def test_benchmark_api_create_jpeg(api_client_with_credentials, benchmark_results, clean_datafiles, n_files):
+    """
+    Benchmark: `DataFileViewSet.create` with camera trap JPEGs, including request parsing and serialization.
+    """
+    user = api_client_with_credentials.handler._force_user
+    deployment = make_deployment("wildlifecamera", "default")
+    deployment.owner = user
+    deployment.save()
+
+    payload = {
+        "deployment": deployment.deployment_device_ID,
+        "files": to_named_bytes(make_jpegs(n_files)),
+    }
+
+    with measure(benchmark_results, "api_create_jpeg", n_files):
+        response_create = api_client_with_credentials.post(
+            '/api/datafile/', data=payload, format='multipart')
+
+    assert response_create.status_code == 201
+    assert len(response_create.data["uploaded_files"]) == n_files
+
+
+def test_benchmark_api_multipart_chunked(api_client_with_credentials, benchmark_results, clean_datafiles):
+    """
+    Benchmark: A 5 MB JPEG uploaded in 1 MB chunks through the Content-Range multipart mode.
+    """
+    user = api_client_with_credentials.handler._force_user
+    deployment = make_deployment("wildlifecamera", "default")
+    deployment.owner = user
+    deployment.save()
+
+    name, content = make_jpegs(1, prefix="LARGE")[0]
+    # Pad after the end of the image to make a large file
+    content = content + os.urandom(5 * 1024 * 1024 - len(content))
+    content_size = len(content)
+    chunk_size = 1024 * 1024
+    n_chunks = math.ceil(content_size / chunk_size)
+
+    checksum = hashlib.md5(content).hexdigest()
+
+    with measure(benchmark_results, "api_multipart_chunked", 1):
+        for i in range(n_chunks):
+            total_offset = min((i + 1) * chunk_size, content_size)
+            chunk_file = BytesIO(content[i * chunk_size:total_offset])
+            chunk_file.name = name
+            extra_data = {}
+            if total_offset == content_size:
+                extra_data["md5_checksum"] = checksum
+            payload = {
+                "deployment": deployment.deployment_device_ID,
+                "files": [chunk_file],
+                "extra_data": [json.dumps(extra_data)],
+            }
+            response_create = api_client_with_credentials.post(
+                '/api/datafile/', data=payload, format='multipart',
+                headers={'Content-Range': f'bytes {total_offset}/{content_size}'})
+
+    assert response_create.status_code == 200
+
+
+def test_benchmark_api_upload_session(api_client_with_credentials, benchmark_results, clean_datafiles):
+    """
+    Benchmark: A 5 MB JPEG uploaded in 1 MB chunks through a resumable upload session.
+    """
+    user = api_client_with_credentials.handler._force_user
+    deployment = make_deployment("wildlifecamera", "default")
+    deployment.owner = user
+    deployment.save()
+
+    name, content = make_jpegs(1, prefix="LARGE")[0]
+    content = content + os.urandom(5 * 1024 * 1024 - len(content))
+    content_size = len(content)
+    chunk_size = 1024 * 1024
+
+    with measure(benchmark_results, "api_upload_session", 1):
+        response_start = api_client_with_credentials.post(
+            '/api/datafile/upload_session/',
+            data={"deployment": deployment.deployment_device_ID,
+                  "original_name": name,
+                  "expected_size": content_size},
+            format='json')
+        session_url = f"/api/datafile/upload_session/{response_start.data['session_id']}/"
+        for start in range(0, content_size, chunk_size):
+            chunk = content[start:start + chunk_size]
+            response_chunk = api_client_with_credentials.patch(
+                session_url, data=chunk, content_type='application/octet-stream',
+                headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{content_size}'})
+
+    assert response_chunk.status_code == 201
@@ -0,0 +1,65 @@
+import io
+
+import pytest
+from data_handlers.functions import open_exif, read_exif_segment
+from data_models.general_functions import create_image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import ExifTags, Image
+
+
+@pytest.fixture
+def exif_jpeg():
+    """
+    Bytes of a JPEG with EXIF tags.
+    """
+    image = create_image(image_width=50, image_height=50)
+    exif = image.getexif()
+    exif[0x010F] = "Test make"
+    exif[0x0110] = "Test model"
+    exif[0x0132] = "2024:05:06 07:08:09"
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="JPEG", exif=exif)
+    return image_bytes.getvalue()
+
+
+def test_open_exif_jpeg(exif_jpeg):
+    """
+    Test: Does reading only the EXIF segment of a JPEG give the same tags as opening the image?
+    """
+    with Image.open(io.BytesIO(exif_jpeg)) as image:
+        expected_exif = {ExifTags.TAGS[k]: v for k,
+                         v in image.getexif().items() if k in ExifTags.TAGS}
+
+    image_exif = open_exif(SimpleUploadedFile("test.jpg", exif_jpeg))
+
+    assert image_exif == expected_exif
+    assert image_exif["Model"] == "Test model"
+    assert image_exif["DateTime"] == "2024:05:06 07:08:09"
+
+
+def test_read_exif_segment_fill_bytes(exif_jpeg):
+    """
+    Test: Are 0xFF fill bytes before a marker skipped?
+    """
+    exif_segment = read_exif_segment(io.BytesIO(exif_jpeg))
+    filled_jpeg = exif_jpeg[:2] + b"\xff\xff\xff" + exif_jpeg[2:]
+
+    assert exif_segment is not None
+    assert read_exif_segment(io.BytesIO(filled_jpeg)) == exif_segment
+
+
+def test_read_exif_segment_invalid_length():
+    """
+    Test: Is a segment length shorter than the length field itself rejected, rather than read to the end?
+    """
+    invalid_jpeg = b"\xff\xd8\xff\xe1\x00\x01Exif\x00\x00" + b"\x00" * 100
+
+    assert read_exif_segment(io.BytesIO(invalid_jpeg)) is None
+
+
+def test_open_exif_invalid(exif_jpeg):
+    """
+    Test: Are no tags returned for files that are not images, or are truncated?
+    """
+    assert open_exif(SimpleUploadedFile("test.txt", b"not an image")) == {}
+    assert open_exif(SimpleUploadedFile("test.jpg", exif_jpeg[:30])) == {}
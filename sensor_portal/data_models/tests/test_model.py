@@ -1,15 +1,27 @@
 import datetime
+import os
 from datetime import timedelta
+from io import BytesIO
 
 import pytest
 from data_models.factories import (DataFileFactory, DataTypeFactory,
                                    DeploymentFactory, DeviceFactory,
                                    DeviceModelFactory, ProjectFactory,
                                    SiteFactory)
+from data_models.file_handling_functions import (clean_local_files,
+                                                 create_file_objects,
+                                                 group_files_by_size,
+                                                 validate_new_datafiles)
+from data_models.general_functions import create_image
+from data_models.models import DataFile, DataFileNameCounter
 from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.utils import timezone as djtimezone
+from PIL import Image
+from user_management.factories import UserFactory
 
 
 @pytest.mark.django_db
@@ -87,6 +99,32 @@ def test_deployment_from_date():
     assert new_device.deployment_from_date("1067-06-06") == deployment_2
     assert new_device.deployment_from_date("1068-06-06") == deployment_3
 
+
+@pytest.mark.django_db
+def test_deployments_for_dates():
+    """
+    Test: Does the `deployments_for_dates` function match deployments in bulk?
+    """
+
+    new_device = DeviceFactory(type=None)
+    deployment_1 = DeploymentFactory(device_type=None,
+                                     device=new_device,
+                                     deployment_start=datetime.datetime(
+                                         1066, 1, 1),
+                                     deployment_end=datetime.datetime(1066, 12, 31))
+    deployment_2 = DeploymentFactory(device_type=None,
+                                     device=new_device,
+                                     deployment_start=datetime.datetime(
+                                         1068, 1, 1),
+                                     deployment_end=None)
+
+    dt_list = ["1066-06-06", "1067-06-06", None,
+               datetime.datetime(1068, 6, 6), "1066-07-07"]
+    result = new_device.deployments_for_dates(dt_list)
+
+    assert result == [deployment_1, None, None, deployment_2, deployment_1]
+    assert result == [new_device.deployment_from_date(x) for x in dt_list]
+
 # DO A VERSION OF THIS TEST WITH TIME ZONES
 
 
@@ -254,3 +292,171 @@ def test_file_in_deployment():
         DataFileFactory(recording_dt=datetime.datetime(
             1068, 1, 1),
             deployment=new_deployment)
+
+
+@pytest.mark.django_db
+def test_file_name_counter_reserve():
+    """
+    Test: Are contiguous, non-overlapping blocks of file numbers reserved?
+    """
+    new_deployment = DeploymentFactory(device_type=None)
+    file_type = new_deployment.device_type
+    upload_date = djtimezone.now().date()
+
+    first_block = DataFileNameCounter.reserve_numbers(
+        file_type, new_deployment, upload_date, 3)
+    second_block = DataFileNameCounter.reserve_numbers(
+        file_type, new_deployment, upload_date, 2)
+    next_day_block = DataFileNameCounter.reserve_numbers(
+        file_type, new_deployment, upload_date + timedelta(days=1))
+
+    assert first_block == 1
+    assert second_block == 4
+    assert next_day_block == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_file_name_counter_reserve_outside_transaction(monkeypatch):
+    """
+    Test: Are file numbers reserved before the upload transaction starts, so that the counter is not locked
+    while the files are written?
+    """
+    data_type = DataTypeFactory(name="wildlifecamera")
+    device_model = DeviceModelFactory(name="default", type=data_type)
+    device = DeviceFactory(model=device_model, type=data_type)
+    first_recording_dt = datetime.datetime(2024, 1, 1, 0, 0, 0)
+    DeploymentFactory(device=device, device_type=data_type,
+                      deployment_start=first_recording_dt - timedelta(days=1), deployment_end=None)
+
+    files = []
+    for i in range(2):
+        exif = Image.Exif()
+        # DateTime
+        exif[306] = (first_recording_dt + timedelta(minutes=i)
+                     ).strftime('%Y:%m:%d %H:%M:%S')
+        temp = BytesIO()
+        create_image(64, 64).save(temp, format="JPEG", exif=exif.tobytes())
+        files.append(SimpleUploadedFile(f"IMG_{i}.JPG", temp.getvalue()))
+
+    reserve_numbers = DataFileNameCounter.reserve_numbers.__func__
+    reserved_in_transaction = []
+
+    def record_reserve_numbers(cls, *args, **kwargs):
+        reserved_in_transaction.append(connection.in_atomic_block)
+        return reserve_numbers(cls, *args, **kwargs)
+
+    monkeypatch.setattr(DataFileNameCounter, "reserve_numbers",
+                        classmethod(record_reserve_numbers))
+
+    uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+        files, check_filename=True, device_object=device)
+
+    assert len(uploaded_files) == 2, invalid_files
+    assert reserved_in_transaction == [False]
+    assert sorted(x.file_name[-3:] for x in uploaded_files) == ["(1)", "(2)"]
+
+    for uploaded_file in uploaded_files:
+        uploaded_file.delete()
+
+
+@pytest.mark.django_db
+def test_validate_new_datafiles():
+    """
+    Test: Does the batch validator catch existing names, repeated names and over-long fields?
+    """
+    existing_file = DataFileFactory(file_name="existing_name")
+    deployment = existing_file.deployment
+
+    new_files = [
+        DataFileFactory.build(file_name="new_name_1", deployment=deployment),
+        DataFileFactory.build(file_name="existing_name",
+                              deployment=deployment),
+        DataFileFactory.build(file_name="repeated_name",
+                              deployment=deployment),
+        DataFileFactory.build(file_name="repeated_name",
+                              deployment=deployment),
+        DataFileFactory.build(file_name="new_name_2", file_format=".too_long_format",
+                              deployment=deployment),
+    ]
+
+    errors = validate_new_datafiles(new_files)
+
+    assert errors[0] is None
+    assert "file_name" in errors[1].message_dict
+    assert "file_name" in errors[2].message_dict
+    assert "file_name" in errors[3].message_dict
+    assert list(errors[4].message_dict.keys()) == ["file_format"]
+
+    existing_file.delete()
+
+
+@pytest.mark.django_db
+def test_group_files_by_size():
+    """
+    Test: Are files grouped in date order, without leaving a group below the minimum size where it can be avoided?
+    """
+    new_deployment = DeploymentFactory(device_type=None,
+                                       deployment_start=datetime.datetime(
+                                           1066, 1, 1),
+                                       deployment_end=datetime.datetime(1066, 12, 31))
+    file_sizes = [5, 5, 5, 5, 1]
+    new_files = [DataFileFactory(file_name=f"group_file_{i}",
+                                 file_size=file_size,
+                                 deployment=new_deployment,
+                                 recording_dt=datetime.datetime(1066, 1, i+1, tzinfo=djtimezone.utc))
+                 for i, file_size in enumerate(file_sizes)]
+    file_objs = DataFile.objects.filter(pk__in=[x.pk for x in new_files])
+    new_pks = [x.pk for x in new_files]
+
+    # Sizes are in GB, so use sizes of single bytes
+    one_byte_gb = 1 / (1024 * 1024 * 1024)
+
+    groups = group_files_by_size(file_objs, max_size=10 * one_byte_gb)
+    assert [x["file_pks"] for x in groups] == [
+        new_pks[0:2], new_pks[2:4], new_pks[4:5]]
+
+    groups = group_files_by_size(
+        file_objs, max_size=10 * one_byte_gb, min_size=2 * one_byte_gb)
+    assert [x["file_pks"] for x in groups] == [
+        new_pks[0:2], new_pks[2:3], new_pks[3:5]]
+
+    for new_file in new_files:
+        new_file.delete()
+
+
+@pytest.mark.django_db
+def test_clean_local_files():
+    """
+    Test: Are archived files removed from local storage in bulk, leaving protected files?
+    """
+    new_deployment = DeploymentFactory(device_type=None)
+    clean_file = DataFileFactory(
+        file_name="clean_file", deployment=new_deployment, archived=True)
+    unarchived_file = DataFileFactory(
+        file_name="unarchived_file", deployment=new_deployment)
+    do_not_remove_file = DataFileFactory(
+        file_name="do_not_remove_file", deployment=new_deployment, archived=True, do_not_remove=True)
+    favourite_file = DataFileFactory(
+        file_name="favourite_file", deployment=new_deployment, archived=True)
+    favourite_file.favourite_of.add(UserFactory())
+    new_files = [clean_file, unarchived_file,
+                 do_not_remove_file, favourite_file]
+    clean_file_path = clean_file.full_path()
+
+    n_cleaned = clean_local_files(DataFile.objects.filter(
+        pk__in=[x.pk for x in new_files]))
+
+    assert n_cleaned == 1
+    assert not os.path.exists(clean_file_path)
+    clean_file.refresh_from_db()
+    assert clean_file.local_storage is False
+    assert clean_file.local_path == ""
+    for protected_file in new_files[1:]:
+        protected_file.refresh_from_db()
+        assert protected_file.local_storage is True
+        assert os.path.exists(protected_file.full_path())
+
+    for new_file in new_files:
+        new_file.archived = False
+        new_file.save()
+        new_file.delete()
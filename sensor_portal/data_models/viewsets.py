@@ -6,7 +6,8 @@ from camtrap_dp_export.querysets import (get_ctdp_deployment_qs,
 from camtrap_dp_export.serializers import (DataFileSerializerCTDP,
                                            DeploymentSerializerCTDP)
 from django.conf import settings
-from django.db import connection, transaction
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_cookie
@@ -25,20 +26,24 @@ from utils.viewsets import (AddOwnerViewSetMixIn, CheckAttachmentViewSetMixIn,
                             CheckFormViewSetMixIn,
                             OptionalPaginationViewSetMixIn)
 
-from .file_handling_functions import create_file_objects
+from .file_handling_functions import (complete_upload_session,
+                                     create_file_objects, find_existing_names,
+                                     parse_content_range, stage_ingest_job,
+                                     write_upload_session_chunk)
 from .filtersets import (DataFileFilter, DataTypeFilter, DeploymentFilter,
                          DeviceFilter, DeviceModelFilter, ProjectFilter)
 from .job_handling_functions import start_job_from_name
 from .models import (DataFile, DataType, Deployment, Device, DeviceModel,
-                     Project, Site)
+                     IngestJob, Project, Site, UploadSession)
 from .permissions import perms
 from .plotting_functions import get_all_file_metric_dicts
 from .serializers import (DataFileCheckSerializer, DataFileSerializer,
                           DataFileUploadSerializer, DataTypeSerializer,
                           DeploymentSerializer, DeploymentSerializer_GeoJSON,
                           DeviceModelSerializer, DeviceSerializer,
-                          GenericJobSerializer, ProjectSerializer,
-                          SiteSerializer)
+                          GenericJobSerializer, IngestJobSerializer,
+                          ProjectSerializer, SiteSerializer,
+                          UploadSessionSerializer)
 from .serializers_fake import (DummyDataFileSerializer,
                                DummyDataFileUploadSerializer,
                                DummyDeploymentSerializer,
@@ -49,6 +54,7 @@ from .serializers_fake import (DummyDataFileSerializer,
                                inline_job_start_serializer,
                                inline_metric_serialiser,
                                inline_upload_response_serializer)
+from .tasks import ingest_files
 
 logger = logging.getLogger(__name__)
 
@@ -660,6 +666,32 @@ class DeviceViewSet(AddOwnerViewSetMixIn, OptionalPaginationViewSetMixIn):
                                        parameters=[
                                            ctdp_parameter,
                                        ]),
+    ingest_job=extend_schema(summary="Background upload status",
+                             description="Get the status of an upload accepted with 'async_ingest', and the datafiles"
+                             " it created once complete.",
+                             responses=IngestJobSerializer,
+                             parameters=[
+                                 OpenApiParameter(
+                                     "job_id",
+                                     OpenApiTypes.UUID,
+                                     OpenApiParameter.PATH,
+                                     description="ID of ingest job.")]),
+    upload_session=extend_schema(summary="Start a resumable upload",
+                                 description="Start a session to upload a single large file in chunks.",
+                                 request=UploadSessionSerializer,
+                                 responses=UploadSessionSerializer),
+    upload_session_chunk=extend_schema(summary="Upload session progress and chunks",
+                                       description="GET or HEAD reports the committed offset of an upload session in the"
+                                       " 'Upload-Offset' header. PATCH writes the raw bytes of the request body at the"
+                                       " offset given by a 'Content-Range: bytes <start>-<end>/<total>' header."
+                                       " Once every byte has been received, the file is registered as a datafile.",
+                                       request={"application/octet-stream": OpenApiTypes.BINARY},
+                                       parameters=[
+                                           OpenApiParameter(
+                                               "session_id",
+                                               OpenApiTypes.UUID,
+                                               OpenApiParameter.PATH,
+                                               description="ID of upload session.")]),
     favourite_file=extend_schema(exclude=True),
     observations=extend_schema(exclude=True)
 )
@@ -691,6 +723,12 @@ class DataFileViewSet(CheckAttachmentViewSetMixIn, OptionalPaginationViewSetMixI
             Returns the appropriate serializer class based on the action and request parameters.
         create(request, *args, **kwargs):
             Handles the creation of new DataFile objects, including file uploads and validation.
+        ingest_job(request, job_id=None):
+            Custom action to get the status of an upload accepted for background processing.
+        upload_session(request, *args, **kwargs):
+            Custom action to start a resumable upload session for a single large file.
+        upload_session_chunk(request, session_id=None):
+            Custom action to report the committed offset of an upload session, or write a chunk to it.
         deployment_datafiles(request, deployment_pk=None):
             Custom action to retrieve DataFile objects associated with a specific deployment.
         project_datafiles(request, project_id=None):
@@ -733,8 +771,9 @@ class DataFileViewSet(CheckAttachmentViewSetMixIn, OptionalPaginationViewSetMixI
 
     @action(detail=False, methods=['post'], pagination_class=None)
     def check_existing(self, request, *args, **kwargs):
+        # Only names are needed, so skip the prefetching and distinct of the default queryset
         queryset = perms['data_models.view_datafile'].filter(
-            request.user, self.get_queryset())
+            request.user, DataFile.objects.all())
 
         serializer = DataFileCheckSerializer(data=request.data)
         if not serializer.is_valid():
@@ -746,18 +785,19 @@ class DataFileViewSet(CheckAttachmentViewSetMixIn, OptionalPaginationViewSetMixI
                 filter_params, queryset=queryset)
             queryset = queryfilter.qs
 
+        device_object = serializer.validated_data.get('device_object')
+
         if (original_names := serializer.validated_data.get('original_names')):
-            existing_names = queryset.filter(
-                original_name__in=original_names).values_list('original_name', flat=True)
-            existing_names = list(existing_names)
+            existing_names = find_existing_names(
+                original_names, "original_name", device_object, queryset)
             missing_names = [
                 x for x in original_names if x not in existing_names]
 
         elif (file_names := serializer.validated_data.get('file_names')):
-            existing_names = queryset.filter(
-                file_name__in=file_names).values_list('file_name', flat=True)
+            existing_names = find_existing_names(
+                file_names, "file_name", device_object, queryset)
             missing_names = [
-                x for x in original_names if x not in existing_names]
+                x for x in file_names if x not in existing_names]
         else:
             return Response({"detail": "Either 'original_names' or 'file_names' must be provided."},
                             status=status.HTTP_400_BAD_REQUEST)
@@ -850,12 +890,19 @@ class DataFileViewSet(CheckAttachmentViewSetMixIn, OptionalPaginationViewSetMixI
 
         multipart = 'HTTP_CONTENT_RANGE' in request.META
 
-        with transaction.atomic(), connection.cursor() as cursor:
-            # Remove db limits during this function.
-            cursor.execute('SET LOCAL statement_timeout TO 0;')
-            uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+        if instance.get('async_ingest') and not multipart:
+            # Only stage the files here, and register them in the background
+            ingest_job = stage_ingest_job(
                 files, check_filename, recording_dt, extra_data, deployment_object, device_object,
-                data_types, self.request.user, multipart)
+                data_types, self.request.user)
+            transaction.on_commit(lambda: ingest_files.delay(ingest_job.pk))
+            return Response(IngestJobSerializer(ingest_job).data,
+                            status=status.HTTP_202_ACCEPTED, headers=headers)
+
+        # Runs its own transaction, once file numbers have been reserved
+        uploaded_files, invalid_files, existing_files, status_code = create_file_objects(
+            files, check_filename, recording_dt, extra_data, deployment_object, device_object,
+            data_types, self.request.user, multipart)
 
         logger.info(
             f"Uploaded files: {uploaded_files}, Invalid files: {invalid_files}, Existing files: {existing_files}, Status code: {status_code}")
@@ -868,6 +915,90 @@ class DataFileViewSet(CheckAttachmentViewSetMixIn, OptionalPaginationViewSetMixI
         return Response({"uploaded_files": uploaded_files, "invalid_files": invalid_files, "existing_files": existing_files},
                         status=status_code, headers=headers)
 
+    @action(detail=False, methods=['get'], url_path=r'ingest/(?P<job_id>[0-9a-f-]+)', url_name="ingest_job",
+            pagination_class=None)
+    def ingest_job(self, request, job_id=None):
+        try:
+            ingest_job = IngestJob.objects.get(
+                job_id=job_id, owner=request.user)
+        except (IngestJob.DoesNotExist, ValueError, ValidationError):
+            return Response({"detail": "Ingest job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        data = IngestJobSerializer(ingest_job).data
+        if uploaded_pks := ingest_job.result.get("uploaded_files"):
+            data["uploaded_files"] = DataFileSerializer(
+                DataFile.objects.filter(pk__in=uploaded_pks), many=True, context={'request': request}).data
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path=r'upload_session', url_name="upload_session",
+            serializer_class=UploadSessionSerializer, pagination_class=None)
+    def upload_session(self, request, *args, **kwargs):
+        serializer = UploadSessionSerializer(
+            data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save(owner=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get', 'patch'], url_path=r'upload_session/(?P<session_id>[0-9a-f-]+)',
+            url_name="upload_session_chunk", serializer_class=UploadSessionSerializer, pagination_class=None,
+            parser_classes=[])
+    def upload_session_chunk(self, request, session_id=None):
+        try:
+            session = UploadSession.objects.get(
+                session_id=session_id, owner=request.user)
+        except (UploadSession.DoesNotExist, ValueError, ValidationError):
+            return Response({"detail": "Upload session not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        def session_response(data, status_code):
+            # Clients resume from the committed offset, which HEAD requests report without a body
+            headers = {"Upload-Offset": str(session.committed_offset),
+                       "Upload-Length": str(session.expected_size)}
+            if session.committed_offset > 0:
+                headers["Range"] = f"bytes=0-{session.committed_offset - 1}"
+            return Response(data, status=status_code, headers=headers)
+
+        if request.method == 'GET':
+            return session_response(UploadSessionSerializer(session).data, status.HTTP_200_OK)
+
+        if session.complete:
+            # Chunks resent after completion are acknowledged without being written
+            return session_response(UploadSessionSerializer(session).data, status.HTTP_200_OK)
+
+        try:
+            start, end, total = parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE', ''))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if total != session.expected_size:
+            return session_response({"detail": f"Content-Range size {total} does not match upload size {session.expected_size}"},
+                                    status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        if request.stream is None:
+            return session_response({"detail": "Empty chunk."}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            write_upload_session_chunk(session, start, end, request.stream)
+        except ValueError as e:
+            return session_response({"detail": str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        if session.committed_offset < session.expected_size:
+            return session_response(UploadSessionSerializer(session).data, status.HTTP_200_OK)
+
+        # Registers the file in its own transaction, once its file number has been reserved
+        uploaded_files, invalid_files, existing_files, status_code = complete_upload_session(
+            session)
+
+        if len(uploaded_files) > 0:
+            returned_data = DataFileSerializer(data=uploaded_files, many=True)
+            returned_data.is_valid()
+            uploaded_files = returned_data.data
+
+        return session_response({"session": UploadSessionSerializer(session).data,
+                                 "uploaded_files": uploaded_files, "invalid_files": invalid_files,
+                                 "existing_files": existing_files},
+                                status_code)
+
     @action(detail=False, methods=['get'], url_path=r'deployment/(?P<deployment_pk>\w+)', url_name="deployment_datafiles")
     def deployment_datafiles(self, request, deployment_pk=None):
         # Filter data files based on the deployment primary key (deployment_pk)
@@ -349,6 +349,22 @@ CELERY_BEAT_SCHEDULE = {
         "task": "data_models.tasks.clean_all_files",
         "schedule": crontab(hour="1", minute="0"),
     },
+    "clean_upload_sessions": {
+        "task": "data_models.tasks.clean_upload_sessions",
+        "schedule": crontab(hour="2", minute="0"),
+    },
+    "schedule_restores": {
+        "task": "archiving.tasks.schedule_restores_task",
+        "schedule": crontab(minute="*/5"),
+    },
+    "evict_preprocessed_images": {
+        "task": "ai_integration.tasks.evict_preprocessed_images_task",
+        "schedule": crontab(minute="30", hour="*"),
+    },
+    "rebuild_archive_ledger": {
+        "task": "archiving.tasks.rebuild_archive_ledger_task",
+        "schedule": crontab(hour="3", minute="0"),
+    },
 }
 
 if not DEVMODE:
@@ -365,8 +381,36 @@ GLOBAL_PROJECT_ID = os.environ.get("GLOBAL_PROJECT_ID", "GLOBAL")
 # Automatically generated collection of data handlers.
 DATA_HANDLERS = DataTypeHandlerCollection()
 
+# Number of threads used to run data handlers over the files of an upload.
+DATA_HANDLER_THREADS = int(os.environ.get("DATA_HANDLER_THREADS", 4))
+
+# Maximum number of bytes to search for the EXIF segment of a JPEG before falling back to opening the image.
+DATA_HANDLER_EXIF_MAX_BYTES = 256 * 1024
+
+# Size in bytes of the buffer used when writing uploaded files to storage.
+FILE_INGEST_BUFFER_SIZE = 1024 * 1024
+
+# Also store a SHA-256 checksum of uploaded files in their extra data.
+FILE_INGEST_SHA256 = os.environ.get("FILE_INGEST_SHA256") is not None
+
+# Uploads written to a temporary file on the same filesystem as FILE_STORAGE_ROOT are moved into place rather than copied.
+FILE_UPLOAD_TEMP_DIR = os.environ.get("FILE_UPLOAD_TEMP_DIR")
+
+# Directory in which resumable upload sessions stage their chunks.
+# Kept inside FILE_STORAGE_ROOT so completed uploads can be moved into place rather than copied.
+UPLOAD_SESSION_ROOT = os.path.join(FILE_STORAGE_ROOT, "upload_sessions")
+
+# Days after which incomplete upload sessions are removed.
+UPLOAD_SESSION_EXPIRY_DAYS = 7
+
+# Directory in which uploads accepted for background processing are staged.
+INGEST_STAGING_ROOT = os.path.join(FILE_STORAGE_ROOT, "ingest_staging")
+
 ONLY_SUPER_UNARCHIVE = False
 
+# Number of threads used to remove archived files from local storage.
+FILE_CLEAN_THREADS = int(os.environ.get("FILE_CLEAN_THREADS", 8))
+
 # Maximum number of files that can be submitted to a job through the start_job API endpoint.
 MAX_JOB_SIZE = 5000
 
@@ -376,6 +420,26 @@ MIN_ARCHIVE_SIZE_GB = 1
 # Maximum TAR size in GB when archiving.
 MAX_ARCHIVE_SIZE_GB = 10
 
+# Compression used when writing archive TARs.
+# "pigz" (gzip) and "zstd" compress on multiple cores using their command line tools, "gzip" compresses in-process on one core.
+# Data types with archive_compressed turned off are always written as uncompressed TARs.
+ARCHIVE_COMPRESSION = os.environ.get("ARCHIVE_COMPRESSION", "pigz")
+
+# Number of threads used by "pigz" and "zstd" archive compression.
+ARCHIVE_COMPRESSION_THREADS = int(os.environ.get(
+    "ARCHIVE_COMPRESSION_THREADS", os.cpu_count() or 1))
+
+# Number of TARs uploaded to an archive at once.
+ARCHIVE_UPLOAD_CONCURRENCY = int(
+    os.environ.get("ARCHIVE_UPLOAD_CONCURRENCY", 4))
+
+# Number of times restoring files from a TAR is attempted before the restore requests waiting on it fail.
+ARCHIVE_RESTORE_MAX_ATTEMPTS = 3
+
+# Number of times each command checking the status of a TAR to restore is sent, before the archive is skipped
+# until the next round of restores.
+ARCHIVE_RESTORE_SSH_TRIES = 3
+
 if DEVMODE:
     # Smaller values for testing
     MIN_ARCHIVE_SIZE_GB = 0.01
@@ -398,3 +462,51 @@ EMAIL_USE_SSL = True
 
 # Name of queue to use for ultralytics tasks.
 ULTRALYTICS_QUEUE = 'ultralytics'
+
+# Send the ultralytics worker the pk, path and recording datetime of each file, rather than only its path.
+# The worker must accept these lists and return results keyed by pk before this is set.
+ULTRALYTICS_FILE_IDENTITIES = os.environ.get(
+    "ULTRALYTICS_FILE_IDENTITIES") is not None
+
+# Seconds for which the workers consuming the ultralytics queue are cached, rather than asking the workers each time.
+ULTRALYTICS_QUEUE_CACHE_SECONDS = 60
+
+# Number of inference chunks that can be in flight for each ultralytics worker.
+ULTRALYTICS_CHUNKS_PER_WORKER = int(
+    os.environ.get("ULTRALYTICS_CHUNKS_PER_WORKER", 2))
+
+# Seconds after which inference chunks stop being counted as in flight, if no chunks are dispatched.
+ULTRALYTICS_CHUNK_TIMEOUT = 60 * 60
+
+# Seconds to wait before dispatching more inference chunks, when the workers are at capacity.
+ULTRALYTICS_DISPATCH_RETRY_SECONDS = 30
+
+# Seconds for which the remaining files of an inference job are kept.
+ULTRALYTICS_DISPATCH_TIMEOUT = 7 * 24 * 60 * 60
+
+# Width and height in pixels of the letterboxed images cached for AI inference.
+AI_PREPROCESS_IMAGE_SIZE = int(os.environ.get("AI_PREPROCESS_IMAGE_SIZE", 640))
+
+# Maximum total size in GB of images cached for AI inference, beyond which the least recently used are removed.
+AI_PREPROCESS_CACHE_MAX_GB = float(
+    os.environ.get("AI_PREPROCESS_CACHE_MAX_GB", 50))
+
+# Number of threads used to preprocess images for AI inference.
+AI_PREPROCESS_THREADS = int(os.environ.get(
+    "AI_PREPROCESS_THREADS", os.cpu_count() or 1))
+
+# Directory of ONNX models that can be run locally, saved as <model name>.onnx.
+AI_LOCAL_MODEL_ROOT = os.environ.get(
+    "AI_LOCAL_MODEL_ROOT", os.path.join(BASE_DIR, "ai_models"))
+
+# Run inference locally if the ultralytics queue is not available.
+AI_LOCAL_INFERENCE_FALLBACK = os.environ.get(
+    "AI_LOCAL_INFERENCE_FALLBACK") is not None
+
+# Number of threads running local inference in parallel.
+AI_LOCAL_INFERENCE_THREADS = int(os.environ.get(
+    "AI_LOCAL_INFERENCE_THREADS", os.cpu_count() or 1))
+
+# Number of images in each batch of local inference.
+AI_LOCAL_INFERENCE_BATCH_SIZE = int(
+    os.environ.get("AI_LOCAL_INFERENCE_BATCH_SIZE", 8))
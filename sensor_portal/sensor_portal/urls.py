@@ -28,6 +28,7 @@ urlpatterns = [
     path("api/", include(api)),
     path('api/', include('user_management.urls')),
     path('api/', include('utils.urls')),
+    path('api/', include('archiving.urls')),
     path('api-token-auth/', views.obtain_auth_token),
     path("icon_picker/", include("django_icon_picker.urls")),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -1,7 +1,6 @@
 import hashlib
 import logging
 import os
-import subprocess
 
 logger = logging.getLogger(__name__)
 
@@ -30,34 +29,6 @@ def convert_unit(size_in_bytes: int, unit: str) -> float:
         return size_in_bytes
 
 
-def call_with_output(command: str | list[str], cwd: str = '/', verbose=False) -> tuple[bool, str]:
-    """
-    Calls a shell command and returns its output.
-
-    Args:
-        command (str | list[str]): Command to run, either a string or a list of strings (reccomended)
-        cwd (str, optional): Working directory in which to run the command. Defaults to '/'.
-        verbose (bool, optional): logger.info( command and output to console. Defaults to False.
-    Returns:
-        tuple[bool, str]: success, shell output of command
-    """
-    success = False
-    if verbose:
-        logger.info(command)
-    try:
-        output = subprocess.check_output(
-            command, stderr=subprocess.STDOUT, cwd=cwd).decode()
-        success = True
-    except subprocess.CalledProcessError as e:
-        output = e.output.decode()
-    except Exception as e:
-        # check_call can raise other exceptions, such as FileNotFoundError
-        output = str(e)
-    if verbose:
-        logger.info(output)
-    return (success, output)
-
-
 def get_md5(file_path: str) -> str:
     """
     Get md5 hash of file at file path.
@@ -70,7 +41,8 @@ def get_md5(file_path: str) -> str:
     """
     hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        # Read in large blocks, small reads are slow on network storage
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 